@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Profile, Follow, Category, BlogPost, Comment, Notification
+from .models import Profile, Follow, Category, BlogPost, Comment, Notification, Job
 
 @admin.register(Profile)
 class ProfileAdmin(admin.ModelAdmin):
@@ -19,7 +19,7 @@ class CategoryAdmin(admin.ModelAdmin):
 
 @admin.register(BlogPost)
 class BlogPostAdmin(admin.ModelAdmin):
-    list_display = ('title', 'author', 'category', 'status', 'created_at', 'view_count')
+    list_display = ('title', 'author', 'category', 'status', 'created_at', 'view_count', 'unique_viewers')
     list_filter = ('status', 'created_at', 'category')
     search_fields = ('title', 'content', 'author__username')
     prepopulated_fields = {'title': ('title',)}
@@ -38,3 +38,10 @@ class NotificationAdmin(admin.ModelAdmin):
     list_filter = ('notification_type', 'is_read', 'created_at')
     search_fields = ('recipient__username', 'sender__username')
     date_hierarchy = 'created_at'
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'attempts', 'run_after', 'created_at', 'finished_at')
+    list_filter = ('status', 'name')
+    search_fields = ('name', 'idempotency_key')
+    readonly_fields = ('payload', 'last_error')
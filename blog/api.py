@@ -0,0 +1,301 @@
+from django.contrib.auth.models import User
+from django.db.models import Count, IntegerField, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
+from django.http import JsonResponse
+from django.urls import reverse
+from django.views.decorators.http import require_GET
+
+from .models import BlogPost, Category, Comment, Tag
+from .pagination import cursor_paginate
+
+# Read-only JSON API for posts, comments, profiles, categories and tags.
+#
+# Every resource declares what each field needs from the database: columns
+# for only(), relations for select_related/prefetch_related and count
+# annotations. A request's `fields=` selection is turned into exactly that
+# query plan, so asking for less reads less. Lists use cursor pagination
+# and `ids=` fetches a batch of objects in one query.
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+MAX_IDS = 100
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class Field:
+    def __init__(self, value, only=(), select=(), prefetch=(), annotate=None):
+        self.value = value
+        self.only = only
+        self.select = select
+        self.prefetch = prefetch
+        self.annotate = annotate or {}
+
+
+def _count(through, fk, **filters):
+    # Correlated subquery rather than a JOIN + GROUP BY, so several counts
+    # on the same row do not multiply each other
+    counts = (
+        through.objects.filter(**{fk: OuterRef('pk')}, **filters)
+        .order_by().values(fk).annotate(n=Count('*')).values('n')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def _column(name):
+    return Field(lambda obj: getattr(obj, name), only=(name,))
+
+
+def _user(obj):
+    return {'id': obj.pk, 'username': obj.username}
+
+
+class Resource:
+    def __init__(self, name, queryset, fields, default_fields, detail_key='pk'):
+        self.name = name
+        self.queryset = queryset
+        self.fields = fields
+        self.default_fields = default_fields
+        self.detail_key = detail_key
+
+    def parse_fields(self, value):
+        if not value:
+            return self.default_fields
+        names = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            raise ApiError(f"Unknown field(s) {', '.join(unknown)}; available: {', '.join(self.fields)}")
+        return names
+
+    def plan(self, names):
+        # Build the cheapest queryset that can serialize `names`
+        only = {self.queryset().model._meta.pk.attname}
+        select, prefetch, annotations = set(), [], {}
+        for name in names:
+            field = self.fields[name]
+            only.update(field.only)
+            select.update(field.select)
+            prefetch.extend(field.prefetch)
+            annotations.update(field.annotate)
+
+        queryset = self.queryset()
+        if select:
+            queryset = queryset.select_related(*sorted(select))
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        if annotations:
+            queryset = queryset.annotate(**annotations)
+        return queryset.only(*only)
+
+    def serialize(self, obj, names):
+        return {name: self.fields[name].value(obj) for name in names}
+
+
+POSTS = Resource(
+    'posts',
+    lambda: BlogPost.objects.filter(status='published'),
+    {
+        'id': Field(lambda post: post.pk),
+        'url': Field(lambda post: post.get_absolute_url()),
+        'title': _column('title'),
+        'excerpt': _column('excerpt'),
+        'content': _column('content'),
+        'created_at': _column('created_at'),
+        'updated_at': _column('updated_at'),
+        'view_count': _column('view_count'),
+        'unique_viewers': _column('unique_viewers'),
+        'author': Field(lambda post: _user(post.author), only=('author__username',), select=('author',)),
+        'category': Field(
+            lambda post: post.category.name if post.category else None,
+            only=('category__name',), select=('category',),
+        ),
+        'tags': Field(
+            lambda post: [tag.name for tag in post.tags.all()],
+            prefetch=(Prefetch('tags', queryset=Tag.objects.only('id', 'name').order_by('name')),),
+        ),
+        'likes': Field(lambda post: post.api_likes, annotate={'api_likes': _count(BlogPost.likes.through, 'blogpost_id')}),
+        'dislikes': Field(
+            lambda post: post.api_dislikes, annotate={'api_dislikes': _count(BlogPost.dislikes.through, 'blogpost_id')}
+        ),
+        'comments': Field(lambda post: post.api_comments, annotate={'api_comments': _count(Comment, 'post_id')}),
+    },
+    ['id', 'url', 'title', 'excerpt', 'author', 'category', 'tags', 'created_at'],
+)
+
+COMMENTS = Resource(
+    'comments',
+    lambda: Comment.objects.filter(post__status='published'),
+    {
+        'id': Field(lambda comment: comment.pk),
+        'url': Field(
+            lambda comment: reverse('post_detail', kwargs={'pk': comment.post_id}) + f'#comment-{comment.pk}',
+            only=('post',),
+        ),
+        'post': Field(lambda comment: comment.post_id, only=('post',)),
+        'parent': Field(lambda comment: comment.parent_id, only=('parent',)),
+        'content': _column('content'),
+        'created_at': _column('created_at'),
+        'updated_at': _column('updated_at'),
+        'author': Field(lambda comment: _user(comment.author), only=('author__username',), select=('author',)),
+        'likes': Field(
+            lambda comment: comment.api_likes, annotate={'api_likes': _count(Comment.likes.through, 'comment_id')}
+        ),
+        'dislikes': Field(
+            lambda comment: comment.api_dislikes,
+            annotate={'api_dislikes': _count(Comment.dislikes.through, 'comment_id')},
+        ),
+    },
+    ['id', 'url', 'post', 'parent', 'author', 'content', 'created_at'],
+)
+
+PROFILES = Resource(
+    'profiles',
+    lambda: User.objects.filter(is_active=True),
+    {
+        'id': Field(lambda user: user.pk),
+        'username': _column('username'),
+        'url': Field(lambda user: reverse('user_profile', kwargs={'username': user.username}), only=('username',)),
+        'date_joined': _column('date_joined'),
+        'bio': Field(lambda user: user.profile.bio, only=('profile__bio',), select=('profile',)),
+        'profile_pic': Field(
+            lambda user: user.profile.profile_pic.url, only=('profile__profile_pic',), select=('profile',)
+        ),
+        'followers_count': Field(
+            lambda user: user.profile.followers_count, only=('profile__followers_count',), select=('profile',)
+        ),
+        'following_count': Field(
+            lambda user: user.profile.following_count, only=('profile__following_count',), select=('profile',)
+        ),
+        'posts': Field(
+            lambda user: user.api_posts,
+            annotate={'api_posts': _count(BlogPost, 'author_id', status='published')},
+        ),
+    },
+    ['id', 'username', 'url', 'bio', 'followers_count', 'following_count'],
+    detail_key='username',
+)
+
+CATEGORIES = Resource(
+    'categories',
+    lambda: Category.objects.all(),
+    {
+        'id': Field(lambda category: category.pk),
+        'name': _column('name'),
+        'url': Field(lambda category: category.get_absolute_url(), only=('name',)),
+    },
+    ['id', 'name', 'url'],
+)
+
+TAGS = Resource(
+    'tags',
+    lambda: Tag.objects.all(),
+    {
+        'id': Field(lambda tag: tag.pk),
+        'name': _column('name'),
+        'url': Field(lambda tag: tag.get_absolute_url(), only=('name',)),
+        'post_count': _column('post_count'),
+    },
+    ['id', 'name', 'url', 'post_count'],
+)
+
+
+def _parse_ids(value):
+    try:
+        ids = list(dict.fromkeys(int(pk) for pk in value.split(',') if pk.strip()))
+    except ValueError:
+        raise ApiError('ids must be a comma-separated list of integers')
+    if len(ids) > MAX_IDS:
+        raise ApiError(f'At most {MAX_IDS} ids per request')
+    return ids
+
+
+def _page_size(value):
+    if not value:
+        return DEFAULT_PAGE_SIZE
+    if not (value.isascii() and value.isdigit()) or int(value) < 1:
+        raise ApiError('limit must be a positive integer')
+    return min(int(value), MAX_PAGE_SIZE)
+
+
+def _error_response(error):
+    return JsonResponse({'error': str(error)}, status=error.status)
+
+
+def list_view(resource, filters=None):
+    @require_GET
+    def view(request):
+        try:
+            names = resource.parse_fields(request.GET.get('fields'))
+            queryset = resource.plan(names)
+            if filters:
+                queryset = filters(request, queryset)
+
+            if 'ids' in request.GET:
+                # Batch lookup: one query, results in the order asked for
+                ids = _parse_ids(request.GET['ids'])
+                found = {obj.pk: obj for obj in queryset.filter(pk__in=ids)}
+                return JsonResponse({
+                    'results': [resource.serialize(found[pk], names) for pk in ids if pk in found],
+                    'missing': [pk for pk in ids if pk not in found],
+                })
+
+            page = cursor_paginate(queryset, request.GET.get('cursor'), _page_size(request.GET.get('limit')))
+        except ApiError as error:
+            return _error_response(error)
+
+        next_url = None
+        if page.has_next:
+            params = request.GET.copy()
+            params['cursor'] = page.next_cursor
+            next_url = f'{request.path}?{params.urlencode()}'
+        return JsonResponse({
+            'results': [resource.serialize(obj, names) for obj in page],
+            'next': next_url,
+        })
+    return view
+
+
+def detail_view(resource):
+    @require_GET
+    def view(request, **kwargs):
+        try:
+            names = resource.parse_fields(request.GET.get('fields'))
+            obj = resource.plan(names).filter(**{resource.detail_key: kwargs[resource.detail_key]}).first()
+            if obj is None:
+                raise ApiError(f'No such {resource.name[:-1]}', status=404)
+        except ApiError as error:
+            return _error_response(error)
+        return JsonResponse(resource.serialize(obj, names))
+    return view
+
+
+def _filter_comments(request, queryset):
+    post = request.GET.get('post')
+    if post is not None:
+        if not (post.isascii() and post.isdigit()):
+            raise ApiError('post must be an integer')
+        queryset = queryset.filter(post_id=post)
+    return queryset
+
+
+def _filter_posts(request, queryset):
+    for param, lookup in (('author', 'author__username'), ('category', 'category__name'), ('tag', 'tags__name')):
+        if request.GET.get(param):
+            queryset = queryset.filter(**{lookup: request.GET[param]})
+    return queryset
+
+
+post_list = list_view(POSTS, _filter_posts)
+post_detail = detail_view(POSTS)
+comment_list = list_view(COMMENTS, _filter_comments)
+comment_detail = detail_view(COMMENTS)
+profile_list = list_view(PROFILES)
+profile_detail = detail_view(PROFILES)
+category_list = list_view(CATEGORIES)
+category_detail = detail_view(CATEGORIES)
+tag_list = list_view(TAGS)
+tag_detail = detail_view(TAGS)
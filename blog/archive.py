@@ -0,0 +1,144 @@
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ArchivedComment, ArchivedPost, BlogPost, Comment, Tag, path_step
+from .tag_stats import adjust_post_counts
+
+# Hot/cold archival of old posts.
+#
+# Posts with no edits, comments or reactions since a cutoff are copied,
+# with their comments, into ArchivedPost/ArchivedComment and then deleted
+# from the hot tables. Join-table rows (tags, likes, dislikes) become id
+# lists on the archived row, so the hot indexes only hold live data.
+# Archived rows keep their primary keys: post_detail falls back to them and
+# restore() puts everything back under the same ids.
+#
+# Revision history, viewer sketches and notifications of an archived post
+# are not kept; its unique reader count is, and the new sketch a restored
+# post starts never lowers it (see record_view).
+
+POST_FIELDS = ['id', 'title', 'content', 'excerpt', 'author_id', 'category_id', 'created_at', 'updated_at',
+               'status', 'view_count', 'unique_viewers']
+COMMENT_FIELDS = ['id', 'post_id', 'author_id', 'content', 'parent_id', 'created_at', 'updated_at']
+
+
+def cold_posts(days):
+    cutoff = timezone.now() - timedelta(days=days)
+    return BlogPost.objects.filter(
+        created_at__lt=cutoff, updated_at__lt=cutoff,
+        comments_changed_at__lt=cutoff, reactions_changed_at__lt=cutoff,
+    )
+
+
+def _id_lists(through, owner, other, owner_ids):
+    lists = defaultdict(list)
+    rows = through.objects.filter(**{f'{owner}__in': owner_ids}).order_by(owner, other)
+    for owner_id, other_id in rows.values_list(owner, other):
+        lists[owner_id].append(other_id)
+    return lists
+
+
+def archive_batch(post_ids):
+    # Moves one batch atomically; returns (posts, comments) archived
+    with transaction.atomic():
+        posts = list(BlogPost.objects.select_for_update().filter(pk__in=post_ids).values(*POST_FIELDS))
+        post_ids = [post['id'] for post in posts]
+        if not post_ids:
+            return 0, 0
+        tags = _id_lists(BlogPost.tags.through, 'blogpost_id', 'tag_id', post_ids)
+        likes = _id_lists(BlogPost.likes.through, 'blogpost_id', 'user_id', post_ids)
+        dislikes = _id_lists(BlogPost.dislikes.through, 'blogpost_id', 'user_id', post_ids)
+
+        comments = list(Comment.objects.filter(post_id__in=post_ids).order_by('pk').values(*COMMENT_FIELDS))
+        comment_ids = [comment['id'] for comment in comments]
+        comment_likes = _id_lists(Comment.likes.through, 'comment_id', 'user_id', comment_ids)
+        comment_dislikes = _id_lists(Comment.dislikes.through, 'comment_id', 'user_id', comment_ids)
+
+        ArchivedPost.objects.bulk_create([
+            ArchivedPost(**post, tag_ids=tags[post['id']], like_ids=likes[post['id']],
+                         dislike_ids=dislikes[post['id']])
+            for post in posts
+        ])
+        ArchivedComment.objects.bulk_create([
+            ArchivedComment(**comment, like_ids=comment_likes[comment['id']],
+                            dislike_ids=comment_dislikes[comment['id']])
+            for comment in comments
+        ], batch_size=500)
+
+        # Cascades to comments and join rows; the delete signals keep tag
+        # counts right
+        BlogPost.objects.filter(pk__in=post_ids).delete()
+    return len(post_ids), len(comments)
+
+
+def archive(days, batch_size=100, limit=None):
+    # Walks the cold posts in primary-key batches so each transaction and
+    # each delete stays small
+    archived = comments = 0
+    last_pk = 0
+    while limit is None or archived < limit:
+        size = batch_size if limit is None else min(batch_size, limit - archived)
+        ids = list(cold_posts(days).filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:size])
+        if not ids:
+            break
+        last_pk = ids[-1]
+        moved, moved_comments = archive_batch(ids)
+        archived += moved
+        comments += moved_comments
+    return archived, comments
+
+
+def restore(post_ids):
+    # Puts archived posts back under their original ids; returns the number
+    # of posts restored
+    with transaction.atomic():
+        archived = list(ArchivedPost.objects.select_for_update().filter(pk__in=post_ids).order_by('pk'))
+        if not archived:
+            return 0
+        post_ids = [post.pk for post in archived]
+        comments = []
+        paths = {}
+        for comment in ArchivedComment.objects.filter(post_id__in=post_ids).order_by('pk'):
+            # Replies whose parent went with a deleted user cannot come back
+            if comment.parent_id is None or comment.parent_id in paths:
+                comments.append(comment)
+                paths[comment.pk] = paths.get(comment.parent_id, '') + path_step(comment.pk)
+
+        # Users or tags may have been deleted while the post was archived
+        user_ids = {user_id for row in archived + comments for user_id in row.like_ids + row.dislike_ids}
+        live_users = set(User.objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+        tag_ids = {tag_id for post in archived for tag_id in post.tag_ids}
+        live_tags = set(Tag.objects.filter(pk__in=tag_ids).values_list('pk', flat=True))
+
+        BlogPost.objects.bulk_create([
+            BlogPost(**{field: getattr(post, field) for field in POST_FIELDS}) for post in archived
+        ])
+        # Parents have lower ids than their replies, so pk order is safe
+        Comment.objects.bulk_create([
+            Comment(**{field: getattr(comment, field) for field in COMMENT_FIELDS}, path=paths[comment.pk])
+            for comment in comments
+        ], batch_size=500)
+
+        def links(through, owner, other, rows, attr, live):
+            through.objects.bulk_create([
+                through(**{owner: row.pk, other: other_id})
+                for row in rows for other_id in getattr(row, attr) if other_id in live
+            ], batch_size=1000)
+
+        links(BlogPost.tags.through, 'blogpost_id', 'tag_id', archived, 'tag_ids', live_tags)
+        links(BlogPost.likes.through, 'blogpost_id', 'user_id', archived, 'like_ids', live_users)
+        links(BlogPost.dislikes.through, 'blogpost_id', 'user_id', archived, 'dislike_ids', live_users)
+        links(Comment.likes.through, 'comment_id', 'user_id', comments, 'like_ids', live_users)
+        links(Comment.dislikes.through, 'comment_id', 'user_id', comments, 'dislike_ids', live_users)
+
+        # bulk_create skips the signals that maintain these
+        adjust_post_counts(Counter(
+            tag_id for post in archived if post.status == 'published' for tag_id in post.tag_ids
+            if tag_id in live_tags
+        ), +1, activity=False)
+        ArchivedPost.objects.filter(pk__in=post_ids).delete()
+    return len(archived)
@@ -0,0 +1,148 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from .models import DraftAutosave
+
+# Delta-based autosave for the post editor.
+#
+# The editor sends splices ([start, end, text], offsets in UTF-16 code
+# units as JavaScript counts them) against the version it last saw. The
+# current state lives in the cache and is only written to DraftAutosave
+# when the interval since the previous write has passed or the editor asks
+# for a flush (idle, leaving the page), so an editing session costs a
+# bounded number of row writes no matter how often it autosaves.
+#
+# The cache is only an accelerator: when it misses (eviction, another
+# process) the state falls back to the stored row and the editor, which
+# always holds the full text, resends it against that version.
+
+CACHE_TIMEOUT = 60 * 60 * 24
+MAX_LENGTH = 1024 * 1024
+
+
+class Conflict(Exception):
+    def __init__(self, state):
+        super().__init__('Draft changed since version was read')
+        self.version = state['version']
+        self.length = utf16_length(state['content'])
+
+
+class InvalidPatch(ValueError):
+    pass
+
+
+def write_interval():
+    return getattr(settings, 'AUTOSAVE_WRITE_INTERVAL', 30)
+
+
+def utf16_length(text):
+    return len(text.encode('utf-16-le')) // 2
+
+
+def apply_patch(content, patch):
+    encoded = content.encode('utf-16-le')
+    for splice in patch:
+        try:
+            start, end, text = splice
+            start, end, text = int(start), int(end), str(text)
+        except (TypeError, ValueError):
+            raise InvalidPatch('Each splice must be [start, end, text]')
+        if not 0 <= start <= end <= len(encoded) // 2:
+            raise InvalidPatch(f'Splice [{start}, {end}] is out of range')
+        encoded = encoded[:start * 2] + text.encode('utf-16-le') + encoded[end * 2:]
+        if len(encoded) // 2 > MAX_LENGTH:
+            raise InvalidPatch('Draft is too long')
+    try:
+        return encoded.decode('utf-16-le')
+    except UnicodeDecodeError:
+        raise InvalidPatch('Splice splits a surrogate pair')
+
+
+def _cache_key(user, post):
+    return f"autosave:{user.pk}:{post.pk if post else 'new'}"
+
+
+def _load(user, post):
+    row = DraftAutosave.objects.filter(author=user, post=post).first()
+    if row is not None:
+        return {
+            'row_id': row.pk, 'version': row.version, 'saved_version': row.version,
+            'saved_at': row.saved_at.timestamp(), 'title': row.title, 'content': row.content,
+        }
+    # Version 0 is what the editor was rendered with
+    return {
+        'row_id': None, 'version': 0, 'saved_version': 0, 'saved_at': 0,
+        'title': post.title if post else '', 'content': post.content if post else '',
+    }
+
+
+def state(user, post):
+    return cache.get(_cache_key(user, post)) or _load(user, post)
+
+
+def editor_state(user, post):
+    # What the editor starts from, and whether it holds unsaved changes
+    # worth offering for restore
+    current = state(user, post)
+    initial = (post.title, post.content) if post else ('', '')
+    return {
+        'post': post.pk if post else None,
+        'version': current['version'],
+        'title': current['title'],
+        'content': current['content'],
+        'restore': (current['title'], current['content']) != initial,
+    }
+
+
+def _persist(user, post, current):
+    fields = {'title': current['title'], 'content': current['content'], 'version': current['version']}
+    if current['row_id'] is None:
+        try:
+            with transaction.atomic():
+                if post is None and not connection.features.supports_partial_indexes:
+                    # No unique_new_post_autosave index (MySQL): first saves
+                    # of the author's new-post draft queue on the user row
+                    list(User.objects.select_for_update().filter(pk=user.pk).values_list('pk'))
+                    if DraftAutosave.objects.filter(author=user, post=None).exists():
+                        raise IntegrityError
+                row = DraftAutosave.objects.create(author=user, post=post, **fields)
+        except IntegrityError:
+            raise Conflict(_load(user, post))
+        current['row_id'] = row.pk
+    else:
+        # Optimistic write: lose the race rather than overwrite newer text
+        written = DraftAutosave.objects.filter(pk=current['row_id'], version=current['saved_version']).update(
+            saved_at=timezone.now(), **fields
+        )
+        if not written:
+            cache.delete(_cache_key(user, post))
+            raise Conflict(_load(user, post))
+    current['saved_version'] = current['version']
+    current['saved_at'] = time.time()
+
+
+def save(user, post, version, patch, title=None, flush=False):
+    current = state(user, post)
+    if version != current['version']:
+        raise Conflict(current)
+
+    content = apply_patch(current['content'], patch)
+    title = current['title'] if title is None else str(title)[:200]
+    if (title, content) != (current['title'], current['content']):
+        current.update(title=title, content=content, version=current['version'] + 1)
+
+    unsaved = current['version'] != current['saved_version']
+    if unsaved and (flush or time.time() - current['saved_at'] >= write_interval()):
+        _persist(user, post, current)
+    cache.set(_cache_key(user, post), current, CACHE_TIMEOUT)
+    return current
+
+
+def clear(user, post):
+    DraftAutosave.objects.filter(author=user, post=post).delete()
+    cache.delete(_cache_key(user, post))
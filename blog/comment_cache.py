@@ -0,0 +1,159 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F, Q, Window
+from django.db.models.functions import RowNumber, Substr
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils.safestring import mark_safe
+
+from .models import PATH_STEP, Comment, path_root_id, path_step, subtree
+from .pagination import CursorPage, cursor_paginate
+
+# Fragment cache for rendered comment threads.
+#
+# A top-level comment and the replies below it, to any depth, render to
+# one HTML fragment that is the same for every reader: no CSRF token, no
+# login-dependent markup and no liked/disliked highlighting. It is cached
+# under the comment's id and render_version, which the signals restamp on
+# edits, replies and reactions anywhere in the thread, so a stale fragment
+# is never looked up again and simply expires. The page adds the viewer's
+# bits (lit buttons, the reply form) on top.
+#
+# Only the first page of threads, each with its first few replies, is part
+# of the post page; the rest is fetched from comment_page as the reader
+# scrolls or expands a thread. Replies come in path order (depth first)
+# and are drawn as a flat list indented by depth, so a page can end
+# anywhere in the tree.
+
+FRAGMENT_TIMEOUT = 60 * 60 * 24
+REPLIES_SHOWN = 5
+REPLIES_PER_PAGE = 20
+MAX_INDENT = 8
+THREAD_TEMPLATE = 'blog/includes/comment_thread.html'
+REPLIES_TEMPLATE = 'blog/includes/comment_replies.html'
+
+
+def page_size():
+    return getattr(settings, 'COMMENTS_PER_PAGE', 20)
+
+
+def fragment_key(comment_id, version):
+    return f'comment-thread:{comment_id}:{version}'
+
+
+def thread_roots(comment_ids):
+    paths = Comment.objects.filter(pk__in=comment_ids).values_list('path', flat=True)
+    return {path_root_id(path) for path in paths if path}
+
+
+def restamp(root_ids):
+    if root_ids:
+        Comment.objects.filter(pk__in=root_ids).update(render_version=time.time_ns())
+
+
+def _reaction_counts(through, comment_ids):
+    rows = through.objects.filter(comment_id__in=comment_ids).values('comment_id').annotate(n=Count('*'))
+    return {row['comment_id']: row['n'] for row in rows}
+
+
+def _count_reactions(comments):
+    ids = [comment.pk for comment in comments]
+    likes = _reaction_counts(Comment.likes.through, ids)
+    dislikes = _reaction_counts(Comment.dislikes.through, ids)
+    for comment in comments:
+        comment.likes_count = likes.get(comment.pk, 0)
+        comment.dislikes_count = dislikes.get(comment.pk, 0)
+        comment.indent = min(comment.depth - 1, MAX_INDENT)
+
+
+def threads_url(post_id, cursor):
+    return reverse('comment_page', kwargs={'pk': post_id}) + f'?cursor={cursor}'
+
+
+def replies_url(post_id, root_id, cursor):
+    return reverse('comment_page', kwargs={'pk': post_id}) + f'?thread={root_id}&cursor={cursor}'
+
+
+def _render(root_ids):
+    # Renders the given threads with three queries however many there are:
+    # one range scan per thread on the path index, cut to the root and its
+    # first REPLIES_SHOWN replies by a window over the thread
+    threads = Q()
+    for pk in root_ids:
+        threads |= subtree(path_step(pk))
+    comments = list(
+        Comment.objects.filter(threads).select_related('author')
+        .annotate(rank=Window(RowNumber(), partition_by=Substr('path', 1, PATH_STEP), order_by=F('path').asc()))
+        .filter(rank__lte=REPLIES_SHOWN + 2).order_by('path')
+    )
+    _count_reactions(comments)
+
+    replies = {}
+    for comment in comments:
+        if comment.parent_id:
+            replies.setdefault(comment.root_id, []).append(comment)
+    rendered = {}
+    for root in comments:
+        if root.parent_id:
+            continue
+        shown = replies.get(root.pk, [])
+        more_url = None
+        if len(shown) > REPLIES_SHOWN:
+            shown = shown[:REPLIES_SHOWN]
+            more_url = replies_url(root.post_id, root.pk, shown[-1].path)
+        rendered[root.pk] = render_to_string(THREAD_TEMPLATE, {
+            'comment': root, 'replies': shown, 'more_url': more_url,
+        })
+    return rendered
+
+
+def render_threads(post, cursor=None, per_page=None):
+    # A page of the post's comment threads as HTML, oldest first
+    roots = cursor_paginate(
+        post.comments.filter(parent=None).values('pk', 'render_version'),
+        cursor, per_page or page_size(), descending=False,
+    )
+    keys = {root['pk']: fragment_key(root['pk'], root['render_version']) for root in roots}
+    fragments = cache.get_many(keys.values())
+
+    missing = {pk for pk, key in keys.items() if key not in fragments}
+    if missing:
+        rendered = _render(missing)
+        cache.set_many({keys[pk]: html for pk, html in rendered.items()}, FRAGMENT_TIMEOUT)
+        fragments.update((keys[pk], html) for pk, html in rendered.items())
+    return CursorPage(
+        [mark_safe(fragments[key]) for key in keys.values() if key in fragments],
+        roots.next_cursor,
+    )
+
+
+def render_replies(post, root_id, cursor):
+    # Further replies of a thread after the path `cursor`, depth first; not
+    # cached, as only readers who expand the thread ask for them
+    root_path = path_step(root_id)
+    replies = Comment.objects.filter(subtree(root_path), post=post, path__gt=root_path)
+    if cursor and cursor.isalnum() and cursor.startswith(root_path):
+        replies = replies.filter(path__gt=cursor)
+    replies = list(replies.select_related('author').order_by('path')[:REPLIES_PER_PAGE + 1])
+
+    next_cursor = None
+    if len(replies) > REPLIES_PER_PAGE:
+        replies = replies[:REPLIES_PER_PAGE]
+        next_cursor = replies[-1].path
+    _count_reactions(replies)
+    return CursorPage(render_to_string(REPLIES_TEMPLATE, {'replies': replies}), next_cursor)
+
+
+def viewer_reactions(user, post):
+    # Which of the post's comments the viewer liked or disliked, applied to
+    # the shared fragments in the browser
+    if not user.is_authenticated:
+        return {'liked': [], 'disliked': []}
+    return {
+        'liked': list(Comment.likes.through.objects.filter(user=user, comment__post=post)
+                      .values_list('comment_id', flat=True)),
+        'disliked': list(Comment.dislikes.through.objects.filter(user=user, comment__post=post)
+                         .values_list('comment_id', flat=True)),
+    }
@@ -0,0 +1,130 @@
+import hashlib
+import time
+from datetime import datetime, timezone
+
+from django.contrib.messages import get_messages
+from django.db.models import Count, Max
+
+from .models import BlogPost
+from .tag_stats import TRENDING_CACHE_TIMEOUT
+
+# Validators for HTTP conditional GET (ETag / Last-Modified).
+#
+# They are computed with a single cheap query before the view builds its
+# context, so an unchanged page can be answered with 304 Not Modified.
+# View counts are deliberately not part of the validators: they change on
+# every hit and would make revalidation useless. The home page's sidebars
+# (popular posts by views, trending tags) move without touching any post,
+# so its validators also roll over every SIDEBAR_REFRESH seconds.
+
+SIDEBAR_REFRESH = TRENDING_CACHE_TIMEOUT  # as long as the trending tags stay cached
+
+
+def _memoize(request, key, compute):
+    # condition() asks for the ETag and Last-Modified separately, so keep
+    # the query result on the request to hit the database only once
+    cache = request.__dict__.setdefault('_conditional_state', {})
+    if key not in cache:
+        cache[key] = compute()
+    return cache[key]
+
+
+def _has_pending_messages(request):
+    # A 304 would swallow flash messages queued for this page
+    return len(get_messages(request)) > 0
+
+
+def _make_etag(request, *parts):
+    user_id = request.user.pk if request.user.is_authenticated else 0
+    raw = '|'.join(str(part) for part in (user_id,) + parts)
+    return hashlib.md5(raw.encode(), usedforsecurity=False).hexdigest()
+
+
+def _etag(request, state, *parts):
+    if state is None or _has_pending_messages(request):
+        return None
+    return _make_etag(request, *parts, *state)
+
+
+def _last_modified(request, state):
+    # Pages render per-user bits, so only anonymous pages advertise a
+    # Last-Modified date; logged-in users revalidate with the ETag alone
+    if state is None or request.user.is_authenticated:
+        return None
+    return max(value for value in state[:3] if value is not None)
+
+
+def _post_state(request, pk):
+    def compute():
+        return BlogPost.objects.filter(pk=pk).values_list(
+            'updated_at', 'comments_changed_at', 'reactions_changed_at'
+        ).first()
+    return _memoize(request, ('post', pk), compute)
+
+
+def _listing_state(request, key, posts):
+    def compute():
+        state = posts.aggregate(
+            updated=Max('updated_at'),
+            commented=Max('comments_changed_at'),
+            reacted=Max('reactions_changed_at'),
+            total=Count('id'),
+        )
+        # Unknown category/tag or empty listing: let the view handle it
+        if not state['total']:
+            return None
+        return (state['updated'], state['commented'], state['reacted'], state['total'])
+    return _memoize(request, key, compute)
+
+
+def _sidebar_period():
+    # Start of the current SIDEBAR_REFRESH period
+    now = time.time()
+    return datetime.fromtimestamp(now - now % SIDEBAR_REFRESH, timezone.utc)
+
+
+def _home_state(request):
+    return _listing_state(request, ('home',), BlogPost.objects.filter(status='published'))
+
+
+def _category_state(request, name):
+    posts = BlogPost.objects.filter(status='published', category__name=name)
+    return _listing_state(request, ('category', name), posts)
+
+
+def _tag_state(request, name):
+    posts = BlogPost.objects.filter(status='published', tags__name=name)
+    return _listing_state(request, ('tag', name), posts)
+
+
+def post_etag(request, pk):
+    return _etag(request, _post_state(request, pk), 'post', pk)
+
+
+def post_last_modified(request, pk):
+    return _last_modified(request, _post_state(request, pk))
+
+
+def home_etag(request):
+    return _etag(request, _home_state(request), 'home', request.GET.get('page', ''), _sidebar_period())
+
+
+def home_last_modified(request):
+    last_modified = _last_modified(request, _home_state(request))
+    return last_modified and max(last_modified, _sidebar_period())
+
+
+def category_etag(request, name):
+    return _etag(request, _category_state(request, name), 'category', name)
+
+
+def category_last_modified(request, name):
+    return _last_modified(request, _category_state(request, name))
+
+
+def tag_etag(request, name):
+    return _etag(request, _tag_state(request, name), 'tag', name)
+
+
+def tag_last_modified(request, name):
+    return _last_modified(request, _tag_state(request, name))
@@ -0,0 +1,202 @@
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import connection
+from django.db.models import Exists, OuterRef
+from django.db.models.functions import Coalesce
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import DigestWatermark, Notification
+from .sitemaps import site_url
+
+logger = logging.getLogger(__name__)
+
+# Email digests of unread notifications.
+#
+# Recipients (active users with an email address and unread notifications
+# newer than their watermark) are streamed in primary-key chunks. For each
+# chunk one query reads the users with their watermarks and one reads
+# their notifications joined to senders and posts. The mails are rendered
+# in a process pool from plain dicts, so workers never touch the database,
+# and the next chunk renders while this one is sent. Each chunk is sent
+# over one mail connection (one SMTP session), and the watermarks of the
+# recipients whose mail went out are then upserted in one statement; a
+# failed mail is retried by the next run.
+
+DESCRIPTIONS = {
+    'follow': 'started following you',
+    'like_post': 'liked your post',
+    'comment': 'commented on your post',
+    'reply': 'replied to your comment on',
+}
+RENDER_CHUNK = 20  # digests handed to a worker at a time
+
+
+def max_items():
+    return getattr(settings, 'DIGEST_MAX_ITEMS', 20)
+
+
+def recipients(after=0, limit=500):
+    # (pk, username, email, watermark) of the next `limit` users due a digest
+    watermark = Coalesce('digest_watermark__notification_id', 0)
+    pending = Notification.objects.filter(recipient=OuterRef('pk'), is_read=False, pk__gt=OuterRef('watermark'))
+    users = (
+        User.objects.filter(is_active=True, pk__gt=after).exclude(email='')
+        .annotate(watermark=watermark).filter(Exists(pending)).order_by('pk')
+    )
+    return list(users.values_list('pk', 'username', 'email', 'watermark')[:limit])
+
+
+def digests(users, limit):
+    # One dict per user: its newest `limit` unread notifications, how many
+    # there are in all, and the id the watermark moves to
+    if not users:
+        return []
+    watermarks = {pk: watermark for pk, _, _, watermark in users}
+    rows = (
+        Notification.objects.filter(
+            recipient_id__in=watermarks, is_read=False, pk__gt=min(watermarks.values())
+        )
+        .order_by('recipient_id', '-pk')
+        .values_list('pk', 'recipient_id', 'notification_type', 'sender__username', 'post_id',
+                     'post__title', 'comment_id', 'created_at')
+    )
+    found = {pk: {'items': [], 'total': 0, 'last_id': 0} for pk in watermarks}
+    for pk, recipient_id, kind, sender, post_id, title, comment_id, created_at in rows:
+        if pk <= watermarks[recipient_id]:
+            continue
+        digest = found[recipient_id]
+        digest['total'] += 1
+        digest['last_id'] = max(digest['last_id'], pk)
+        if len(digest['items']) < limit:
+            digest['items'].append({
+                'kind': kind, 'sender': sender, 'post_id': post_id, 'title': title,
+                'comment_id': comment_id, 'created_at': created_at,
+            })
+    return [
+        {'user_id': pk, 'username': username, 'email': email, **found[pk]}
+        for pk, username, email, _ in users if found[pk]['total']
+    ]
+
+
+def _link(item):
+    if item['kind'] == 'follow':
+        path = reverse('user_profile', kwargs={'username': item['sender']})
+    elif item['post_id'] is None:
+        return ''
+    else:
+        path = reverse('post_detail', kwargs={'pk': item['post_id']})
+        if item['comment_id'] is not None:
+            path += f'#comment-{item["comment_id"]}'
+    return site_url() + path
+
+
+def render(digest):
+    # Runs in a worker: returns (user id, subject, text body, html body)
+    items = [
+        {**item, 'description': DESCRIPTIONS.get(item['kind'], item['kind']), 'url': _link(item)}
+        for item in digest['items']
+    ]
+    context = {
+        'username': digest['username'],
+        'items': items,
+        'more': digest['total'] - len(items),
+        'site_url': site_url(),
+    }
+    subject = f'{digest["total"]} new notification(s) on Blog Site'
+    return (
+        digest['user_id'], subject,
+        render_to_string('blog/email/digest.txt', context),
+        render_to_string('blog/email/digest.html', context),
+    )
+
+
+def _init_worker():
+    # A no-op under fork; a spawned worker sets Django up from the same
+    # DJANGO_SETTINGS_MODULE
+    django.setup()
+
+
+@contextmanager
+def _renderer(workers):
+    # Yields a function that starts rendering a list of digests and returns
+    # an iterator over the results in order
+    if (workers or os.cpu_count()) == 1:
+        yield lambda batch: map(render, batch)
+        return
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker) as pool:
+        yield lambda batch: pool.map(render, batch, chunksize=RENDER_CHUNK)
+
+
+def deliver(batch, rendered):
+    # Sends one chunk's mails over one connection; returns the digests
+    # sent and the number that failed
+    emails = {digest['user_id']: digest for digest in batch}
+    sent = []
+    failed = 0
+    with get_connection() as mail_connection:
+        for user_id, subject, text, html in rendered:
+            digest = emails[user_id]
+            message = EmailMultiAlternatives(subject, text, to=[digest['email']], connection=mail_connection)
+            message.attach_alternative(html, 'text/html')
+            try:
+                message.send()
+            except Exception:
+                logger.exception('Digest to user %s failed', user_id)
+                failed += 1
+            else:
+                sent.append(digest)
+    # MySQL upserts on any unique key and refuses a named one
+    target = connection.features.supports_update_conflicts_with_target
+    DigestWatermark.objects.bulk_create(
+        [DigestWatermark(user_id=digest['user_id'], notification_id=digest['last_id'], sent_at=timezone.now())
+         for digest in sent],
+        update_conflicts=True,
+        unique_fields=['user'] if target else None,
+        update_fields=['notification_id', 'sent_at'],
+    )
+    return sent, failed
+
+
+def send(chunk_size=500, workers=None, limit=None):
+    # Returns a dict of mails sent, mails failed, notifications covered and
+    # elapsed seconds
+    started = time.perf_counter()
+    limit = limit or max_items()
+    totals = {'sent': 0, 'failed': 0, 'notifications': 0}
+    pending = None
+    after = 0
+    with _renderer(workers) as start_rendering:
+        while True:
+            users = recipients(after, chunk_size)
+            batch = digests(users, limit)
+            current = (batch, start_rendering(batch)) if batch else None
+            if pending:
+                _deliver_counted(*pending, totals)
+            pending = current
+            if len(users) < chunk_size:
+                break
+            after = users[-1][0]
+        if pending:
+            _deliver_counted(*pending, totals)
+    totals['elapsed'] = time.perf_counter() - started
+    return totals
+
+
+def _deliver_counted(batch, rendered, totals):
+    sent, failed = deliver(batch, rendered)
+    totals['sent'] += len(sent)
+    totals['failed'] += failed
+    totals['notifications'] += sum(digest['total'] for digest in sent)
@@ -0,0 +1,253 @@
+import heapq
+import threading
+import time
+from array import array
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connections
+
+from .models import BlogPost, Category, Tag
+
+# Facet counts for search results.
+#
+# Each process keeps, for every category, tag and author, the set of its
+# published posts: as an int bitset indexed by post id when the value has
+# many posts, or as a sorted id array when it has few. The text search
+# returns the matching ids, which become one bitset; a facet value's count
+# is then a popcount of an AND, or bit tests for its array. Tags and
+# authors are visited largest first and the walk stops once no remaining
+# value can make the top list. Up to ARRAY_LIMIT matches are cheaper to
+# count one by one from per-post arrays of category, author and tags.
+#
+# Several values of one facet are combined with OR and different facets
+# with AND. Each facet is counted against the results filtered by the
+# other facets only, so its unselected values keep showing what selecting
+# them would add.
+#
+# The first search of a process builds the index. After that it is
+# rebuilt every FACETS_REFRESH seconds in a background thread while the old
+# one keeps serving, so counts may lag behind changes by that long.
+
+FACETS = ('category', 'tag', 'author')
+TOP = {'category': None, 'tag': 10, 'author': 10}  # None: every value
+DENSE = 64  # a value with more than 1 post in DENSE gets a bitset
+ARRAY_LIMIT = 1000
+
+
+def refresh_interval():
+    return getattr(settings, 'FACETS_REFRESH', 300)
+
+
+def bitset(pks):
+    if not pks:
+        return 0
+    buffer = bytearray((max(pks) >> 3) + 1)
+    for pk in pks:
+        buffer[pk >> 3] |= 1 << (pk & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+class Value:
+    __slots__ = ('name', 'size', 'bits', 'pks')
+
+    def __init__(self, name, pks, universe):
+        self.name = name
+        self.size = len(pks)
+        if self.size * DENSE > universe:
+            self.bits, self.pks = bitset(pks), None
+        else:
+            self.bits, self.pks = None, array('q', sorted(pks))
+
+    def as_bits(self):
+        return self.bits if self.bits is not None else bitset(self.pks)
+
+    def count(self, mask, mask_bytes):
+        if self.bits is not None:
+            return (self.bits & mask).bit_count()
+        limit = len(mask_bytes) << 3
+        return sum(mask_bytes[pk >> 3] >> (pk & 7) & 1 for pk in self.pks if pk < limit)
+
+
+class FacetIndex:
+    def __init__(self):
+        self.built_at = time.monotonic()
+        self.values = {facet: {} for facet in FACETS}
+        self.by_size = {}
+        self.post_values = {}  # facet -> post id -> tuple of value ids
+
+    @classmethod
+    def build(cls):
+        index = cls()
+        members = {facet: defaultdict(list) for facet in FACETS}
+        posts = BlogPost.objects.filter(status='published')
+        universe = 1
+        rows = posts.values_list('pk', 'category_id', 'author_id')
+        for pk, category_id, author_id in rows.iterator(chunk_size=5000):
+            universe = max(universe, pk + 1)
+            if category_id is not None:
+                members['category'][category_id].append(pk)
+            members['author'][author_id].append(pk)
+        links = BlogPost.tags.through.objects.filter(blogpost__status='published')
+        for pk, tag_id in links.values_list('blogpost_id', 'tag_id').iterator(chunk_size=5000):
+            members['tag'][tag_id].append(pk)
+
+        names = {
+            'category': dict(Category.objects.filter(pk__in=members['category']).values_list('pk', 'name')),
+            'tag': dict(Tag.objects.filter(pk__in=members['tag']).values_list('pk', 'name')),
+            'author': dict(User.objects.filter(pk__in=members['author']).values_list('pk', 'username')),
+        }
+        for facet in FACETS:
+            post_values = defaultdict(tuple)
+            for value_id, pks in members[facet].items():
+                for pk in pks:
+                    post_values[pk] += (value_id,)
+            index.post_values[facet] = dict(post_values)
+            index.values[facet] = {
+                value_id: Value(names[facet].get(value_id, ''), pks, universe)
+                for value_id, pks in members[facet].items()
+            }
+            values = index.values[facet]
+            index.by_size[facet] = sorted(values, key=lambda value_id: -values[value_id].size)
+        return index
+
+    def _mask(self, facet, selected):
+        # Posts having any of the selected values
+        mask = 0
+        for value_id in selected:
+            value = self.values[facet].get(value_id)
+            if value is not None:
+                mask |= value.as_bits()
+        return mask
+
+    def _counts(self, facet, mask, selected):
+        mask_bytes = mask.to_bytes((mask.bit_length() + 7) >> 3, 'little')
+        values = self.values[facet]
+        limit = TOP[facet]
+        counted = []
+        for value_id in self.by_size[facet]:
+            value = values[value_id]
+            if limit is not None and len(counted) >= limit and value.size <= counted[0][0]:
+                # Neither this value nor any smaller one can make the list
+                break
+            count = value.count(mask, mask_bytes)
+            if not count:
+                continue
+            entry = (count, -value_id, value_id)
+            if limit is None or len(counted) < limit:
+                heapq.heappush(counted, entry)
+            elif entry > counted[0]:
+                heapq.heapreplace(counted, entry)
+        counted = {value_id: count for count, _, value_id in counted}
+        for value_id in selected - counted.keys():
+            if value_id in values:
+                counted[value_id] = values[value_id].count(mask, mask_bytes)
+        return self._listing(facet, counted, selected)
+
+    def _listing(self, facet, counted, selected):
+        # The top values by count, then any selected value not among them
+        values = self.values[facet]
+        ranked = sorted(counted.items(), key=lambda item: (-item[1], item[0]))[:TOP[facet]]
+        shown = {value_id for value_id, _ in ranked}
+        ranked += [(value_id, counted.get(value_id, 0)) for value_id in sorted(selected - shown)]
+        return [
+            {'id': value_id, 'name': values[value_id].name, 'count': count, 'selected': value_id in selected}
+            for value_id, count in ranked if value_id in values
+        ]
+
+    def _search_arrays(self, ordered_ids, selected):
+        # Walks the matches once, noting which selections each one passes
+        active = [facet for facet in FACETS if selected.get(facet)]
+        counted = {facet: defaultdict(int) for facet in FACETS}
+        ids = []
+        for pk in ordered_ids:
+            values = {facet: self.post_values[facet].get(pk, ()) for facet in FACETS}
+            failed = [facet for facet in active if selected[facet].isdisjoint(values[facet])]
+            if not failed:
+                ids.append(pk)
+            for facet in FACETS:
+                # Counted when no other facet's selection excludes it
+                if not failed or failed == [facet]:
+                    for value_id in values[facet]:
+                        counted[facet][value_id] += 1
+        return ids, {facet: self._listing(facet, counted[facet], selected.get(facet, set())) for facet in FACETS}
+
+    def search(self, ordered_ids, selected):
+        # ordered_ids: the text search's matches in display order;
+        # selected: {facet: set of value ids}. Returns the matches that
+        # pass the selected facets, in the same order, and the counts
+        if len(ordered_ids) <= ARRAY_LIMIT:
+            return self._search_arrays(ordered_ids, selected)
+        results = bitset(ordered_ids)
+        masks = {facet: self._mask(facet, selected[facet]) for facet in FACETS if selected.get(facet)}
+        facets = {}
+        for facet in FACETS:
+            mask = results
+            for other, other_mask in masks.items():
+                if other != facet:
+                    mask &= other_mask
+            facets[facet] = self._counts(facet, mask, selected.get(facet, set()))
+
+        if not masks:
+            return ordered_ids, facets
+        matching = results
+        for mask in masks.values():
+            matching &= mask
+        matching_bytes = matching.to_bytes((matching.bit_length() + 7) >> 3, 'little')
+        limit = len(matching_bytes) << 3
+        ids = [pk for pk in ordered_ids if pk < limit and matching_bytes[pk >> 3] >> (pk & 7) & 1]
+        return ids, facets
+
+
+_index = None
+_building = threading.Lock()
+
+
+def get_index():
+    global _index
+    index = _index
+    if index is None:
+        with _building:
+            if _index is None:
+                _index = FacetIndex.build()
+            return _index
+    if time.monotonic() - index.built_at >= refresh_interval() and _building.acquire(blocking=False):
+        threading.Thread(target=_rebuild, daemon=True).start()
+    return index
+
+
+def _rebuild():
+    global _index
+    try:
+        _index = FacetIndex.build()
+    finally:
+        connections.close_all()
+        _building.release()
+
+
+def toggle_url(params, facet, value_id):
+    # Query string selecting or deselecting one value, back on page 1
+    params = params.copy()
+    params.pop('page', None)
+    values = [value for value in params.getlist(facet) if value != str(value_id)]
+    if len(values) == len(params.getlist(facet)):
+        values.append(str(value_id))
+    params.setlist(facet, values)
+    return '?' + params.urlencode()
+
+
+def page_query(params):
+    # The current query string without the page, for pagination links
+    params = params.copy()
+    params.pop('page', None)
+    return params.urlencode()
+
+
+def reset():
+    global _index
+    _index = None
+
+
+def search(ordered_ids, selected):
+    return get_index().search(ordered_ids, selected)
@@ -0,0 +1,189 @@
+import hashlib
+
+from django.contrib.auth.models import User
+from django.contrib.syndication.views import Feed
+from django.core.cache import cache
+from django.db.models import Count, Max, Sum
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.feedgenerator import Atom1Feed
+from django.views.decorators.http import condition
+
+from .models import BlogPost, Category, Tag
+
+# RSS and Atom feeds for the whole site, categories, tags and authors.
+#
+# The ETag of a feed comes from one aggregate over its published posts
+# (newest updated_at, count and sum of ids, which moves when posts join or
+# leave it), so every process agrees on it whichever one saved the change.
+# A poller revalidating an unchanged feed costs that one query and gets a
+# 304; a full fetch is served from the rendered feed cached under the ETag.
+
+FEED_SIZE = 20
+FEED_CACHE_TIMEOUT = 60 * 60
+
+
+def _feed_etag(feed, request, kwargs):
+    state = BlogPost.objects.filter(status='published', **feed.filters(**kwargs)).aggregate(
+        updated=Max('updated_at'), total=Count('id'), ids=Sum('id'),
+    )
+    # Unknown category/tag/author or empty feed: let the view handle it
+    if not state['total']:
+        return None
+    raw = f"{state['updated'].isoformat()}|{state['total']}|{state['ids']}|{request.path}"
+    return hashlib.md5(raw.encode(), usedforsecurity=False).hexdigest()
+
+
+def cached_feed(feed):
+    def etag(request, **kwargs):
+        # Kept on the request, the view keys the cache with it too
+        if not hasattr(request, '_feed_etag'):
+            request._feed_etag = _feed_etag(feed, request, kwargs)
+        return request._feed_etag
+
+    @condition(etag_func=etag)
+    def view(request, **kwargs):
+        key = etag(request, **kwargs)
+        cached = cache.get(f'feed:{key}') if key else None
+        if cached is None:
+            response = feed(request, **kwargs)
+            cached = (response.content, response['Content-Type'])
+            if key:
+                cache.set(f'feed:{key}', cached, FEED_CACHE_TIMEOUT)
+        content, content_type = cached
+        return HttpResponse(content, content_type=content_type)
+    return view
+
+
+def _published_posts():
+    # Only the columns the feed renders; the excerpt is precomputed on save
+    return (
+        BlogPost.objects.filter(status='published')
+        .select_related('author', 'category')
+        .only('id', 'title', 'excerpt', 'created_at', 'updated_at', 'author__username', 'category__name')
+        .order_by('-created_at')
+    )
+
+
+class LatestPostsFeed(Feed):
+    title = 'Blog Site'
+    description = 'Latest posts on Blog Site.'
+
+    def link(self):
+        return reverse('home')
+
+    def filters(self, **kwargs):
+        # Lookups selecting the feed's posts from the URL arguments
+        return {}
+
+    def items(self):
+        return _published_posts()[:FEED_SIZE]
+
+    def item_title(self, item):
+        return item.title
+
+    def item_description(self, item):
+        return item.excerpt
+
+    def item_author_name(self, item):
+        return item.author.username
+
+    def item_pubdate(self, item):
+        return item.created_at
+
+    def item_updateddate(self, item):
+        return item.updated_at
+
+    def item_categories(self, item):
+        return [item.category.name] if item.category else []
+
+
+class CategoryFeed(LatestPostsFeed):
+    def filters(self, name):
+        return {'category__name': name}
+
+    def get_object(self, request, name):
+        return get_object_or_404(Category, name=name)
+
+    def title(self, obj):
+        return f'Blog Site: {obj.name}'
+
+    def description(self, obj):
+        return f'Latest posts in {obj.name}.'
+
+    def link(self, obj):
+        return obj.get_absolute_url()
+
+    def items(self, obj):
+        return _published_posts().filter(category=obj)[:FEED_SIZE]
+
+
+class TagFeed(LatestPostsFeed):
+    def filters(self, name):
+        return {'tags__name': name}
+
+    def get_object(self, request, name):
+        return get_object_or_404(Tag, name=name)
+
+    def title(self, obj):
+        return f'Blog Site: posts tagged "{obj.name}"'
+
+    def description(self, obj):
+        return f'Latest posts tagged {obj.name}.'
+
+    def link(self, obj):
+        return obj.get_absolute_url()
+
+    def items(self, obj):
+        return _published_posts().filter(tags=obj)[:FEED_SIZE]
+
+
+class AuthorFeed(LatestPostsFeed):
+    def filters(self, username):
+        return {'author__username': username}
+
+    def get_object(self, request, username):
+        return get_object_or_404(User, username=username)
+
+    def title(self, obj):
+        return f'Blog Site: posts by {obj.username}'
+
+    def description(self, obj):
+        return f'Latest posts by {obj.username}.'
+
+    def link(self, obj):
+        return reverse('user_profile', kwargs={'username': obj.username})
+
+    def items(self, obj):
+        return _published_posts().filter(author=obj)[:FEED_SIZE]
+
+
+class LatestPostsAtomFeed(LatestPostsFeed):
+    feed_type = Atom1Feed
+    subtitle = LatestPostsFeed.description
+
+
+class CategoryAtomFeed(CategoryFeed):
+    feed_type = Atom1Feed
+    subtitle = CategoryFeed.description
+
+
+class TagAtomFeed(TagFeed):
+    feed_type = Atom1Feed
+    subtitle = TagFeed.description
+
+
+class AuthorAtomFeed(AuthorFeed):
+    feed_type = Atom1Feed
+    subtitle = AuthorFeed.description
+
+
+site_rss = cached_feed(LatestPostsFeed())
+site_atom = cached_feed(LatestPostsAtomFeed())
+category_rss = cached_feed(CategoryFeed())
+category_atom = cached_feed(CategoryAtomFeed())
+tag_rss = cached_feed(TagFeed())
+tag_atom = cached_feed(TagAtomFeed())
+author_rss = cached_feed(AuthorFeed())
+author_atom = cached_feed(AuthorAtomFeed())
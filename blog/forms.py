@@ -85,12 +85,6 @@ class SearchForm(forms.Form):
             'class': 'form-control',
         })
     )
-    category = forms.ModelChoiceField(
-        queryset=Category.objects.all(),
-        required=False,
-        empty_label="All Categories",
-        widget=forms.Select(attrs={'class': 'form-control'})
-    )
 
 class TagForm(forms.ModelForm):
     class Meta:
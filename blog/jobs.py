@@ -0,0 +1,142 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job, Notification
+
+logger = logging.getLogger(__name__)
+
+# Lightweight DB-backed job queue.
+#
+# Signal handlers call enqueue() and the row is inserted once the current
+# transaction commits; the run_jobs management command claims due jobs in
+# batches, runs them and retries failures with exponential backoff.
+# Jobs carrying an idempotency key are inserted at most once.
+
+_handlers = {}
+
+
+def job(name, batch=False):
+    # Register a handler. Batch handlers receive the list of payloads of
+    # every claimed job with this name, plain handlers one payload at a time.
+    def decorator(func):
+        _handlers[name] = (func, batch)
+        return func
+    return decorator
+
+
+def enqueue(name, payload, key=None, delay=0):
+    new_job = Job(
+        name=name,
+        payload=payload,
+        idempotency_key=key,
+        run_after=timezone.now() + timedelta(seconds=delay),
+    )
+
+    if getattr(settings, 'JOBS_RUN_INLINE', False):
+        transaction.on_commit(lambda: _run_inline(new_job))
+    else:
+        transaction.on_commit(lambda: Job.objects.bulk_create([new_job], ignore_conflicts=True))
+
+
+def _run_inline(new_job):
+    func, batch = _handlers[new_job.name]
+    if batch:
+        func([new_job.payload])
+    else:
+        func(new_job.payload)
+
+
+def claim(batch_size, lock_timeout=300):
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', run_after__lte=now)
+            .filter(Q(locked_until__isnull=True) | Q(locked_until__lt=now))
+            .order_by('id')[:batch_size]
+        )
+        Job.objects.filter(pk__in=[j.pk for j in jobs]).update(
+            locked_until=now + timedelta(seconds=lock_timeout),
+            attempts=F('attempts') + 1,
+        )
+    for claimed in jobs:
+        claimed.attempts += 1
+    return jobs
+
+
+def run(jobs, max_attempts=5):
+    groups = {}
+    for claimed in jobs:
+        groups.setdefault(claimed.name, []).append(claimed)
+
+    for name, group in groups.items():
+        if name not in _handlers:
+            _fail(group, f'No handler registered for {name!r}', max_attempts=0)
+            continue
+
+        func, batch = _handlers[name]
+        if batch:
+            if not _run_group(group, lambda: func([j.payload for j in group]), max_attempts, len(group) == 1):
+                # One bad payload (say, its post deleted since) must not
+                # fail the others: run them one by one
+                for claimed in group:
+                    _run_group([claimed], lambda: func([claimed.payload]), max_attempts)
+        else:
+            for claimed in group:
+                _run_group([claimed], lambda: func(claimed.payload), max_attempts)
+
+
+def process(batch_size=100, max_attempts=5, lock_timeout=300):
+    jobs = claim(batch_size, lock_timeout)
+    run(jobs, max_attempts)
+    return len(jobs)
+
+
+def _run_group(group, call, max_attempts, record_failure=True):
+    # The side effects and the completion mark commit together, so a job
+    # that crashes half-way is retried from a clean slate. Returns whether
+    # it succeeded; record_failure=False leaves a failed group claimed for
+    # the caller to retry
+    try:
+        with transaction.atomic():
+            call()
+            Job.objects.filter(pk__in=[j.pk for j in group]).update(
+                status='done',
+                finished_at=timezone.now(),
+                locked_until=None,
+                last_error='',
+            )
+    except Exception as exc:
+        if not record_failure:
+            return False
+        logger.exception('Job %s failed', group[0].name)
+        _fail(group, repr(exc), max_attempts)
+        return False
+    return True
+
+
+def _fail(group, error, max_attempts):
+    now = timezone.now()
+    for failed in group:
+        if failed.attempts >= max_attempts:
+            changes = {'status': 'failed', 'finished_at': now}
+        else:
+            backoff = getattr(settings, 'JOBS_RETRY_BACKOFF', 10) * 2 ** (failed.attempts - 1)
+            changes = {'run_after': now + timedelta(seconds=backoff)}
+        Job.objects.filter(pk=failed.pk).update(locked_until=None, last_error=error, **changes)
+
+
+# Handlers
+
+@job('notifications.create', batch=True)
+def create_notifications(payloads):
+    Notification.objects.bulk_create([Notification(**payload) for payload in payloads])
+
+
+def notify(key, **fields):
+    enqueue('notifications.create', fields, key=key)
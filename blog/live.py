@@ -0,0 +1,260 @@
+import asyncio
+import json
+import logging
+import re
+import threading
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .models import PATH_STEP, BlogPost, Comment
+
+logger = logging.getLogger(__name__)
+
+# Live comment and reaction updates over server-sent events.
+#
+# Signals publish tiny "something changed" messages on a per-post channel
+# once the transaction commits. In each ASGI worker a Hub keeps a single
+# broker subscription per post that has readers, turns each message into an
+# event with one query, and fans it out to every connected reader, so the
+# database sees one query per change per worker rather than one per client.
+#
+# InProcessBroker only reaches listeners in the same process, which is
+# what tests and a single-worker deployment need. LIVE_BROKER can point to
+# a class with the same publish/subscribe interface backed by a shared
+# pub/sub service for multi-process deployments.
+
+STREAM_PATH = re.compile(r'^/post/(?P<pk>\d+)/events/$')
+CLIENT_QUEUE_SIZE = 100
+
+
+class InProcessBroker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def publish(self, channel, message):
+        # Safe to call from any thread, e.g. sync views run by the ASGI
+        # handler's thread pool
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            subscription.deliver(message)
+
+    def subscribe(self, channel):
+        subscription = _Subscription(self, channel)
+        with self._lock:
+            self._subscriptions[channel].add(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.channel)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.channel]
+
+
+class _Subscription:
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+
+    def deliver(self, message):
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, message)
+        except RuntimeError:
+            # The worker's loop is gone; nobody is listening any more
+            self.close()
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.broker._unsubscribe(self)
+
+
+_broker = None
+
+
+def broker():
+    global _broker
+    if _broker is None:
+        _broker = import_string(getattr(settings, 'LIVE_BROKER', 'blog.live.InProcessBroker'))()
+    return _broker
+
+
+def channel(post_id):
+    return f'post:{post_id}'
+
+
+def publish(post_id, message):
+    broker().publish(channel(post_id), message)
+
+
+def _comment_event(post_id, comment_id):
+    comment = (
+        Comment.objects.filter(pk=comment_id, post_id=post_id)
+        .values('id', 'parent_id', 'path', 'author__username', 'content', 'created_at')
+        .first()
+    )
+    if comment is None:
+        return None
+    return 'comment', {
+        'id': comment['id'],
+        'parent': comment['parent_id'],
+        'depth': len(comment['path']) // PATH_STEP - 1,
+        'author': comment['author__username'],
+        'content': comment['content'],
+        'created_at': comment['created_at'].isoformat(),
+        'comments': Comment.objects.filter(post_id=post_id).count(),
+    }
+
+
+def _reaction_counts(model, field, pk):
+    # Two index-only counts instead of joining both reaction tables
+    return {
+        'likes': model.likes.through.objects.filter(**{field: pk}).count(),
+        'dislikes': model.dislikes.through.objects.filter(**{field: pk}).count(),
+    }
+
+
+@sync_to_async
+def resolve(post_id, message):
+    # Turns a published message into (event name, data) for the readers
+    kind = message.get('type')
+    if kind == 'comment':
+        return _comment_event(post_id, message['id'])
+    if kind == 'reactions':
+        return 'reactions', _reaction_counts(BlogPost, 'blogpost_id', post_id)
+    if kind == 'comment_reactions':
+        return 'comment_reactions', {'id': message['id'], **_reaction_counts(Comment, 'comment_id', message['id'])}
+    return None
+
+
+class Hub:
+    def __init__(self):
+        self.clients = defaultdict(set)
+        self.listeners = {}
+
+    def join(self, post_id):
+        queue = asyncio.Queue(CLIENT_QUEUE_SIZE)
+        self.clients[post_id].add(queue)
+        if post_id not in self.listeners:
+            # Subscribe before returning so nothing published from here on
+            # is missed while the listener task starts
+            subscription = broker().subscribe(channel(post_id))
+            self.listeners[post_id] = asyncio.ensure_future(self._listen(post_id, subscription))
+        return queue
+
+    def leave(self, post_id, queue):
+        clients = self.clients.get(post_id)
+        if clients is None:
+            return
+        clients.discard(queue)
+        if not clients:
+            del self.clients[post_id]
+            self.listeners.pop(post_id).cancel()
+
+    async def _listen(self, post_id, subscription):
+        try:
+            while True:
+                message = await subscription.get()
+                try:
+                    event = await resolve(post_id, message)
+                except Exception:
+                    # One bad message must not silence the post's readers
+                    logger.exception('Could not resolve live message %r for post %s', message, post_id)
+                    continue
+                if event is None:
+                    continue
+                for queue in list(self.clients.get(post_id, ())):
+                    # A reader that stopped consuming misses events rather
+                    # than holding up everybody else
+                    if not queue.full():
+                        queue.put_nowait(event)
+        finally:
+            subscription.close()
+
+
+hub = Hub()
+
+
+def _format(name, data):
+    return f'event: {name}\ndata: {json.dumps(data)}\n\n'.encode()
+
+
+@sync_to_async
+def _post_exists(pk):
+    return BlogPost.objects.filter(pk=pk).exists()
+
+
+async def _respond(send, status, body, content_type=b'text/plain; charset=utf-8'):
+    await send({'type': 'http.response.start', 'status': status, 'headers': [(b'content-type', content_type)]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def event_stream(scope, receive, send, post_id):
+    if scope['method'] != 'GET':
+        await _respond(send, 405, b'Method not allowed')
+        return
+    if not await _post_exists(post_id):
+        await _respond(send, 404, b'Not found')
+        return
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': b'retry: 5000\n\n', 'more_body': True})
+
+    keepalive = getattr(settings, 'LIVE_KEEPALIVE', 15)
+    queue = hub.join(post_id)
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        while True:
+            event = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({event, disconnected}, timeout=keepalive,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if disconnected in done:
+                event.cancel()
+                break
+            if event in done:
+                body = _format(*event.result())
+            else:
+                event.cancel()
+                body = b': keepalive\n\n'
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    finally:
+        hub.leave(post_id, queue)
+        disconnected.cancel()
+
+
+async def _wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+def router(django_application):
+    # Serves the event streams directly and everything else through Django,
+    # so a long-lived stream never ties up a request thread
+    async def application(scope, receive, send):
+        if scope['type'] == 'http':
+            match = STREAM_PATH.match(scope['path'])
+            if match:
+                await event_stream(scope, receive, send, int(match['pk']))
+                return
+        await django_application(scope, receive, send)
+    return application
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from blog import archive
+
+
+class Command(BaseCommand):
+    help = 'Move cold posts with their comments and reactions into the archive tables, or restore them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=730,
+                            help='Archive posts with no edits, comments or reactions for this many days')
+        parser.add_argument('--batch-size', type=int, default=100, help='Posts moved per transaction')
+        parser.add_argument('--limit', type=int, help='Stop after archiving this many posts')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the posts that would be archived')
+        parser.add_argument('--restore', type=int, nargs='+', metavar='POST_ID',
+                            help='Move these archived posts back instead')
+
+    def handle(self, *args, **options):
+        if options['restore']:
+            restored = archive.restore(options['restore'])
+            self.stdout.write(self.style.SUCCESS(f'Restored {restored} post(s).'))
+            return
+
+        if options['dry_run']:
+            count = archive.cold_posts(options['days']).count()
+            self.stdout.write(f'{count} post(s) would be archived.')
+            return
+
+        started = time.monotonic()
+        posts, comments = archive.archive(options['days'], options['batch_size'], options['limit'])
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {posts} post(s) and {comments} comment(s) in {elapsed:.1f}s.'
+        ))
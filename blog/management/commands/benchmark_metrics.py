@@ -0,0 +1,56 @@
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from django.urls import resolve, reverse
+
+from blog import metrics
+
+
+class Command(BaseCommand):
+    help = 'Measure the per-request overhead of MetricsMiddleware and the cost of a scrape'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=100000, help='Requests to time')
+        parser.add_argument('--routes', type=int, default=50, help='Distinct routes for the scrape')
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        request = RequestFactory().get(reverse('home'))
+        request.resolver_match = resolve(reverse('home'))
+        response = HttpResponse('x' * 4096)
+
+        def view(request):
+            return response
+
+        previous = metrics.registry
+        metrics.registry = metrics.Registry()
+        try:
+            with tempfile.TemporaryDirectory() as root, override_settings(METRICS_ROOT=root):
+                bare = self.time(view, request, count)
+                wrapped = self.time(metrics.MetricsMiddleware(view), request, count)
+                self.stdout.write(f'Without middleware: {bare * 1e6:.2f} µs/request')
+                self.stdout.write(f'With middleware:    {wrapped * 1e6:.2f} µs/request')
+                self.stdout.write(self.style.SUCCESS(f'Overhead: {(wrapped - bare) * 1e6:.2f} µs/request'))
+
+                for route in range(options['routes']):
+                    for status in (200, 302, 404):
+                        metrics.registry.record(f'route_{route}', status, 0.05, 1000, 0.01, 3)
+                started = time.perf_counter()
+                metrics.registry.flush()
+                flushed = time.perf_counter() - started
+                started = time.perf_counter()
+                text = metrics.render(metrics.load())
+                scraped = time.perf_counter() - started
+                self.stdout.write(f'Flush: {flushed * 1000:.2f} ms; scrape: {scraped * 1000:.2f} ms '
+                                  f'({len(text) // 1024} KB, {options["routes"] * 3 + 1} series)')
+        finally:
+            metrics.registry = previous
+
+    def time(self, handler, request, count):
+        started = time.perf_counter()
+        for _ in range(count):
+            handler(request)
+        return (time.perf_counter() - started) / count
@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from blog import suggestions
+
+
+class Command(BaseCommand):
+    help = 'Precompute "who to follow" suggestions from follows, likes and comments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=10, help='Suggestions stored per user')
+        parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Users scored per worker task')
+        parser.add_argument('--benchmark', type=int, metavar='USERS',
+                            help='Score a synthetic graph of this many users instead of the database')
+
+    def handle(self, *args, **options):
+        if options['benchmark']:
+            return self.benchmark(options)
+
+        started = time.perf_counter()
+        stored = suggestions.build(
+            top_k=options['top_k'],
+            workers=options['workers'],
+            chunk_size=options['chunk_size'],
+        )
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'Stored suggestions for {stored} user(s) in {elapsed:.1f}s.'))
+
+    def benchmark(self, options):
+        users = options['benchmark']
+
+        started = time.perf_counter()
+        graph = suggestions.synthetic_graph(users)
+        built = time.perf_counter() - started
+        edges = sum(len(followed) for followed in graph.following.values())
+        engagements = sum(len(posts) for posts in graph.engaged.values())
+        self.stdout.write(f'Graph: {users} users, {edges} follows, {engagements} engagements ({built:.1f}s)')
+
+        started = time.perf_counter()
+        scored = sum(1 for _ in suggestions.compute(
+            graph, graph.users(), options['top_k'], options['workers'], options['chunk_size']
+        ))
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Scored {scored} users in {elapsed:.1f}s ({scored / elapsed:.0f} users/s)'
+        ))
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from blog import sitemaps
+
+
+class Command(BaseCommand):
+    help = 'Write the sitemap index and gzipped shards, rewriting only shards that changed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rewrite every shard regardless of the manifest')
+        parser.add_argument('--shard-size', type=int, help='Primary keys per shard (defaults to SITEMAP_SHARD_SIZE)')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        stats = sitemaps.build(full=options['full'], size=options['shard_size'])
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {stats['written']} shard(s), {stats['unchanged']} unchanged, "
+            f"{stats['removed']} removed in {elapsed:.1f}s."
+        ))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from blog import retention
+
+
+class Command(BaseCommand):
+    help = 'Delete old read notifications, withdrawn notifications, finished jobs and old tag activity in small batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows deleted per statement')
+        parser.add_argument('--sleep', type=float, default=0,
+                            help='Seconds to pause between batches, e.g. to let replicas catch up')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the rows that would be deleted')
+
+    def handle(self, *args, **options):
+        for name, model, condition in retention.policies():
+            if options['dry_run']:
+                count = model.objects.filter(condition).count()
+                self.stdout.write(f'{name}: {count} row(s) would be deleted.')
+                continue
+            deleted, elapsed = retention.prune(model, condition, options['batch_size'], options['sleep'])
+            rate = deleted / elapsed if elapsed else 0
+            self.stdout.write(self.style.SUCCESS(
+                f'{name}: deleted {deleted} row(s) in {elapsed:.1f}s ({rate:.0f} rows/s).'
+            ))
@@ -0,0 +1,37 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from blog.hll import HyperLogLog
+from blog.models import BlogPost, ViewerSketch
+from blog.viewers import save_sketch
+
+
+class Command(BaseCommand):
+    help = 'Merge daily unique-reader sketches into the all-time sketch and drop old daily rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-days', type=int, default=30, help='Daily sketches to keep per post')
+
+    def handle(self, *args, **options):
+        cutoff = (timezone.now() - timedelta(days=options['keep_days'])).date().isoformat()
+        old = ViewerSketch.objects.filter(bucket__lt=cutoff).exclude(bucket=ViewerSketch.TOTAL)
+
+        post_ids = old.values_list('post_id', flat=True).distinct()
+        merged_rows = 0
+        for post_id in post_ids.iterator():
+            rows = old.filter(post_id=post_id)
+            sketch = HyperLogLog()
+            for registers in rows.values_list('registers', flat=True):
+                sketch.merge(HyperLogLog.from_bytes(bytes(registers)))
+                merged_rows += 1
+
+            # Merging is idempotent, so folding days that already reached the
+            # all-time sketch on the request path is harmless
+            total = save_sketch(post_id, ViewerSketch.TOTAL, sketch)
+            BlogPost.objects.filter(pk=post_id).update(unique_viewers=Greatest('unique_viewers', total.count()))
+            rows.delete()
+
+        self.stdout.write(self.style.SUCCESS(f'Rolled up {merged_rows} daily sketch(es).'))
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from blog import jobs
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (notifications and other signal side effects)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Jobs claimed per batch')
+        parser.add_argument('--max-attempts', type=int, default=5, help='Attempts before a job is marked failed')
+        parser.add_argument('--lock-timeout', type=int, default=300,
+                            help='Seconds before a claimed but unfinished job can be claimed again')
+        parser.add_argument('--sleep', type=float, default=1.0, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Drain the queue and exit')
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            processed = jobs.process(
+                batch_size=options['batch_size'],
+                max_attempts=options['max_attempts'],
+                lock_timeout=options['lock_timeout'],
+            )
+            total += processed
+            if not processed:
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {total} job(s).'))
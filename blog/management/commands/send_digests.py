@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from blog import digests
+
+
+class Command(BaseCommand):
+    help = 'Email each user a digest of the unread notifications they have not been sent yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Recipients loaded and sent over one mail connection at a time')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Processes rendering mails (default: CPU count, 1 renders inline)')
+        parser.add_argument('--max-items', type=int, default=None,
+                            help='Notifications listed per mail (default: DIGEST_MAX_ITEMS)')
+
+    def handle(self, *args, **options):
+        result = digests.send(
+            chunk_size=options['chunk_size'], workers=options['workers'], limit=options['max_items'],
+        )
+        if result['failed']:
+            self.stderr.write(f"{result['failed']} digest(s) failed and will be retried by the next run.")
+        self.stdout.write(self.style.SUCCESS(
+            f"Sent {result['sent']} digest(s) covering {result['notifications']} notification(s) "
+            f"in {result['elapsed']:.1f}s."
+        ))
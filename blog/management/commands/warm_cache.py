@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from blog import warmup
+
+
+class Command(BaseCommand):
+    help = 'Pre-render the hottest pages after a deploy or restart to fill caches and the database buffer pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=50,
+                            help='Most read posts to warm, plus as many recently active ones')
+        parser.add_argument('--listings', type=int, default=20, help='Category and tag listings to warm, each')
+        parser.add_argument('--days', type=int, default=7, help='What counts as recent activity')
+        parser.add_argument('--workers', type=int, default=4, help='Pages rendered at the same time')
+
+    def handle(self, *args, **options):
+        targets = warmup.pages(posts=options['posts'], listings=options['listings'], days=options['days'])
+        result = warmup.warm(targets, workers=options['workers'])
+        for url, status in result['failed']:
+            self.stderr.write(f'{url}: HTTP {status}')
+        warmed = f"Warmed {result['pages'] - len(result['failed'])} of {result['pages']} page(s) in {result['elapsed']:.1f}s"
+        if result['shared']:
+            self.stdout.write(self.style.SUCCESS(f"{warmed}, filling {result['keys']} cache key(s)."))
+            return
+        self.stdout.write(self.style.SUCCESS(f'{warmed}; only the database was warmed.'))
+        self.stdout.write(self.style.WARNING(
+            'The default cache is local to this process, so no cache keys were kept for the web workers. '
+            'Configure a shared backend in CACHES to warm the cache as well.'
+        ))
@@ -0,0 +1,213 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from . import process_files
+
+# Prometheus metrics for every request.
+#
+# MetricsMiddleware records four histograms per (route, status), the route
+# being the view name the URL resolved to: latency, response size,
+# database time and query count. Counters live in a dict per thread, so
+# recording takes no lock: only the owning thread writes to its dict, and
+# readers copy it (a scrape may see a request half counted, never a
+# corrupt total). The dicts of finished threads are folded into a retired
+# total whenever a thread registers or the registry is read, so servers
+# that start a thread per request don't pile them up. Every
+# METRICS_FLUSH_INTERVAL seconds a process writes the sum of its counters
+# to its own file in METRICS_ROOT (see process_files); the metrics view
+# adds up the files of all processes, so a scrape of any worker returns
+# the totals of the whole deployment.
+
+HISTOGRAMS = [
+    ('http_request_duration_seconds', 'Request latency in seconds.',
+     (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)),
+    ('http_response_size_bytes', 'Response body size in bytes.',
+     (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)),
+    ('http_request_db_seconds', 'Database time per request in seconds.',
+     (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)),
+    ('http_request_queries', 'SQL statements per request.',
+     (0, 1, 2, 5, 10, 20, 50, 100, 200)),
+]
+UNMATCHED = 'unmatched'
+
+def _layout():
+    # Each series is one flat list: for every histogram its bucket counts,
+    # the last one for values above all bounds, followed by their sum
+    offsets, length = [], 0
+    for _, _, bounds in HISTOGRAMS:
+        offsets.append(length)
+        length += len(bounds) + 2
+    return offsets, length
+
+
+OFFSETS, SERIES_LENGTH = _layout()
+
+
+def metrics_root():
+    return getattr(settings, 'METRICS_ROOT', os.path.join(settings.BASE_DIR, 'metrics'))
+
+
+def flush_interval():
+    return getattr(settings, 'METRICS_FLUSH_INTERVAL', 15)
+
+
+class Registry:
+    def __init__(self):
+        self.local = threading.local()
+        self.threads = {}  # thread -> its series
+        self.retired = {}  # counters of threads that have finished
+        self.threads_lock = threading.Lock()  # only taken by a thread's first request
+        self.flush_lock = threading.Lock()
+        self.process = process_files.process_name()
+        self.flushed_at = time.monotonic()
+
+    def _thread_series(self):
+        try:
+            return self.local.series
+        except AttributeError:
+            series = self.local.series = {}
+            with self.threads_lock:
+                self._retire()
+                self.threads[threading.current_thread()] = series
+            return series
+
+    def _retire(self):
+        # Called with threads_lock held; a finished thread writes no more
+        for thread in [thread for thread in self.threads if not thread.is_alive()]:
+            for key, counters in self.threads.pop(thread).items():
+                _add(self.retired, key, counters)
+
+    def record(self, route, status, *values):
+        # values: one per histogram, None to leave it out
+        series = self._thread_series()
+        counters = series.get((route, status))
+        if counters is None:
+            counters = series[route, status] = [0] * SERIES_LENGTH
+        for offset, (_, _, bounds), value in zip(OFFSETS, HISTOGRAMS, values):
+            if value is not None:
+                counters[offset + bisect_left(bounds, value)] += 1
+                counters[offset + len(bounds) + 1] += value
+
+    def snapshot(self):
+        with self.threads_lock:
+            self._retire()
+            threads = list(self.threads.values())
+            merged = {key: list(counters) for key, counters in self.retired.items()}
+        for series in threads:
+            for key, counters in list(series.items()):
+                _add(merged, key, counters)
+        return merged
+
+    def due(self):
+        return time.monotonic() - self.flushed_at >= flush_interval()
+
+    def flush(self):
+        # One flushing thread at a time; the others skip rather than wait
+        if not self.flush_lock.acquire(blocking=False):
+            return
+        try:
+            self.flushed_at = time.monotonic()
+            series = [[route, status, counters] for (route, status), counters in self.snapshot().items()]
+            process_files.write(metrics_root(), self.process, {'process': self.process, 'series': series})
+        finally:
+            self.flush_lock.release()
+
+
+registry = Registry()
+
+
+def _add(merged, key, counters):
+    total = merged.get(key)
+    if total is None:
+        merged[key] = list(counters)
+    else:
+        for index, value in enumerate(counters):
+            total[index] += value
+
+
+class _Timer:
+    def __init__(self):
+        self.seconds = 0.0
+        self.queries = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.queries += 1
+
+
+def _size(response):
+    if not response.streaming:
+        return len(response.content)
+    length = response.get('Content-Length')
+    return int(length) if length and length.isdigit() else None
+
+
+class MetricsMiddleware:
+    # Goes first, so the latency covers the rest of the stack
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        timer = _Timer()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+
+        match = getattr(request, 'resolver_match', None)
+        route = match.view_name if match else UNMATCHED
+        registry.record(route, response.status_code, duration, _size(response), timer.seconds, timer.queries)
+        if registry.due():
+            registry.flush()
+        return response
+
+
+def load(root=None):
+    # Totals of every process: the others' from their files, this one's
+    # straight from memory
+    merged = registry.snapshot()
+    for data in process_files.read_all(root or metrics_root(), exclude=registry.process):
+        for route, status, counters in data['series']:
+            if len(counters) == SERIES_LENGTH:
+                _add(merged, (route, status), counters)
+    return merged
+
+
+def _label(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(series):
+    # Prometheus text exposition format, version 0.0.4
+    lines = []
+    keys = sorted(series)
+    for offset, (name, description, bounds) in zip(OFFSETS, HISTOGRAMS):
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} histogram')
+        for route, status in keys:
+            counters = series[route, status]
+            buckets = counters[offset:offset + len(bounds) + 1]
+            labels = f'route="{_label(route)}",status="{status}"'
+            seen = 0
+            for bound, count in zip(bounds + ('+Inf',), buckets):
+                seen += count
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {seen}')
+            lines.append(f'{name}_sum{{{labels}}} {_number(counters[offset + len(bounds) + 1])}')
+            lines.append(f'{name}_count{{{labels}}} {seen}')
+    return '\n'.join(lines) + '\n'
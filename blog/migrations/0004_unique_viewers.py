@@ -0,0 +1,47 @@
+# Generated by Django 4.2.7 on 2026-10-19 06:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0003_job"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="blogpost",
+            name="unique_viewers",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name="ViewerSketch",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("bucket", models.CharField(max_length=10)),
+                ("registers", models.BinaryField()),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "post",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="viewer_sketches",
+                        to="blog.blogpost",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("post", "bucket")},
+            },
+        ),
+    ]
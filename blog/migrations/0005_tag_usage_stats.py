@@ -0,0 +1,58 @@
+# Generated by Django 4.2.7 on 2026-10-19 06:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def count_published_posts(apps, schema_editor):
+    Tag = apps.get_model("blog", "Tag")
+    tags = Tag.objects.annotate(
+        published=models.Count("posts", filter=models.Q(posts__status="published"))
+    )
+    for tag in tags.iterator():
+        if tag.published:
+            Tag.objects.filter(pk=tag.pk).update(post_count=tag.published)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0004_unique_viewers"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="tag",
+            name="post_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name="TagActivity",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("count", models.PositiveIntegerField(default=0)),
+                (
+                    "tag",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="activity",
+                        to="blog.tag",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "Tag activity",
+                "unique_together": {("tag", "day")},
+            },
+        ),
+        migrations.RunPython(count_published_posts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.7 on 2026-10-19 06:23
+
+from django.db import migrations, models
+
+
+def count_follows(apps, schema_editor):
+    Profile = apps.get_model("blog", "Profile")
+    Follow = apps.get_model("blog", "Follow")
+    followers = Follow.objects.values("followed_id").annotate(n=models.Count("id"))
+    for row in followers.iterator():
+        Profile.objects.filter(user_id=row["followed_id"]).update(followers_count=row["n"])
+    following = Follow.objects.values("follower_id").annotate(n=models.Count("id"))
+    for row in following.iterator():
+        Profile.objects.filter(user_id=row["follower_id"]).update(following_count=row["n"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0005_tag_usage_stats"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="profile",
+            name="followers_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="profile",
+            name="following_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_follows, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7 on 2026-10-19 06:26
+
+from django.db import migrations, models
+from django.utils.html import strip_tags
+from django.utils.text import Truncator
+
+
+def fill_excerpts(apps, schema_editor):
+    BlogPost = apps.get_model("blog", "BlogPost")
+    posts = BlogPost.objects.only("id", "content").order_by("pk")
+    batch = []
+    for post in posts.iterator(chunk_size=500):
+        post.excerpt = Truncator(strip_tags(post.content)).words(50)
+        batch.append(post)
+        if len(batch) == 500:
+            BlogPost.objects.bulk_update(batch, ["excerpt"])
+            batch = []
+    BlogPost.objects.bulk_update(batch, ["excerpt"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0007_follow_suggestions"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="blogpost",
+            name="excerpt",
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.RunPython(fill_excerpts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.7 on 2026-10-19 06:46
+
+from django.db import migrations, models
+import time
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0011_archive"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="comment",
+            name="render_version",
+            field=models.BigIntegerField(default=time.time_ns, editable=False),
+        ),
+    ]
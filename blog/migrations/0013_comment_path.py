@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-19 06:52
+
+from django.db import migrations, models
+
+
+def path_step(pk):
+    digits = ""
+    while pk:
+        pk, digit = divmod(pk, 36)
+        digits = "0123456789abcdefghijklmnopqrstuvwxyz"[digit] + digits
+    return digits.rjust(8, "0")
+
+
+def fill_paths(apps, schema_editor):
+    # Only a batch in memory at a time: each pass takes comments whose
+    # parent already has a path, so threads fill in top-down
+    Comment = apps.get_model("blog", "Comment")
+    ready = Comment.objects.filter(path="").filter(models.Q(parent=None) | models.Q(parent__path__gt=""))
+    while True:
+        batch = list(ready.values_list("id", "parent__path").order_by("pk")[:500])
+        if not batch:
+            break
+        Comment.objects.bulk_update(
+            [Comment(pk=pk, path=(parent_path or "") + path_step(pk)) for pk, parent_path in batch], ["path"]
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0012_comment_render_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="comment",
+            name="path",
+            field=models.CharField(
+                db_index=True, default="", editable=False, max_length=512
+            ),
+        ),
+        migrations.RunPython(fill_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:17
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+        ("blog", "0013_comment_path"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DigestWatermark",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="digest_watermark",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("notification_id", models.BigIntegerField(default=0)),
+                ("sent_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:32
+
+from django.db import migrations, models
+
+
+def drop_duplicate_drafts(apps, schema_editor):
+    # Keep each author's most recent new-post draft
+    DraftAutosave = apps.get_model("blog", "DraftAutosave")
+    seen = set()
+    duplicates = []
+    drafts = DraftAutosave.objects.filter(post=None).order_by("author_id", "-saved_at", "-pk")
+    for pk, author_id in drafts.values_list("pk", "author_id"):
+        if author_id in seen:
+            duplicates.append(pk)
+        seen.add(author_id)
+    DraftAutosave.objects.filter(pk__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0014_digest_watermark"),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_drafts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="draftautosave",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("post__isnull", True)),
+                fields=("author",),
+                name="unique_new_post_autosave",
+            ),
+        ),
+    ]
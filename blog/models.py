@@ -1,18 +1,64 @@
-from django.db import models
+import time
+
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.urls import reverse
+from django.utils.html import strip_tags
+from django.utils.text import Truncator
+
+EXCERPT_WORDS = 50
+
+def make_excerpt(content):
+    return Truncator(strip_tags(content)).words(EXCERPT_WORDS)
 
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     bio = models.TextField(max_length=500, blank=True)
     profile_pic = models.ImageField(upload_to='profile_pics', default='default.jpg')
+    # Maintained by the Follow signals
+    followers_count = models.PositiveIntegerField(default=0, editable=False)
+    following_count = models.PositiveIntegerField(default=0, editable=False)
     
     def __str__(self):
         return f'{self.user.username} Profile'
     
     def get_absolute_url(self):
         return reverse('user_profile', kwargs={'username': self.user.username})
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot()
+        return instance
+    
+    def _field_values(self):
+        deferred = self.get_deferred_fields()
+        return {
+            field.name: field.get_prep_value(field.value_from_object(self))
+            for field in self._meta.concrete_fields
+            if field.attname not in deferred
+        }
+    
+    def _snapshot(self):
+        self._loaded_values = self._field_values()
+    
+    def get_dirty_fields(self):
+        loaded = getattr(self, '_loaded_values', {})
+        return [name for name, value in self._field_values().items()
+                if name in loaded and loaded[name] != value]
+    
+    def save(self, *args, **kwargs):
+        # Write only the columns that changed since the profile was loaded
+        if self.pk and hasattr(self, '_loaded_values') and not (
+            kwargs.get('update_fields') or kwargs.get('force_insert')
+        ):
+            dirty = self.get_dirty_fields()
+            if not dirty:
+                return
+            kwargs['update_fields'] = dirty
+        super().save(*args, **kwargs)
+        self._snapshot()
 
 class Follow(models.Model):
     follower = models.ForeignKey(User, related_name='following', on_delete=models.CASCADE)
@@ -25,6 +71,19 @@ class Follow(models.Model):
     def __str__(self):
         return f'{self.follower.username} follows {self.followed.username}'
 
+class FollowSuggestions(models.Model):
+    # Precomputed "who to follow" list, rebuilt offline by the
+    # build_follow_suggestions command (see blog/suggestions.py)
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='follow_suggestions')
+    suggested_ids = models.JSONField(default=list)
+    computed_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f'Suggestions for {self.user_id}'
+    
+    class Meta:
+        verbose_name_plural = 'Follow suggestions'
+
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
     
@@ -39,6 +98,8 @@ class Category(models.Model):
 
 class Tag(models.Model):
     name = models.CharField(max_length=100, unique=True)
+    # Published posts with this tag, maintained by signals
+    post_count = models.PositiveIntegerField(default=0, editable=False)
     
     def __str__(self):
         return self.name
@@ -46,6 +107,19 @@ class Tag(models.Model):
     def get_absolute_url(self):
         return reverse('tag_posts', kwargs={'name': self.name})
 
+class TagActivity(models.Model):
+    # Times a tag was applied to a published post, bucketed per day
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='activity')
+    day = models.DateField()
+    count = models.PositiveIntegerField(default=0)
+    
+    def __str__(self):
+        return f'{self.tag.name} on {self.day}: {self.count}'
+    
+    class Meta:
+        unique_together = ('tag', 'day')
+        verbose_name_plural = 'Tag activity'
+
 class BlogPost(models.Model):
     STATUS_CHOICES = (
         ('draft', 'Draft'),
@@ -54,6 +128,8 @@ class BlogPost(models.Model):
     
     title = models.CharField(max_length=200)
     content = models.TextField()
+    # Plain-text summary of content, refreshed on save (feeds, listings)
+    excerpt = models.TextField(blank=True, editable=False)
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='blog_posts')
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, related_name='posts')
     created_at = models.DateTimeField(auto_now_add=True)
@@ -62,7 +138,11 @@ class BlogPost(models.Model):
     likes = models.ManyToManyField(User, related_name='liked_posts', blank=True)
     dislikes = models.ManyToManyField(User, related_name='disliked_posts', blank=True)
     view_count = models.PositiveIntegerField(default=0)
+    unique_viewers = models.PositiveIntegerField(default=0, editable=False)
     tags = models.ManyToManyField(Tag, related_name='posts', blank=True)
+    # Watermarks bumped by signals, used as cheap HTTP validators
+    comments_changed_at = models.DateTimeField(default=timezone.now, editable=False)
+    reactions_changed_at = models.DateTimeField(default=timezone.now, editable=False)
     
     def __str__(self):
         return self.title
@@ -70,6 +150,22 @@ class BlogPost(models.Model):
     def get_absolute_url(self):
         return reverse('post_detail', kwargs={'pk': self.pk})
     
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'content' in update_fields:
+            self.excerpt = make_excerpt(self.content)
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'excerpt'}
+        super().save(*args, **kwargs)
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored status so signals can detect publish/unpublish
+        if 'status' in field_names:
+            instance._loaded_status = instance.status
+        return instance
+    
     def total_likes(self):
         return self.likes.count()
     
@@ -79,6 +175,30 @@ class BlogPost(models.Model):
     def total_comments(self):
         return self.comments.count()
 
+# Materialized comment paths: the ids of a comment's ancestors and its own,
+# PATH_STEP base-36 digits each. Ordering by path walks a thread depth
+# first, and a whole subtree is one range on the path index.
+PATH_STEP = 8  # ids below 36 ** 8, about 2.8 trillion
+PATH_MAX_LENGTH = 512
+MAX_COMMENT_DEPTH = PATH_MAX_LENGTH // PATH_STEP
+PATH_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+def path_step(pk):
+    digits = ''
+    while pk:
+        pk, digit = divmod(pk, 36)
+        digits = PATH_DIGITS[digit] + digits
+    return digits.rjust(PATH_STEP, '0')
+
+def path_root_id(path):
+    return int(path[:PATH_STEP], 36)
+
+def subtree(path):
+    # The comment at `path` and everything below it, as an index range. A
+    # prefix match rather than path < path + '~', which depends on where
+    # the collation sorts '~' (MySQL's default puts it before the digits)
+    return models.Q(path__startswith=path)
+
 class Comment(models.Model):
     post = models.ForeignKey(BlogPost, on_delete=models.CASCADE, related_name='comments')
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='user_comments')
@@ -88,10 +208,35 @@ class Comment(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     likes = models.ManyToManyField(User, related_name='liked_comments', blank=True)
     dislikes = models.ManyToManyField(User, related_name='disliked_comments', blank=True)
+    # Stamp of the cached thread fragment; new on every edit, reply or
+    # reaction in the thread (see blog/comment_cache.py)
+    render_version = models.BigIntegerField(default=time.time_ns, editable=False)
+    path = models.CharField(max_length=PATH_MAX_LENGTH, db_index=True, editable=False, default='')
     
     def __str__(self):
         return f'Comment by {self.author.username} on {self.post.title}'
     
+    def save(self, *args, **kwargs):
+        # One transaction, so on_commit hooks never see a comment without
+        # its path and a crash in between leaves no pathless row behind
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+            if not self.path:
+                # The path ends in the comment's own id, known only now
+                self.path = (self.parent.path if self.parent_id else '') + path_step(self.pk)
+                Comment.objects.filter(pk=self.pk).update(path=self.path)
+    
+    @property
+    def depth(self):
+        return len(self.path) // PATH_STEP - 1
+    
+    @property
+    def root_id(self):
+        return path_root_id(self.path)
+    
+    def can_reply(self):
+        return self.depth + 1 < MAX_COMMENT_DEPTH
+    
     def total_likes(self):
         return self.likes.count()
     
@@ -104,9 +249,28 @@ class Comment(models.Model):
     def children(self):
         return Comment.objects.filter(parent=self).order_by('created_at')
     
+    def descendants(self):
+        return Comment.objects.filter(subtree(self.path)).exclude(pk=self.pk).order_by('path')
+    
     def get_absolute_url(self):
         return reverse('post_detail', kwargs={'pk': self.post.pk}) + f'#comment-{self.pk}'
 
+class ViewerSketch(models.Model):
+    # HyperLogLog registers of the readers of a post, one row per day plus
+    # an all-time row (see blog/viewers.py)
+    TOTAL = 'total'
+    
+    post = models.ForeignKey(BlogPost, on_delete=models.CASCADE, related_name='viewer_sketches')
+    bucket = models.CharField(max_length=10)
+    registers = models.BinaryField()
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f'Viewers of {self.post_id} ({self.bucket})'
+    
+    class Meta:
+        unique_together = ('post', 'bucket')
+
 class Notification(models.Model):
     NOTIFICATION_TYPES = (
         ('follow', 'Follow'),
@@ -128,3 +292,124 @@ class Notification(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+
+class DigestWatermark(models.Model):
+    # Newest notification included in the user's last email digest (see
+    # blog/digests.py)
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='digest_watermark')
+    notification_id = models.BigIntegerField(default=0)
+    sent_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f'Digest watermark for {self.user_id}'
+
+class Job(models.Model):
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+    
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    idempotency_key = models.CharField(max_length=200, unique=True, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f'{self.name} #{self.pk} ({self.status})'
+    
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_after'])]
+
+class DraftAutosave(models.Model):
+    # Unsaved editor state of a post (or of a new post when post is null),
+    # written by the autosave endpoint at most once per interval
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='autosaves')
+    post = models.ForeignKey(BlogPost, on_delete=models.CASCADE, null=True, blank=True, related_name='autosaves')
+    title = models.CharField(max_length=200, blank=True)
+    content = models.TextField(blank=True)
+    version = models.PositiveIntegerField(default=0)
+    saved_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f'Autosave v{self.version} by {self.author.username}'
+    
+    class Meta:
+        unique_together = ('author', 'post')
+        constraints = [
+            # NULLs are distinct to the unique_together above
+            models.UniqueConstraint(
+                fields=['author'], condition=models.Q(post__isnull=True), name='unique_new_post_autosave',
+            ),
+        ]
+
+class PostRevision(models.Model):
+    # One saved version of a post. Every few revisions the content is
+    # stored whole, in between as a delta against the previous revision;
+    # both compressed (see blog/revisions.py)
+    KIND_CHOICES = (
+        ('snapshot', 'Snapshot'),
+        ('delta', 'Delta'),
+    )
+    
+    post = models.ForeignKey(BlogPost, on_delete=models.CASCADE, related_name='revisions')
+    number = models.PositiveIntegerField()
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    title = models.CharField(max_length=200)
+    data = models.BinaryField()
+    # Uncompressed content length, for display and storage accounting
+    size = models.PositiveIntegerField()
+    editor = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='post_revisions')
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f'{self.post.title} r{self.number}'
+    
+    class Meta:
+        unique_together = ('post', 'number')
+
+class ArchivedPost(models.Model):
+    # Cold copy of a BlogPost moved out by the archive_posts command. It
+    # keeps the original primary key so old URLs still resolve; tags and
+    # reactions are kept as id lists instead of join-table rows.
+    id = models.BigIntegerField(primary_key=True)
+    title = models.CharField(max_length=200)
+    content = models.TextField()
+    excerpt = models.TextField(blank=True)
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_posts')
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, related_name='archived_posts')
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    status = models.CharField(max_length=10, choices=BlogPost.STATUS_CHOICES)
+    view_count = models.PositiveIntegerField(default=0)
+    unique_viewers = models.PositiveIntegerField(default=0)
+    tag_ids = models.JSONField(default=list)
+    like_ids = models.JSONField(default=list)
+    dislike_ids = models.JSONField(default=list)
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f'{self.title} (archived)'
+    
+    def get_absolute_url(self):
+        return reverse('post_detail', kwargs={'pk': self.pk})
+
+class ArchivedComment(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    post = models.ForeignKey(ArchivedPost, on_delete=models.CASCADE, related_name='comments')
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_comments')
+    content = models.TextField()
+    parent_id = models.BigIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    like_ids = models.JSONField(default=list)
+    dislike_ids = models.JSONField(default=list)
+    
+    def __str__(self):
+        return f'Archived comment by {self.author.username}'
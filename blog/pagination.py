@@ -0,0 +1,54 @@
+# Keyset ("cursor") pagination on the primary key.
+#
+# Unlike Paginator it never counts the whole result set and the cost of a
+# page does not grow with its depth: each page is a single indexed range
+# query starting after the last key of the previous page.
+
+
+class CursorPage:
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def parse_cursor(value):
+    try:
+        cursor = int(value)
+    except (TypeError, ValueError):
+        return None
+    return cursor if cursor > 0 else None
+
+
+def cursor_paginate(queryset, cursor, per_page, descending=True, key='pk'):
+    # `key` must be unique and match the ordering, e.g. 'pk' or a foreign
+    # key id when paginating a through table by the related object
+    cursor = parse_cursor(cursor)
+    if cursor is not None:
+        lookup = f'{key}__lt' if descending else f'{key}__gt'
+        queryset = queryset.filter(**{lookup: cursor})
+    queryset = queryset.order_by(f'-{key}' if descending else key)
+
+    items = list(queryset[:per_page + 1])
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        next_cursor = _key_value(items[-1], key)
+    return CursorPage(items, next_cursor)
+
+
+def _key_value(item, key):
+    if isinstance(item, dict):
+        return item[key]
+    for part in key.split('__'):
+        item = getattr(item, part)
+    return item
@@ -0,0 +1,57 @@
+import json
+import os
+import time
+import uuid
+
+# Per-process JSON files in a shared directory.
+#
+# Each process writes its own cumulative totals to a file of its own, so
+# writers never contend and no lock is needed across processes; readers
+# combine all the files. Files nobody rewrote for RETENTION seconds were
+# left by processes that are gone and are removed.
+
+RETENTION = 60 * 60 * 24 * 7
+
+
+def process_name():
+    # Unique even when a pid is reused after a restart
+    return f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+
+
+def write(root, name, data):
+    os.makedirs(root, exist_ok=True)
+    path = os.path.join(root, f'{name}.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f)
+    os.replace(path + '.tmp', path)
+    remove_stale(root)
+
+
+def remove_stale(root):
+    cutoff = time.time() - RETENTION
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def read_all(root, exclude=None):
+    # The data of every process's file, skipping `exclude` (usually the
+    # caller's own, which it has fresher in memory)
+    try:
+        names = os.listdir(root)
+    except FileNotFoundError:
+        return []
+    found = []
+    for name in names:
+        if not name.endswith('.json') or name == f'{exclude}.json':
+            continue
+        try:
+            with open(os.path.join(root, name)) as f:
+                found.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return found
@@ -0,0 +1,173 @@
+import cProfile
+import json
+import os
+import pstats
+import random
+import re
+import time
+import uuid
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core import signing
+
+# On-demand request profiling.
+#
+# ProfilingMiddleware runs cProfile around the rest of the stack, i.e. the
+# view and its template rendering, for a random PROFILE_SAMPLE_RATE
+# fraction of requests and for any request a superuser marks with a signed
+# `_profile` parameter (see profile_token). Each capture is a pstats dump
+# plus a small JSON description on local disk in PROFILE_ROOT; only the
+# newest PROFILE_KEEP are kept. The admin panel lists them and shows their
+# top functions by cumulative time.
+
+PARAM = '_profile'
+TOKEN_SALT = 'blog.profiling'
+TOKEN_MAX_AGE = 60 * 60 * 24
+PROFILE_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+def profile_root():
+    return getattr(settings, 'PROFILE_ROOT', os.path.join(settings.BASE_DIR, 'profiles'))
+
+
+def sample_rate():
+    return getattr(settings, 'PROFILE_SAMPLE_RATE', 0.0)
+
+
+def keep():
+    return getattr(settings, 'PROFILE_KEEP', 200)
+
+
+def profile_token(user):
+    # Valid for TOKEN_MAX_AGE and only for the superuser it was made for
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign(str(user.pk))
+
+
+def _requested(request):
+    token = request.GET.get(PARAM)
+    user = getattr(request, 'user', None)
+    if not token or user is None or not user.is_superuser:
+        return False
+    try:
+        return signing.TimestampSigner(salt=TOKEN_SALT).unsign(token, max_age=TOKEN_MAX_AGE) == str(user.pk)
+    except signing.BadSignature:
+        return False
+
+
+class ProfilingMiddleware:
+    # Goes after AuthenticationMiddleware, which the signed flag needs
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if _requested(request):
+            reason = 'requested'
+        elif sample_rate() and random.random() < sample_rate():
+            reason = 'sampled'
+        else:
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already running in this process
+            return self.get_response(request)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        save(profiler, request, response, time.perf_counter() - started, reason)
+        return response
+
+
+def save(profiler, request, response, duration, reason):
+    root = profile_root()
+    os.makedirs(root, exist_ok=True)
+    profile_id = uuid.uuid4().hex
+    profiler.dump_stats(os.path.join(root, f'{profile_id}.prof'))
+
+    match = getattr(request, 'resolver_match', None)
+    user = getattr(request, 'user', None)
+    info = {
+        'id': profile_id,
+        'method': request.method,
+        'path': request.path,
+        'view': match.view_name if match else None,
+        'status': response.status_code,
+        'duration_ms': round(duration * 1000, 1),
+        'user': user.username if user is not None and user.is_authenticated else None,
+        'reason': reason,
+        'created_at': time.time(),
+    }
+    # The description is written last, so listed profiles are complete
+    tmp = os.path.join(root, f'{profile_id}.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(info, f)
+    os.replace(tmp, os.path.join(root, f'{profile_id}.json'))
+    prune(root)
+    return info
+
+
+def prune(root=None):
+    root = root or profile_root()
+    profiles = list_profiles(root)
+    for info in profiles[keep():]:
+        for suffix in ('.json', '.prof'):
+            try:
+                os.remove(os.path.join(root, info['id'] + suffix))
+            except FileNotFoundError:
+                pass
+    return max(len(profiles) - keep(), 0)
+
+
+def list_profiles(root=None):
+    # Newest first
+    root = root or profile_root()
+    try:
+        names = os.listdir(root)
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for name in names:
+        if name.endswith('.json') and PROFILE_ID.match(name[:-5]):
+            try:
+                with open(os.path.join(root, name)) as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    profiles.sort(key=lambda info: info['created_at'], reverse=True)
+    for info in profiles:
+        info['captured'] = datetime.fromtimestamp(info['created_at'], tz=timezone.utc)
+    return profiles
+
+
+def load(profile_id, limit=40):
+    # The profile's description and its top functions by cumulative time,
+    # or None
+    if not PROFILE_ID.match(profile_id):
+        return None
+    root = profile_root()
+    try:
+        with open(os.path.join(root, f'{profile_id}.json')) as f:
+            info = json.load(f)
+        stats = pstats.Stats(os.path.join(root, f'{profile_id}.prof'))
+    except (OSError, ValueError):
+        return None
+
+    rows = []
+    for (filename, line, function), (primitive, calls, own, cumulative, _) in stats.stats.items():
+        rows.append({
+            'function': pstats.func_std_string((filename, line, function)),
+            'calls': calls if calls == primitive else f'{calls}/{primitive}',
+            'tottime': own,
+            'cumtime': cumulative,
+            'percall': cumulative / primitive if primitive else 0,
+        })
+    rows.sort(key=lambda row: row['cumtime'], reverse=True)
+    info['functions'] = rows[:limit]
+    info['total_calls'] = stats.total_calls
+    info['total_time'] = stats.total_tt
+    return info
@@ -0,0 +1,212 @@
+import logging
+import os
+import re
+import threading
+import time
+import traceback
+from bisect import bisect_left
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connections
+
+from . import process_files
+
+logger = logging.getLogger(__name__)
+
+# Per-view SQL statistics and a slow-query log.
+#
+# QueryLogMiddleware puts an execute wrapper on the database connections
+# for the duration of each request. Every statement is reduced to a
+# fingerprint (literals and placeholders become ?, IN lists and VALUES
+# rows collapse) and counted per (view name, fingerprint): calls, total
+# and max time, and a fixed histogram of durations from which the p95 is
+# read. Each process holds at most QUERYLOG_MAX_FINGERPRINTS entries and
+# every QUERYLOG_FLUSH_INTERVAL seconds writes its cumulative totals to
+# its own file in QUERYLOG_ROOT (see process_files). The admin panel sums
+# the files of all processes. Statements slower than QUERYLOG_SLOW_MS are
+# logged at WARNING with the project frames of the call stack.
+
+BUCKETS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)  # ms; one more for slower
+OTHER = '(other statements)'
+
+_LITERALS = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'%s'), '?'),
+    (re.compile(r'[`"]s\d+_x\d+[`"]'), '?'),  # savepoint names, quoted for PostgreSQL/SQLite or MySQL
+    (re.compile(r'(?<![\w"`.])-?\d+(?:\.\d+)?(?![\w"`])'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),
+    (re.compile(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+'), '(...)'),
+    (re.compile(r'\s+'), ' '),
+]
+
+
+def querylog_root():
+    return getattr(settings, 'QUERYLOG_ROOT', os.path.join(settings.BASE_DIR, 'querylog'))
+
+
+def slow_ms():
+    return getattr(settings, 'QUERYLOG_SLOW_MS', 100)
+
+
+def flush_interval():
+    return getattr(settings, 'QUERYLOG_FLUSH_INTERVAL', 60)
+
+
+def max_fingerprints():
+    return getattr(settings, 'QUERYLOG_MAX_FINGERPRINTS', 500)
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(sql):
+    # The ORM sends the same SQL text with different params, so this is
+    # mostly a cache hit
+    for pattern, replacement in _LITERALS:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+def percentile(buckets, fraction=0.95):
+    # Upper bound of the bucket holding the percentile; None when it is
+    # the open-ended last bucket
+    target = fraction * sum(buckets)
+    seen = 0
+    for index, count in enumerate(buckets):
+        seen += count
+        if count and seen >= target:
+            return BUCKETS[index] if index < len(BUCKETS) else None
+    return 0
+
+
+def _empty(**fields):
+    return {**fields, 'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'buckets': [0] * (len(BUCKETS) + 1)}
+
+
+def _add(total, entry):
+    total['calls'] += entry['calls']
+    total['total_ms'] += entry['total_ms']
+    total['max_ms'] = max(total['max_ms'], entry['max_ms'])
+    total['buckets'] = [a + b for a, b in zip(total['buckets'], entry['buckets'])]
+
+
+class QueryStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.process = process_files.process_name()
+        self.started_at = time.time()
+        self.flushed_at = time.monotonic()
+
+    def record(self, view, sql, ms):
+        key = (view, fingerprint(sql))
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                if len(self.entries) >= max_fingerprints():
+                    key = (view, OTHER)
+                entry = self.entries.setdefault(key, _empty())
+            entry['calls'] += 1
+            entry['total_ms'] += ms
+            entry['max_ms'] = max(entry['max_ms'], ms)
+            entry['buckets'][bisect_left(BUCKETS, ms)] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return [
+                {'view': view, 'fingerprint': sql, **entry, 'buckets': list(entry['buckets'])}
+                for (view, sql), entry in self.entries.items()
+            ]
+
+    def due(self):
+        return time.monotonic() - self.flushed_at >= flush_interval()
+
+    def flush(self):
+        self.flushed_at = time.monotonic()
+        data = {'process': self.process, 'started_at': self.started_at, 'entries': self.snapshot()}
+        process_files.write(querylog_root(), self.process, data)
+
+
+stats = QueryStats()
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else '-'
+
+
+def _project_stack():
+    # Only the project's own frames say which code issued the query
+    base = str(settings.BASE_DIR)
+    frames = [
+        frame for frame in traceback.extract_stack()[:-3]
+        if frame.filename.startswith(base) and 'site-packages' not in frame.filename
+        and frame.filename != __file__
+    ]
+    return ''.join(traceback.format_list(frames))
+
+
+class _Wrapper:
+    def __init__(self, request):
+        self.request = request
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            ms = (time.perf_counter() - started) * 1000
+            view = _view_name(self.request)
+            stats.record(view, sql, ms)
+            if ms >= slow_ms():
+                logger.warning('Slow query (%.1f ms) in %s: %s\n%s', ms, view, fingerprint(sql), _project_stack())
+
+
+class QueryLogMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        wrapper = _Wrapper(request)
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(wrapper))
+            response = self.get_response(request)
+        if stats.due():
+            stats.flush()
+        return response
+
+
+def load(root=None):
+    # Totals of every process that wrote a file, summed per (view,
+    # fingerprint); returns (entries, earliest start)
+    merged = {}
+    started = []
+    for data in process_files.read_all(root or querylog_root()):
+        started.append(data['started_at'])
+        for entry in data['entries']:
+            key = (entry['view'], entry['fingerprint'])
+            _add(merged.setdefault(key, _empty(view=entry['view'], fingerprint=entry['fingerprint'])), entry)
+    since = datetime.fromtimestamp(min(started), tz=timezone.utc) if started else None
+    return list(merged.values()), since
+
+
+def _finish(entry):
+    entry['avg_ms'] = entry['total_ms'] / entry['calls'] if entry['calls'] else 0
+    entry['p95_ms'] = percentile(entry['buckets'])
+    return entry
+
+
+def top_queries(entries, limit=10):
+    entries = sorted(entries, key=lambda entry: entry['total_ms'], reverse=True)[:limit]
+    return [_finish(dict(entry)) for entry in entries]
+
+
+def top_views(entries, limit=10):
+    views = {}
+    for entry in entries:
+        total = views.setdefault(entry['view'], _empty(view=entry['view'], fingerprints=0))
+        _add(total, entry)
+        total['fingerprints'] += 1
+    return top_queries(views.values(), limit)
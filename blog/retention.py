@@ -0,0 +1,75 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Exists, Max, Min, OuterRef, Q
+from django.utils import timezone
+
+from .models import BlogPost, Follow, Job, Notification, TagActivity
+
+# Retention policies and batched pruning.
+#
+# Notifications get one row per follow, like, comment and reply and are
+# never removed otherwise; finished jobs and daily tag activity pile up
+# the same way. Each policy is a model and a condition. Pruning walks the
+# matching rows in primary-key order: one query finds the pk closing the
+# next batch_size matches, a second deletes the matches in that pk range.
+# Every batch is its own short transaction, so no lock is held for long
+# and replicas apply the deletes a little at a time; --sleep spaces the
+# batches out further. A setting of None turns its policy off.
+#
+# Notifications of deleted posts and comments go with them (CASCADE).
+# What remains of deleted content are follow and like notifications whose
+# follow or like was undone.
+
+def _days_ago(name, default):
+    days = getattr(settings, name, default)
+    return None if days is None else timezone.now() - timedelta(days=days)
+
+
+def _withdrawn():
+    follow = Follow.objects.filter(follower=OuterRef('sender'), followed=OuterRef('recipient'))
+    like = BlogPost.likes.through.objects.filter(blogpost=OuterRef('post'), user=OuterRef('sender'))
+    return (
+        (Q(notification_type='follow') & ~Exists(follow))
+        | (Q(notification_type='like_post') & ~Exists(like))
+    )
+
+
+def policies():
+    # (name, model, condition) of the policies in effect
+    found = []
+    read_before = _days_ago('NOTIFICATION_READ_RETENTION_DAYS', 90)
+    if read_before is not None:
+        found.append(('read notifications', Notification, Q(is_read=True, created_at__lt=read_before)))
+    if getattr(settings, 'NOTIFICATION_PRUNE_WITHDRAWN', True):
+        found.append(('withdrawn notifications', Notification, _withdrawn()))
+    finished_before = _days_ago('JOB_RETENTION_DAYS', 14)
+    if finished_before is not None:
+        found.append(('finished jobs', Job, Q(status='done', finished_at__lt=finished_before)))
+    active_before = _days_ago('TAG_ACTIVITY_RETENTION_DAYS', 90)
+    if active_before is not None:
+        found.append(('tag activity', TagActivity, Q(day__lt=active_before.date())))
+    return found
+
+
+def prune(model, condition, batch_size=1000, sleep=0):
+    # Deletes the rows matching condition; returns (rows, seconds)
+    started = time.perf_counter()
+    matching = model.objects.filter(condition)
+    bounds = model.objects.aggregate(low=Min('pk'), high=Max('pk'))
+    if bounds['low'] is None:
+        return 0, time.perf_counter() - started
+    start, high = bounds['low'], bounds['high']
+    deleted = 0
+    while start <= high:
+        end = matching.filter(pk__gte=start, pk__lte=high).order_by('pk').values_list('pk', flat=True)
+        end = end[batch_size - 1:batch_size].first()
+        batch = matching.filter(pk__gte=start, pk__lte=high if end is None else end)
+        deleted += batch.delete()[0]
+        if end is None:
+            break
+        start = end + 1
+        if sleep:
+            time.sleep(sleep)
+    return deleted, time.perf_counter() - started
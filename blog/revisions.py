@@ -0,0 +1,169 @@
+import difflib
+import json
+import zlib
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Q
+
+from .models import BlogPost, PostRevision
+
+# Compressed revision history for posts.
+#
+# Revisions are numbered per post. A revision is either a snapshot (the
+# whole content) or a line delta against the previous revision, always
+# zlib-compressed. A snapshot is forced every SNAPSHOT_EVERY revisions, so
+# rebuilding any version replays at most SNAPSHOT_EVERY - 1 deltas. Only
+# the newest POST_MAX_REVISIONS per post are kept.
+#
+# Delta format: a JSON list where a positive int copies that many lines
+# from the base, a negative int skips that many, and a list of strings
+# inserts those lines.
+
+SNAPSHOT_EVERY = 10
+
+
+def max_revisions():
+    return getattr(settings, 'POST_MAX_REVISIONS', 50)
+
+
+def _compress(value):
+    return zlib.compress(value.encode(), 6)
+
+
+def _decompress(data):
+    return zlib.decompress(bytes(data)).decode()
+
+
+def make_delta(old, new):
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    ops = []
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append(i2 - i1)
+            continue
+        if i2 > i1:
+            ops.append(i1 - i2)
+        if j2 > j1:
+            ops.append(new_lines[j1:j2])
+    return ops
+
+
+def apply_delta(base, ops):
+    lines = base.splitlines(keepends=True)
+    out = []
+    position = 0
+    for op in ops:
+        if isinstance(op, list):
+            out.extend(op)
+        elif op > 0:
+            out.extend(lines[position:position + op])
+            position += op
+        else:
+            position -= op
+    return ''.join(out)
+
+
+def _replay(post, numbers):
+    # Rebuilds the requested revision numbers in one pass, starting from
+    # the last snapshot at or before the oldest of them
+    low, high = min(numbers), max(numbers)
+    start = post.revisions.filter(kind='snapshot', number__lte=low).aggregate(start=Max('number'))['start']
+    if start is None:
+        raise PostRevision.DoesNotExist(f'No revision {low} for post {post.pk}')
+
+    rows = post.revisions.filter(number__gte=start, number__lte=high).order_by('number')
+    found = {}
+    content = None
+    for number, kind, data in rows.values_list('number', 'kind', 'data'):
+        if kind == 'snapshot':
+            content = _decompress(data)
+        else:
+            content = apply_delta(content, json.loads(_decompress(data)))
+        if number in numbers:
+            found[number] = content
+
+    missing = set(numbers) - set(found)
+    if missing:
+        raise PostRevision.DoesNotExist(f'No revision {min(missing)} for post {post.pk}')
+    return found
+
+
+def content_at(post, number):
+    return _replay(post, {number})[number]
+
+
+def diff(post, old_number, new_number):
+    contents = _replay(post, {old_number, new_number})
+    return ''.join(difflib.unified_diff(
+        contents[old_number].splitlines(keepends=True),
+        contents[new_number].splitlines(keepends=True),
+        fromfile=f'r{old_number}',
+        tofile=f'r{new_number}',
+    ))
+
+
+def record(post, editor=None):
+    # Stores the post's current title and content as a new revision, unless
+    # they match the latest one. Returns the revision or None.
+    with transaction.atomic():
+        # Serialize concurrent saves of the same post on its row lock
+        BlogPost.objects.select_for_update().filter(pk=post.pk).values_list('pk', flat=True).get()
+        latest = post.revisions.aggregate(
+            last=Max('number'), last_snapshot=Max('number', filter=Q(kind='snapshot'))
+        )
+        number = (latest['last'] or 0) + 1
+        kind, data = 'snapshot', _compress(post.content)
+
+        if latest['last']:
+            title = post.revisions.filter(number=latest['last']).values_list('title', flat=True).get()
+            previous = content_at(post, latest['last'])
+            if (title, previous) == (post.title, post.content):
+                return None
+            if number - latest['last_snapshot'] < SNAPSHOT_EVERY:
+                delta = _compress(json.dumps(make_delta(previous, post.content), separators=(',', ':')))
+                # A rewrite can make the delta larger than the text itself
+                if len(delta) < len(data):
+                    kind, data = 'delta', delta
+
+        revision = PostRevision.objects.create(
+            post=post, number=number, kind=kind, title=post.title, data=data,
+            size=len(post.content), editor=editor,
+        )
+        if number > max_revisions():
+            prune(post)
+    return revision
+
+
+def ensure_baseline(post):
+    # Posts written before revisions existed get their current text as r1
+    # before the first edit overwrites it
+    if not post.revisions.exists():
+        record(post, post.author)
+
+
+def prune(post, keep=None):
+    keep = keep or max_revisions()
+    numbers = list(post.revisions.order_by('-number').values_list('number', flat=True)[keep - 1:keep])
+    cutoff = numbers[0] if numbers else None
+    if cutoff is None or not post.revisions.filter(number__lt=cutoff).exists():
+        return 0
+
+    # The oldest kept revision must stand on its own once its base is gone
+    oldest = post.revisions.get(number=cutoff)
+    if oldest.kind == 'delta':
+        oldest.data = _compress(content_at(post, cutoff))
+        oldest.kind = 'snapshot'
+        oldest.save(update_fields=['kind', 'data'])
+    deleted, _ = post.revisions.filter(number__lt=cutoff).delete()
+    return deleted
+
+
+def restore(post, number, editor):
+    revision = post.revisions.only('title').get(number=number)
+    post.title = revision.title
+    post.content = content_at(post, number)
+    post.save(update_fields=['title', 'content', 'updated_at'])
+    return record(post, editor)
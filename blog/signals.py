@@ -1,7 +1,16 @@
-from django.db.models.signals import post_save, m2m_changed
+from functools import partial
+
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F
 from django.dispatch import receiver
-from .models import Profile, BlogPost, Comment, Notification, Follow
+from django.utils import timezone
+from . import live, typeahead
+from .comment_cache import restamp, thread_roots
+from .jobs import notify
+from .models import Profile, BlogPost, Comment, Follow, Tag
+from .tag_stats import adjust_post_counts
 
 @receiver(post_save, sender=User)
 def create_profile(sender, instance, created, **kwargs):
@@ -9,15 +18,32 @@ def create_profile(sender, instance, created, **kwargs):
         Profile.objects.create(user=instance)
 
 @receiver(post_save, sender=User)
-def save_profile(sender, instance, **kwargs):
-    instance.profile.save()
+def save_profile(sender, instance, created, **kwargs):
+    # Only a profile already loaded alongside the user can have pending
+    # changes; Profile.save() itself skips clean instances
+    if not created and User.profile.is_cached(instance):
+        instance.profile.save()
+
+@receiver(post_save, sender=Follow)
+def count_follow(sender, instance, created, **kwargs):
+    if created:
+        Profile.objects.filter(user_id=instance.followed_id).update(followers_count=F('followers_count') + 1)
+        Profile.objects.filter(user_id=instance.follower_id).update(following_count=F('following_count') + 1)
+
+@receiver(post_delete, sender=Follow)
+def uncount_follow(sender, instance, **kwargs):
+    Profile.objects.filter(user_id=instance.followed_id, followers_count__gt=0).update(
+        followers_count=F('followers_count') - 1)
+    Profile.objects.filter(user_id=instance.follower_id, following_count__gt=0).update(
+        following_count=F('following_count') - 1)
 
 @receiver(post_save, sender=Follow)
 def create_follow_notification(sender, instance, created, **kwargs):
     if created:
-        Notification.objects.create(
-            recipient=instance.followed,
-            sender=instance.follower,
+        notify(
+            f'follow:{instance.pk}',
+            recipient_id=instance.followed_id,
+            sender_id=instance.follower_id,
             notification_type='follow'
         )
 
@@ -25,37 +51,218 @@ def create_follow_notification(sender, instance, created, **kwargs):
 def create_comment_notification(sender, instance, created, **kwargs):
     if created:
         # If it's a reply to another comment
-        if instance.parent:
+        if instance.parent_id:
             # Notify the parent comment author
-            if instance.parent.author != instance.author:
-                Notification.objects.create(
-                    recipient=instance.parent.author,
-                    sender=instance.author,
+            if instance.parent.author_id != instance.author_id:
+                notify(
+                    f'comment:{instance.pk}',
+                    recipient_id=instance.parent.author_id,
+                    sender_id=instance.author_id,
                     notification_type='reply',
-                    post=instance.post,
-                    comment=instance
+                    post_id=instance.post_id,
+                    comment_id=instance.pk
                 )
         # If it's a direct comment on a post
         else:
             # Notify the post author
-            if instance.post.author != instance.author:
-                Notification.objects.create(
-                    recipient=instance.post.author,
-                    sender=instance.author,
+            if instance.post.author_id != instance.author_id:
+                notify(
+                    f'comment:{instance.pk}',
+                    recipient_id=instance.post.author_id,
+                    sender_id=instance.author_id,
                     notification_type='comment',
-                    post=instance.post,
-                    comment=instance
+                    post_id=instance.post_id,
+                    comment_id=instance.pk
                 )
 
 @receiver(m2m_changed, sender=BlogPost.likes.through)
-def create_post_like_notification(sender, instance, action, pk_set, **kwargs):
-    if action == 'post_add':
+def create_post_like_notification(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'post_add' and not reverse:
+        # One notification per reader and day: unliking and liking again
+        # doesn't notify twice, a like on another day does
+        day = timezone.localdate().isoformat()
         for pk in pk_set:
-            user = User.objects.get(pk=pk)
-            if user != instance.author:
-                Notification.objects.create(
-                    recipient=instance.author,
-                    sender=user,
+            if pk != instance.author_id:
+                notify(
+                    f'like_post:{instance.pk}:{pk}:{day}',
+                    recipient_id=instance.author_id,
+                    sender_id=pk,
                     notification_type='like_post',
-                    post=instance
-                ) 
\ No newline at end of file
+                    post_id=instance.pk
+                )
+
+# Live updates for readers of the post (see blog/live.py)
+@receiver(post_save, sender=Comment)
+def publish_new_comment(sender, instance, created, **kwargs):
+    if created:
+        post_id, comment_id = instance.post_id, instance.pk
+        transaction.on_commit(lambda: live.publish(post_id, {'type': 'comment', 'id': comment_id}))
+
+@receiver(m2m_changed, sender=BlogPost.likes.through)
+@receiver(m2m_changed, sender=BlogPost.dislikes.through)
+def publish_post_reactions(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    post_ids = (pk_set or ()) if reverse else [instance.pk]
+    for post_id in post_ids:
+        transaction.on_commit(lambda post_id=post_id: live.publish(post_id, {'type': 'reactions'}))
+
+@receiver(m2m_changed, sender=Comment.likes.through)
+@receiver(m2m_changed, sender=Comment.dislikes.through)
+def publish_comment_reactions(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear') or reverse:
+        return
+    post_id, comment_id = instance.post_id, instance.pk
+    transaction.on_commit(lambda: live.publish(post_id, {'type': 'comment_reactions', 'id': comment_id}))
+
+# Watermarks used for conditional GET on post and listing pages
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def touch_post_comments(sender, instance, origin=None, **kwargs):
+    # Comments deleted along with their post leave nothing to touch
+    if isinstance(origin, BlogPost) or getattr(origin, 'model', None) is BlogPost:
+        return
+    BlogPost.objects.filter(pk=instance.post_id).update(comments_changed_at=timezone.now())
+
+@receiver(m2m_changed, sender=BlogPost.likes.through)
+@receiver(m2m_changed, sender=BlogPost.dislikes.through)
+def touch_post_reactions(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        posts = BlogPost.objects.filter(pk=instance.pk)
+    elif pk_set:
+        posts = BlogPost.objects.filter(pk__in=pk_set)
+    else:
+        return
+    posts.update(reactions_changed_at=timezone.now())
+
+@receiver(m2m_changed, sender=Comment.likes.through)
+@receiver(m2m_changed, sender=Comment.dislikes.through)
+def touch_comment_reactions(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        posts = BlogPost.objects.filter(pk=instance.post_id)
+    elif pk_set:
+        posts = BlogPost.objects.filter(comments__in=pk_set)
+    else:
+        return
+    posts.update(reactions_changed_at=timezone.now())
+
+# Cached comment thread fragments (see blog/comment_cache.py)
+@receiver(post_save, sender=Comment)
+def restamp_thread_on_save(sender, instance, created, **kwargs):
+    # A new top-level comment starts its own thread with a fresh stamp; a
+    # new reply has no path yet, so its thread is found from the parent
+    if not created:
+        restamp([instance.root_id])
+    elif instance.parent_id:
+        restamp(thread_roots([instance.parent_id]))
+
+@receiver(post_delete, sender=Comment)
+def restamp_thread_on_delete(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, BlogPost) or getattr(origin, 'model', None) is BlogPost:
+        return
+    # Replies deleted along with an ancestor are covered by the ancestor
+    if isinstance(origin, Comment) and origin.pk != instance.pk:
+        return
+    if instance.parent_id and instance.path:
+        restamp([instance.root_id])
+
+@receiver(m2m_changed, sender=Comment.likes.through)
+@receiver(m2m_changed, sender=Comment.dislikes.through)
+def restamp_thread_on_reaction(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        restamp([instance.root_id])
+    elif pk_set:
+        restamp(thread_roots(pk_set))
+
+# Tag usage counters (published posts per tag) and daily tag activity
+@receiver(pre_save, sender=BlogPost)
+def remember_status(sender, instance, **kwargs):
+    # Instances loaded from the database already know their stored status
+    if instance.pk and not hasattr(instance, '_loaded_status'):
+        instance._loaded_status = BlogPost.objects.filter(pk=instance.pk).values_list('status', flat=True).first()
+
+@receiver(post_save, sender=BlogPost)
+def count_tags_on_status_change(sender, instance, created, **kwargs):
+    was_published = not created and getattr(instance, '_loaded_status', None) == 'published'
+    is_published = instance.status == 'published'
+    instance._loaded_status = instance.status
+    
+    # A freshly created post has no tags yet; they arrive through m2m_changed
+    if created or was_published == is_published:
+        return
+    tag_ids = list(instance.tags.values_list('id', flat=True))
+    adjust_post_counts(tag_ids, 1 if is_published else -1)
+
+@receiver(pre_delete, sender=BlogPost)
+def count_tags_on_delete(sender, instance, **kwargs):
+    if instance.status == 'published':
+        adjust_post_counts(list(instance.tags.values_list('id', flat=True)), -1)
+
+@receiver(m2m_changed, sender=BlogPost.tags.through)
+def count_tag_changes(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('pre_remove', 'pre_clear'):
+        # Only links that exist count, so resolve them before they go
+        if not reverse:
+            removed = instance.tags.all() if instance.status == 'published' else instance.tags.none()
+            if pk_set is not None:
+                removed = removed.filter(pk__in=pk_set)
+            instance._removed_tag_counts = list(removed.values_list('id', flat=True))
+        else:
+            posts = instance.posts.filter(status='published')
+            if pk_set is not None:
+                posts = posts.filter(pk__in=pk_set)
+            instance._removed_tag_counts = {instance.pk: posts.count()}
+    elif action in ('post_remove', 'post_clear'):
+        adjust_post_counts(getattr(instance, '_removed_tag_counts', []), -1)
+        instance._removed_tag_counts = []
+    elif action == 'post_add':
+        if not reverse:
+            if instance.status == 'published':
+                adjust_post_counts(list(pk_set), 1)
+        else:
+            published = BlogPost.objects.filter(pk__in=pk_set, status='published').count()
+            adjust_post_counts({instance.pk: published}, 1)
+
+# Typeahead index, changed once the data is committed
+@receiver(post_save, sender=BlogPost)
+def index_post(sender, instance, **kwargs):
+    if instance.status == 'published':
+        transaction.on_commit(partial(typeahead.put, 'posts', instance.pk, instance.title, instance.view_count))
+    else:
+        transaction.on_commit(partial(typeahead.remove, 'posts', instance.pk))
+
+@receiver(post_save, sender=Tag)
+def index_tag(sender, instance, **kwargs):
+    transaction.on_commit(partial(typeahead.put, 'tags', instance.pk, instance.name))
+
+@receiver(post_save, sender=User)
+def index_user(sender, instance, update_fields=None, **kwargs):
+    # Logins save last_login only
+    if update_fields is not None and not {'username', 'is_active'} & set(update_fields):
+        return
+    if instance.is_active:
+        transaction.on_commit(partial(typeahead.put, 'users', instance.pk, instance.username))
+    else:
+        transaction.on_commit(partial(typeahead.remove, 'users', instance.pk))
+
+@receiver(post_delete, sender=BlogPost)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=User)
+def unindex(sender, instance, **kwargs):
+    kind = {BlogPost: 'posts', Tag: 'tags', User: 'users'}[sender]
+    transaction.on_commit(partial(typeahead.remove, kind, instance.pk))
+
+@receiver(post_save, sender=Follow)
+def index_follow(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(partial(typeahead.rescore, 'users', instance.followed_id, 1))
+
+@receiver(post_delete, sender=Follow)
+def index_unfollow(sender, instance, **kwargs):
+    transaction.on_commit(partial(typeahead.rescore, 'users', instance.followed_id, -1))
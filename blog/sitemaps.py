@@ -0,0 +1,223 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.db.models import Count, Max
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import BlogPost, Category, Profile, Tag
+
+# Sharded sitemaps, written to disk by the build_sitemaps command.
+#
+# Every section is split into shards by primary-key range, so a shard holds
+# at most SITEMAP_SHARD_SIZE URLs (well under the 50k limit) and its
+# boundaries never move when rows are added or deleted. Shards are streamed
+# from a keyset-ordered .iterator() straight into gzip files, and a manifest
+# remembers a signature per shard so incremental runs only rewrite shards
+# whose rows changed.
+
+MAX_URLS_PER_SHARD = 50000
+MANIFEST = 'manifest.json'
+INDEX = 'sitemap.xml'
+SHARD_NAME = re.compile(r'^sitemap-[a-z]+-\d{4,}\.xml\.gz$')
+
+
+def sitemap_root():
+    return getattr(settings, 'SITEMAP_ROOT', os.path.join(settings.BASE_DIR, 'sitemaps'))
+
+
+def shard_size():
+    return min(getattr(settings, 'SITEMAP_SHARD_SIZE', 10000), MAX_URLS_PER_SHARD)
+
+
+def site_url():
+    return getattr(settings, 'SITE_URL', 'http://localhost:8000').rstrip('/')
+
+
+def _pk_url(view_name):
+    # reverse() once and format per row; reversing a million posts one by
+    # one costs more than writing them
+    marker = 987654321
+    return reverse(view_name, kwargs={'pk': marker}).replace(str(marker), '{}')
+
+
+class Section:
+    # Sections with a modification timestamp can be compared against the
+    # manifest with one aggregate per shard; the others are hashed while
+    # they stream
+    lastmod_field = None
+
+    def __init__(self, name):
+        self.name = name
+
+    def queryset(self):
+        raise NotImplementedError
+
+    def rows(self, queryset):
+        raise NotImplementedError
+
+
+class PostSection(Section):
+    lastmod_field = 'updated_at'
+
+    def queryset(self):
+        return BlogPost.objects.filter(status='published')
+
+    def rows(self, queryset):
+        url = site_url() + _pk_url('post_detail')
+        for pk, updated_at in queryset.values_list('pk', 'updated_at').iterator(chunk_size=2000):
+            yield url.format(pk), updated_at
+
+
+class CategorySection(Section):
+    def queryset(self):
+        return Category.objects.all()
+
+    def rows(self, queryset):
+        for category in queryset.only('name').iterator(chunk_size=2000):
+            yield site_url() + category.get_absolute_url(), None
+
+
+class TagSection(Section):
+    def queryset(self):
+        # Tags without published posts lead to empty pages
+        return Tag.objects.filter(post_count__gt=0)
+
+    def rows(self, queryset):
+        for tag in queryset.only('name').iterator(chunk_size=2000):
+            yield site_url() + tag.get_absolute_url(), None
+
+
+class ProfileSection(Section):
+    def queryset(self):
+        return Profile.objects.filter(user__is_active=True)
+
+    def rows(self, queryset):
+        for username in queryset.values_list('user__username', flat=True).iterator(chunk_size=2000):
+            yield site_url() + reverse('user_profile', kwargs={'username': username}), None
+
+
+SECTIONS = [PostSection('posts'), CategorySection('categories'), TagSection('tags'), ProfileSection('profiles')]
+
+
+def shard_name(section, number):
+    return f'sitemap-{section.name}-{number:04d}.xml.gz'
+
+
+def _write_shard(path, rows):
+    # Streams rows into a temporary gzip file; returns the URL count and a
+    # digest of the content so unchanged shards can be detected
+    digest = hashlib.md5(usedforsecurity=False)
+    count = 0
+    tmp = path + '.tmp'
+    with gzip.open(tmp, 'wt', encoding='utf-8') as out:
+        out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        out.write('<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+        for loc, lastmod in rows:
+            entry = f'<url><loc>{escape(loc)}</loc>'
+            if lastmod:
+                entry += f'<lastmod>{lastmod.isoformat()}</lastmod>'
+            entry += '</url>\n'
+            out.write(entry)
+            digest.update(entry.encode())
+            count += 1
+        out.write('</urlset>\n')
+    return tmp, count, digest.hexdigest()
+
+
+def _load_manifest(root):
+    try:
+        with open(os.path.join(root, MANIFEST)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _save_json(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def build(full=False, root=None, size=None):
+    root = root or sitemap_root()
+    size = size or shard_size()
+    os.makedirs(root, exist_ok=True)
+
+    manifest = _load_manifest(root)
+    if manifest.get('shard_size') != size:
+        full = True
+    previous = {} if full else manifest.get('shards', {})
+    shards = {}
+    stats = {'written': 0, 'unchanged': 0, 'removed': 0}
+
+    for section in SECTIONS:
+        base = section.queryset()
+        last_pk = base.aggregate(last=Max('pk'))['last'] or 0
+        for number in range(last_pk // size + 1 if last_pk else 0):
+            name = shard_name(section, number)
+            path = os.path.join(root, name)
+            queryset = base.filter(pk__gte=number * size, pk__lt=(number + 1) * size).order_by('pk')
+            known = previous.get(name)
+
+            signature = None
+            if section.lastmod_field:
+                summary = queryset.aggregate(urls=Count('pk'), lastmod=Max(section.lastmod_field))
+                if not summary['urls']:
+                    continue
+                signature = f"{summary['urls']}:{summary['lastmod'].isoformat()}"
+                if known and known['signature'] == signature and os.path.exists(path):
+                    shards[name] = known
+                    stats['unchanged'] += 1
+                    continue
+
+            tmp, count, digest = _write_shard(path, section.rows(queryset))
+            if not count:
+                _remove(tmp)
+                continue
+            signature = signature or digest
+            if known and known['signature'] == signature and os.path.exists(path):
+                _remove(tmp)
+                shards[name] = known
+                stats['unchanged'] += 1
+                continue
+
+            os.replace(tmp, path)
+            lastmod = summary['lastmod'] if section.lastmod_field else timezone.now()
+            shards[name] = {'signature': signature, 'urls': count, 'lastmod': lastmod.isoformat()}
+            stats['written'] += 1
+
+    # Shards that emptied out, or belong to an old shard size, go away
+    for name in set(manifest.get('shards', {})) - set(shards):
+        _remove(os.path.join(root, name))
+        stats['removed'] += 1
+
+    _write_index(root, shards)
+    _save_json(os.path.join(root, MANIFEST), {'shard_size': size, 'shards': shards})
+    return stats
+
+
+def _write_index(root, shards):
+    path = os.path.join(root, INDEX)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as out:
+        out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        out.write('<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+        for name in sorted(shards):
+            loc = site_url() + reverse('sitemap_shard', kwargs={'name': name})
+            out.write(f"<sitemap><loc>{escape(loc)}</loc><lastmod>{shards[name]['lastmod']}</lastmod></sitemap>\n")
+        out.write('</sitemapindex>\n')
+    os.replace(tmp, path)
@@ -44,8 +44,8 @@ $(document).ready(function() {
         });
     });
     
-    // Like/Dislike Comment
-    $('.comment-like-btn, .comment-dislike-btn').on('click', function(e) {
+    // Like/Dislike Comment (delegated: comments are also loaded later)
+    $(document).on('click', '.comment-like-btn, .comment-dislike-btn', function(e) {
         e.preventDefault();
         
         const button = $(this);
@@ -83,13 +83,74 @@ $(document).ready(function() {
         });
     });
     
-    // Toggle reply form
-    $('.reply-toggle-btn').on('click', function(e) {
+    // Toggle reply form: one form on the page, moved under the comment
+    $(document).on('click', '.reply-toggle-btn', function(e) {
         e.preventDefault();
-        const commentId = $(this).data('comment-id');
-        $(`#reply-form-${commentId}`).toggle();
+        const form = $('#reply-form');
+        const url = $(this).data('reply-url');
+        if (form.is(':visible') && form.find('form').attr('action') === url) {
+            form.hide();
+            return;
+        }
+        form.find('form').attr('action', url);
+        form.insertAfter($(this).closest('.comment-actions')).show();
+    });
+    
+    // Light up the viewer's own reactions on the shared comment markup
+    const commentReactions = $('#comment-reactions').length ? JSON.parse($('#comment-reactions').text()) : null;
+    
+    function showCommentReactions(container) {
+        if (!commentReactions) return;
+        commentReactions.liked.forEach(function(id) {
+            container.find(`.comment-like-btn[data-comment-id="${id}"]`).addClass('text-primary').removeClass('text-secondary');
+        });
+        commentReactions.disliked.forEach(function(id) {
+            container.find(`.comment-dislike-btn[data-comment-id="${id}"]`).addClass('text-danger').removeClass('text-secondary');
+        });
+    }
+    showCommentReactions($('.comments-list'));
+    
+    // Load more comment threads, or more replies of a thread
+    $(document).on('click', '.load-more-comments', function(e) {
+        e.preventDefault();
+        
+        const link = $(this);
+        if (link.data('loading')) return;
+        link.data('loading', true);
+        
+        $.getJSON(link.data('url'), function(data) {
+            const added = $($.parseHTML(data.html)).filter(function() {
+                // Skip anything a live update already put on the page
+                return !this.id || !$(`#${this.id}`).length;
+            });
+            showCommentReactions(added);
+            link.before(added);
+            if (data.next) {
+                link.data('url', data.next);
+                if (commentsObserver && link.is('#load-more-comments')) {
+                    // Re-observe so a link still on screen loads the next page too
+                    commentsObserver.unobserve(link[0]);
+                    commentsObserver.observe(link[0]);
+                }
+            } else {
+                link.remove();
+            }
+        }).always(function() {
+            link.data('loading', false);
+        });
     });
     
+    // Fetch the next page of threads when the reader scrolls near the end
+    let commentsObserver = null;
+    if (window.IntersectionObserver && $('#load-more-comments').length) {
+        commentsObserver = new IntersectionObserver(function(entries) {
+            if (entries[0].isIntersecting) {
+                $('#load-more-comments').trigger('click');
+            }
+        }, {rootMargin: '400px'});
+        commentsObserver.observe($('#load-more-comments')[0]);
+    }
+    
     // Character counter for comment/reply forms
     $('.comment-input').on('input', function() {
         const maxLength = 500;
@@ -113,6 +174,72 @@ $(document).ready(function() {
         }
     });
     
+    // Navbar typeahead: grouped suggestions while typing
+    const searchInput = $('#navbar-search input[name="query"]');
+    const suggestMenu = $('#navbar-search .typeahead-menu');
+    const suggestGroups = {posts: 'Posts', tags: 'Tags', users: 'People'};
+    let suggestTimer = null;
+    let suggestRequest = null;
+    
+    function hideSuggestions() {
+        suggestMenu.removeClass('show').empty();
+    }
+    
+    searchInput.on('input', function() {
+        clearTimeout(suggestTimer);
+        const query = searchInput.val().trim();
+        if (!query) {
+            hideSuggestions();
+            return;
+        }
+        suggestTimer = setTimeout(function() {
+            if (suggestRequest) {
+                suggestRequest.abort();
+            }
+            suggestRequest = $.getJSON(searchInput.data('suggest-url'), {q: query}, function(data) {
+                suggestMenu.empty();
+                $.each(suggestGroups, function(kind, title) {
+                    if (!data[kind].length) {
+                        return;
+                    }
+                    suggestMenu.append($('<h6 class="dropdown-header"></h6>').text(title));
+                    data[kind].forEach(function(item) {
+                        suggestMenu.append($('<a class="dropdown-item" role="option"></a>').attr('href', item.url).text(item.label));
+                    });
+                });
+                suggestMenu.toggleClass('show', suggestMenu.children().length > 0);
+            });
+        }, 100);
+    });
+    
+    searchInput.on('keydown', function(e) {
+        if (e.key === 'ArrowDown' && suggestMenu.hasClass('show')) {
+            e.preventDefault();
+            suggestMenu.find('.dropdown-item').first().trigger('focus');
+        } else if (e.key === 'Escape') {
+            hideSuggestions();
+        }
+    });
+    
+    suggestMenu.on('keydown', '.dropdown-item', function(e) {
+        const items = suggestMenu.find('.dropdown-item');
+        const index = items.index(this);
+        if (e.key === 'ArrowDown' || e.key === 'ArrowUp') {
+            e.preventDefault();
+            const next = index + (e.key === 'ArrowDown' ? 1 : -1);
+            (next < 0 ? searchInput : items.eq(next)).trigger('focus');
+        } else if (e.key === 'Escape') {
+            hideSuggestions();
+            searchInput.trigger('focus');
+        }
+    });
+    
+    $(document).on('click', function(e) {
+        if (!$(e.target).closest('#navbar-search').length) {
+            hideSuggestions();
+        }
+    });
+    
     // Initialize tooltips
     const tooltipTriggerList = document.querySelectorAll('[data-bs-toggle="tooltip"]')
     const tooltipList = [...tooltipTriggerList].map(tooltipTriggerEl => new bootstrap.Tooltip(tooltipTriggerEl));
@@ -0,0 +1,83 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import Tag, TagActivity
+
+# Denormalized tag statistics.
+#
+# Tag.post_count and the daily TagActivity buckets are kept up to date by
+# the signals in blog/signals.py, so popular and trending tags never need
+# a GROUP BY over the BlogPost.tags join table.
+
+TRENDING_CACHE_TIMEOUT = 60 * 10
+
+
+def adjust_post_counts(tag_counts, sign, activity=True):
+    # tag_counts maps tag id -> number of published posts gained or lost;
+    # activity=False for moves that are not new tagging (archive restores)
+    by_amount = {}
+    for tag_id, amount in Counter(tag_counts).items():
+        if amount:
+            by_amount.setdefault(amount, []).append(tag_id)
+
+    for amount, tag_ids in by_amount.items():
+        tags = Tag.objects.filter(pk__in=tag_ids)
+        if sign > 0:
+            tags.update(post_count=F('post_count') + amount)
+        else:
+            tags.filter(post_count__gte=amount).update(post_count=F('post_count') - amount)
+
+    if sign > 0 and activity:
+        record_activity(tag_counts)
+
+
+def record_activity(tag_counts):
+    today = timezone.now().date()
+    tag_counts = {tag_id: amount for tag_id, amount in Counter(tag_counts).items() if amount}
+    if not tag_counts:
+        return
+
+    # Create missing buckets first so the increment below is race-free
+    TagActivity.objects.bulk_create(
+        [TagActivity(tag_id=tag_id, day=today) for tag_id in tag_counts],
+        ignore_conflicts=True,
+    )
+    by_amount = {}
+    for tag_id, amount in tag_counts.items():
+        by_amount.setdefault(amount, []).append(tag_id)
+    for amount, tag_ids in by_amount.items():
+        TagActivity.objects.filter(tag_id__in=tag_ids, day=today).update(count=F('count') + amount)
+
+
+def trending_tags(days=7, limit=10):
+    key = f'tags:trending:{days}:{limit}'
+    tags = cache.get(key)
+    if tags is None:
+        since = timezone.now().date() - timedelta(days=days - 1)
+        tags = list(
+            TagActivity.objects.filter(day__gte=since)
+            .values('tag__name')
+            .annotate(activity=Sum('count'))
+            .order_by('-activity', 'tag__name')[:limit]
+        )
+        tags = [{'name': tag['tag__name'], 'activity': tag['activity']} for tag in tags]
+        cache.set(key, tags, TRENDING_CACHE_TIMEOUT)
+    return tags
+
+
+def tag_cloud(limit=50, steps=5):
+    tags = list(
+        Tag.objects.filter(post_count__gt=0)
+        .order_by('-post_count', 'name')
+        .values('name', 'post_count')[:limit]
+    )
+    if tags:
+        low, high = tags[-1]['post_count'], tags[0]['post_count']
+        spread = max(high - low, 1)
+        for tag in tags:
+            tag['weight'] = 1 + round((tag['post_count'] - low) * (steps - 1) / spread)
+    return tags
@@ -1,3 +1,1769 @@
-from django.test import TestCase
+import asyncio
+import importlib
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+import zlib
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Q
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import archive, autosave, comment_cache, conditional, digests, facets, jobs, live, metrics, models, profiling, querylog, retention, revisions, signals, sitemaps, suggestions, typeahead, warmup
+from .hll import HyperLogLog
+from .models import MAX_COMMENT_DEPTH, ArchivedComment, ArchivedPost, BlogPost, Category, Comment, DigestWatermark, DraftAutosave, Follow, Job, Notification, Profile, Tag, TagActivity, ViewerSketch
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', 'pass12345')
+        cls.reader = User.objects.create_user('reader', 'reader@example.com', 'pass12345')
+        cls.category = Category.objects.create(name='python')
+        cls.tag = Tag.objects.create(name='django')
+        cls.post = BlogPost.objects.create(
+            title='Hello', content='<p>World</p>', author=cls.author,
+            category=cls.category, status='published',
+        )
+        cls.post.tags.add(cls.tag)
+
+    def setUp(self):
+        cache.clear()
+
+    def revalidate(self, url, queries):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        with self.assertNumQueries(queries):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        return etag
+
+    def test_unchanged_pages_return_304_with_one_query(self):
+        for url in (
+            reverse('home'),
+            reverse('category_posts', kwargs={'name': self.category.name}),
+            reverse('tag_posts', kwargs={'name': self.tag.name}),
+        ):
+            with self.subTest(url=url):
+                self.revalidate(url, 1)
+        # Plus counting the view
+        self.revalidate(reverse('post_detail', kwargs={'pk': self.post.pk}), 2)
+
+    def test_revalidated_posts_still_count_views(self):
+        url = reverse('post_detail', kwargs={'pk': self.post.pk})
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.view_count, self.post.unique_viewers), (2, 1))
+
+    def test_home_pages_have_their_own_etags(self):
+        for index in range(10):
+            BlogPost.objects.create(title=f'Post {index}', content='x', author=self.author, status='published')
+        etag = self.client.get(reverse('home'))['ETag']
+        response = self.client.get(reverse('home') + '?page=2', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_home_validators_roll_over_for_the_sidebars(self):
+        response = self.client.get(reverse('home'))
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertEqual(self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.addCleanup(setattr, conditional, 'time', conditional.time)
+        later = time.time() + conditional.SIDEBAR_REFRESH
+        conditional.time = SimpleNamespace(time=lambda: later)
+        self.assertEqual(self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(self.client.get(reverse('home'), HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 200)
+
+    def test_anonymous_pages_support_if_modified_since(self):
+        url = reverse('post_detail', kwargs={'pk': self.post.pk})
+        response = self.client.get(url)
+        with self.assertNumQueries(2):
+            response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_authenticated_304_path(self):
+        self.client.force_login(self.reader)
+        # session + user + view count + validators
+        self.revalidate(reverse('post_detail', kwargs={'pk': self.post.pk}), 4)
+
+    def test_view_count_does_not_change_validators(self):
+        url = reverse('post_detail', kwargs={'pk': self.post.pk})
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url)['ETag'], etag)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.view_count, 2)
+
+    def test_comment_and_reaction_changes_invalidate(self):
+        url = reverse('post_detail', kwargs={'pk': self.post.pk})
+        etag = self.client.get(url)['ETag']
+
+        Comment.objects.create(post=self.post, author=self.reader, content='Nice')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+        self.post.likes.add(self.reader)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        listing = reverse('home')
+        etag = self.client.get(listing)['ETag']
+        self.post.likes.remove(self.reader)
+        self.assertEqual(self.client.get(listing, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_etag_is_per_user(self):
+        url = reverse('post_detail', kwargs={'pk': self.post.pk})
+        etag = self.client.get(url)['ETag']
+        self.client.force_login(self.reader)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class JobQueueTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', 'pass12345')
+        cls.reader = User.objects.create_user('reader', 'reader@example.com', 'pass12345')
+        cls.post = BlogPost.objects.create(title='Hello', content='World', author=cls.author, status='published')
+
+    def test_comment_notification_is_deferred_to_worker(self):
+        self.client.force_login(self.reader)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('add_comment', kwargs={'post_pk': self.post.pk}), {'content': 'Nice'})
+        self.assertFalse(Notification.objects.exists())
+        self.assertEqual(Job.objects.filter(status='pending').count(), 1)
+
+        call_command('run_jobs', '--once', stdout=StringIO())
+
+        notification = Notification.objects.get()
+        self.assertEqual(notification.recipient, self.author)
+        self.assertEqual(notification.notification_type, 'comment')
+        self.assertEqual(Job.objects.get().status, 'done')
+
+    def test_idempotency_key_deduplicates(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.likes.add(self.reader)
+            self.post.likes.remove(self.reader)
+            self.post.likes.add(self.reader)
+        self.assertEqual(Job.objects.count(), 1)
+        jobs.process()
+        self.assertEqual(Notification.objects.count(), 1)
+
+        # A like on a later day notifies again
+        tomorrow = timezone.localdate() + timedelta(days=1)
+        self.addCleanup(setattr, signals, 'timezone', signals.timezone)
+        signals.timezone = SimpleNamespace(localdate=lambda: tomorrow, now=timezone.now)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.likes.remove(self.reader)
+            self.post.likes.add(self.reader)
+        jobs.process()
+        self.assertEqual(Notification.objects.count(), 2)
+
+    def test_failures_are_retried_then_marked_failed(self):
+        calls = []
+
+        @jobs.job('tests.flaky')
+        def flaky(payload):
+            calls.append(payload)
+            raise RuntimeError('boom')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.enqueue('tests.flaky', {'n': 1})
+
+        with self.assertLogs('blog.jobs', 'ERROR'):
+            jobs.process(max_attempts=2)
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), ('pending', 1))
+        self.assertIn('boom', job.last_error)
+
+        Job.objects.update(run_after=job.created_at)
+        with self.assertLogs('blog.jobs', 'ERROR'):
+            jobs.process(max_attempts=2)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+        self.assertEqual(len(calls), 2)
+
+    def test_bad_payload_does_not_fail_its_batch(self):
+        done = []
+
+        @jobs.job('tests.batch', batch=True)
+        def handle(payloads):
+            if any(payload['bad'] for payload in payloads):
+                raise RuntimeError('bad payload')
+            done.extend(payload['n'] for payload in payloads)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for n in range(3):
+                jobs.enqueue('tests.batch', {'n': n, 'bad': n == 1})
+
+        with self.assertLogs('blog.jobs', 'ERROR'):
+            jobs.process(max_attempts=1)
+        self.assertEqual(done, [0, 2])
+        statuses = dict(Job.objects.values_list('payload__n', 'status'))
+        self.assertEqual(statuses, {0: 'done', 1: 'failed', 2: 'done'})
+
+
+class ProfileWriteTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('writer', 'writer@example.com', 'pass12345')
+
+    def profile_queries(self, queries):
+        return [q['sql'] for q in queries if 'blog_profile' in q['sql']]
+
+    def test_login_touches_no_profile_rows(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse('login'), {'username': 'writer', 'password': 'pass12345'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.profile_queries(ctx.captured_queries), [])
+        # user lookup, session key check, session insert, last_login update,
+        # session update; previously also a profile SELECT and UPDATE
+        statements = [q['sql'] for q in ctx.captured_queries if 'SAVEPOINT' not in q['sql']]
+        self.assertEqual(len(statements), 5)
+
+    def test_clean_profile_is_not_written(self):
+        profile = Profile.objects.get(user=self.user)
+        with self.assertNumQueries(0):
+            profile.save()
+
+    def test_only_changed_columns_are_written(self):
+        profile = Profile.objects.get(user=self.user)
+        profile.bio = 'Hello'
+        with CaptureQueriesContext(connection) as ctx:
+            profile.save()
+        update, = self.profile_queries(ctx.captured_queries)
+        self.assertIn('"bio"', update)
+        self.assertNotIn('profile_pic', update)
+        self.assertEqual(Profile.objects.get(user=self.user).bio, 'Hello')
+
+    def test_edit_profile_writes_profile_once(self):
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post(reverse('edit_profile'), {'username': 'writer', 'email': 'new@example.com', 'bio': 'Bio'})
+        updates = [sql for sql in self.profile_queries(ctx.captured_queries) if sql.startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(Profile.objects.get(user=self.user).bio, 'Bio')
+
+    def test_registration_creates_user_and_profile(self):
+        self.client.post(reverse('register'), {
+            'username': 'newbie', 'email': 'newbie@example.com',
+            'password1': 'Sup3r-secret-pw', 'password2': 'Sup3r-secret-pw',
+        })
+        self.assertTrue(Profile.objects.filter(user__username='newbie').exists())
+
+
+class UniqueViewerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', 'pass12345')
+        cls.reader = User.objects.create_user('reader', 'reader@example.com', 'pass12345')
+        cls.post = BlogPost.objects.create(title='Hello', content='World', author=cls.author, status='published')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_estimate_is_within_error_bounds(self):
+        sketch = HyperLogLog()
+        for i in range(50000):
+            sketch.add(f'user:{i}')
+        self.assertEqual(len(sketch.to_bytes()), 8192)
+        self.assertAlmostEqual(sketch.count(), 50000, delta=50000 * 0.035)
+
+    def test_small_sketches_are_stored_sparse(self):
+        sketch = HyperLogLog()
+        for i in range(50):
+            sketch.add(f'user:{i}')
+        data = sketch.to_bytes()
+        self.assertLess(len(data), 200)
+        restored = HyperLogLog.from_bytes(data)
+        self.assertEqual(restored.registers, sketch.registers)
+        self.assertEqual(restored.count(), sketch.count())
+        self.assertEqual(HyperLogLog.from_bytes(bytes(sketch.registers)).registers, sketch.registers)
+
+    def test_merge_equals_union(self):
+        monday, tuesday, union = HyperLogLog(), HyperLogLog(), HyperLogLog()
+        for i in range(3000):
+            monday.add(f'user:{i}')
+            union.add(f'user:{i}')
+        for i in range(2000, 6000):
+            tuesday.add(f'user:{i}')
+            union.add(f'user:{i}')
+        monday.merge(tuesday)
+        self.assertEqual(monday.to_bytes(), union.to_bytes())
+
+    def test_refreshes_count_once_and_do_not_write(self):
+        url = reverse('post_detail', kwargs={'pk': self.post.pk})
+        self.client.force_login(self.reader)
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(url)
+        self.assertFalse([q for q in ctx.captured_queries if 'blog_viewersketch' in q['sql']])
+
+        self.client.logout()
+        self.client.get(url, REMOTE_ADDR='10.0.0.1')
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.view_count, 3)
+        self.assertEqual(self.post.unique_viewers, 2)
+        self.assertEqual(ViewerSketch.objects.filter(post=self.post).count(), 2)
+
+    def test_rollup_folds_old_days_into_total(self):
+        sketch = HyperLogLog()
+        for i in range(100):
+            sketch.add(f'user:{i}')
+        ViewerSketch.objects.create(post=self.post, bucket='2020-01-01', registers=sketch.to_bytes())
+
+        call_command('rollup_viewers', stdout=StringIO())
+
+        self.assertEqual(list(ViewerSketch.objects.values_list('bucket', flat=True)), [ViewerSketch.TOTAL])
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.unique_viewers, sketch.count())
+
+
+class TagStatsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', 'pass12345')
+        cls.python = Tag.objects.create(name='python')
+        cls.django = Tag.objects.create(name='django')
+
+    def setUp(self):
+        cache.clear()
+
+    def counts(self):
+        return dict(Tag.objects.values_list('name', 'post_count'))
+
+    def test_counts_follow_tags_and_status(self):
+        post = BlogPost.objects.create(title='A', content='a', author=self.author, status='published')
+        draft = BlogPost.objects.create(title='B', content='b', author=self.author, status='draft')
+        post.tags.add(self.python, self.django)
+        draft.tags.add(self.python)
+        self.assertEqual(self.counts(), {'python': 1, 'django': 1})
+
+        draft = BlogPost.objects.get(pk=draft.pk)
+        draft.status = 'published'
+        draft.save()
+        self.assertEqual(self.counts(), {'python': 2, 'django': 1})
+
+        post.tags.remove(self.django, Tag.objects.create(name='unused'))
+        self.django.posts.add(draft)
+        self.assertEqual(self.counts(), {'python': 2, 'django': 1, 'unused': 0})
+
+        post.tags.clear()
+        self.assertEqual(self.counts(), {'python': 1, 'django': 1, 'unused': 0})
+
+        draft.delete()
+        self.assertEqual(self.counts(), {'python': 0, 'django': 0, 'unused': 0})
+
+    def test_edit_post_form_keeps_counts(self):
+        category = Category.objects.create(name='code')
+        post = BlogPost.objects.create(title='A', content='a', author=self.author, category=category)
+        post.tags.add(self.python)
+        self.client.force_login(self.author)
+        self.client.post(reverse('edit_post', kwargs={'pk': post.pk}), {
+            'title': 'A', 'content': 'a', 'category': category.pk,
+            'status': 'published', 'tags': [self.django.pk],
+        })
+        self.assertEqual(self.counts(), {'python': 0, 'django': 1})
+
+    def test_trending_and_cloud(self):
+        post = BlogPost.objects.create(title='A', content='a', author=self.author, status='published')
+        other = BlogPost.objects.create(title='B', content='b', author=self.author, status='published')
+        post.tags.add(self.python, self.django)
+        other.tags.add(self.python)
+        self.assertEqual(TagActivity.objects.get(tag=self.python).count, 2)
+
+        with self.assertNumQueries(2):
+            data = self.client.get(reverse('tag_cloud')).json()
+        self.assertEqual([t['name'] for t in data['trending']], ['python', 'django'])
+        self.assertEqual([(t['name'], t['post_count'], t['weight']) for t in data['tags']],
+                         [('python', 2, 5), ('django', 1, 1)])
+        self.assertContains(self.client.get(reverse('home')), 'Trending Tags This Week')
+        self.assertEqual(self.client.get(reverse('tag_cloud'), {'limit': '²'}).status_code, 200)
+
+    def test_a_tag_named_cloud_has_its_listing(self):
+        Tag.objects.create(name='cloud')
+        response = self.client.get(reverse('tag_posts', kwargs={'name': 'cloud'}))
+        self.assertEqual((response.status_code, response.resolver_match.view_name), (200, 'tag_posts'))
+
+
+class FollowTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.star = User.objects.create_user('star', 'star@example.com', 'pass12345')
+        cls.fans = [User.objects.create(username=f'fan{i}') for i in range(25)]
+
+    def test_follow_and_unfollow_keep_counts(self):
+        fan = self.fans[0]
+        self.client.force_login(fan)
+        self.client.get(reverse('follow_user', kwargs={'username': 'star'}))
+        self.client.get(reverse('follow_user', kwargs={'username': 'star'}))
+        self.assertEqual(Profile.objects.get(user=self.star).followers_count, 1)
+        self.assertEqual(Profile.objects.get(user=fan).following_count, 1)
+
+        self.client.get(reverse('unfollow_user', kwargs={'username': 'star'}))
+        self.client.get(reverse('unfollow_user', kwargs={'username': 'star'}))
+        self.assertEqual(Profile.objects.get(user=self.star).followers_count, 0)
+        self.assertEqual(Profile.objects.get(user=fan).following_count, 0)
+
+    def test_follower_list_is_cursor_paginated(self):
+        for fan in self.fans:
+            Follow.objects.create(follower=fan, followed=self.star)
+        viewer = self.fans[0]
+        Follow.objects.create(follower=viewer, followed=self.fans[24])
+        self.client.force_login(viewer)
+
+        url = reverse('followers_list', kwargs={'username': 'star'})
+        # session, viewer, profile owner, follows page, batched membership
+        with self.assertNumQueries(5):
+            response = self.client.get(url)
+        page = response.context['page']
+        self.assertEqual([u.username for u in page.users][:2], ['fan24', 'fan23'])
+        self.assertEqual(len(page.users), 20)
+        self.assertTrue(page.users[0].viewer_follows)
+        self.assertFalse(page.users[1].viewer_follows)
+
+        page = self.client.get(url, {'cursor': page.next_cursor}).context['page']
+        self.assertEqual([u.username for u in page.users], [f'fan{i}' for i in range(4, -1, -1)])
+        self.assertFalse(page.has_next)
+
+    def test_profile_pages_use_counters(self):
+        for fan in self.fans[:3]:
+            Follow.objects.create(follower=fan, followed=self.star)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('user_profile', kwargs={'username': 'star'}))
+        self.assertContains(response, '<h5 class="mb-0">3</h5>', html=False)
+        self.assertFalse([q for q in ctx.captured_queries if 'blog_follow"' in q['sql']])
+
+
+class FollowSuggestionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice, cls.bob, cls.carol, cls.dave, cls.erin = [
+            User.objects.create(username=name) for name in ('alice', 'bob', 'carol', 'dave', 'erin')
+        ]
+        Follow.objects.create(follower=cls.alice, followed=cls.bob)
+        Follow.objects.create(follower=cls.bob, followed=cls.carol)
+        Follow.objects.create(follower=cls.bob, followed=cls.dave)
+        Follow.objects.create(follower=cls.alice, followed=cls.dave)
+        post = BlogPost.objects.create(title='A', content='a', author=cls.carol, status='published')
+        post.likes.add(cls.alice, cls.erin)
+        Comment.objects.create(post=post, author=cls.erin, content='!')
+
+    def test_build_and_read(self):
+        call_command('build_follow_suggestions', '--workers', '1', stdout=StringIO())
+
+        # carol via bob (1.0) beats erin via the shared post (0.5); dave is followed
+        self.assertEqual(
+            [u.username for u in suggestions.suggestions_for(self.alice)],
+            ['carol', 'erin'],
+        )
+        with self.assertNumQueries(3):
+            suggestions.suggestions_for(self.alice)
+
+        Follow.objects.create(follower=self.alice, followed=self.carol)
+        self.assertEqual([u.username for u in suggestions.suggestions_for(self.alice)], ['erin'])
+
+        self.client.force_login(self.alice)
+        self.assertContains(self.client.get(reverse('profile')), 'Who to follow')
+
+    def test_process_pool_matches_serial(self):
+        graph = suggestions.synthetic_graph(300, seed=1)
+        serial = dict(suggestions.compute(graph, graph.users(), workers=1, chunk_size=50))
+        pooled = dict(suggestions.compute(graph, graph.users(), workers=2, chunk_size=50))
+        self.assertEqual(serial, pooled)
+
+
+class FeedTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author')
+        cls.category = Category.objects.create(name='python')
+        cls.tag = Tag.objects.create(name='django')
+        cls.post = BlogPost.objects.create(
+            title='Hello feed', content='<p>' + 'word ' * 80 + '</p>', author=cls.author,
+            category=cls.category, status='published',
+        )
+        cls.post.tags.add(cls.tag)
+        BlogPost.objects.create(title='Secret draft', content='x', author=cls.author, category=cls.category)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_feeds_list_published_posts_with_excerpts(self):
+        for name, kwargs in (
+            ('feed_rss', {}), ('feed_atom', {}),
+            ('category_feed_rss', {'name': 'python'}), ('category_feed_atom', {'name': 'python'}),
+            ('tag_feed_rss', {'name': 'django'}), ('tag_feed_atom', {'name': 'django'}),
+            ('author_feed_rss', {'username': 'author'}), ('author_feed_atom', {'username': 'author'}),
+        ):
+            with self.subTest(feed=name):
+                response = self.client.get(reverse(name, kwargs=kwargs))
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, 'Hello feed')
+                self.assertContains(response, 'word word')
+                self.assertNotContains(response, 'Secret draft')
+                self.assertNotContains(response, '&lt;p&gt;')
+
+        self.assertEqual(self.client.get(reverse('tag_feed_rss', kwargs={'name': 'nope'})).status_code, 404)
+
+    def test_polling_costs_one_query_until_posts_change(self):
+        url = reverse('feed_atom')
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(3):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            self.assertEqual(self.client.get(url).status_code, 200)
+            # Query strings don't change the feed, its ETag or its cache entry
+            self.assertEqual(self.client.get(url, {'utm_source': 'x'})['ETag'], etag)
+
+        BlogPost.objects.create(title='Fresh', content='new', author=self.author, status='published')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Fresh')
+
+    def test_changes_saved_by_other_processes_invalidate(self):
+        # No signals run here, as for a save in another process
+        url = reverse('tag_feed_rss', kwargs={'name': 'django'})
+        etag = self.client.get(url)['ETag']
+        BlogPost.objects.filter(pk=self.post.pk).update(title='Renamed', updated_at=timezone.now())
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Renamed')
+
+        etag = response['ETag']
+        other = BlogPost.objects.create(title='Other', content='x', author=self.author, status='published')
+        BlogPost.tags.through.objects.create(blogpost=other, tag=self.tag)
+        self.assertContains(self.client.get(url, HTTP_IF_NONE_MATCH=etag), 'Other')
+
+
+class SitemapTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author')
+        cls.posts = [
+            BlogPost.objects.create(title=f'Post {i}', content='x', author=cls.author, status='published')
+            for i in range(5)
+        ]
+        cls.draft = BlogPost.objects.create(title='Draft', content='x', author=cls.author)
+        Category.objects.create(name='python')
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = tmp.name
+        settings_override = override_settings(SITEMAP_ROOT=self.root, SITE_URL='https://blog.example')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def read_shard(self, name):
+        with gzip.open(os.path.join(self.root, name), 'rt') as f:
+            return f.read()
+
+    def test_shards_split_by_primary_key_range(self):
+        size = self.posts[0].pk + 3
+        stats = sitemaps.build(size=size)
+        names = sorted(name for name in os.listdir(self.root) if name.startswith('sitemap-posts'))
+        self.assertEqual(names, ['sitemap-posts-0000.xml.gz', 'sitemap-posts-0001.xml.gz'])
+
+        urls = ''.join(self.read_shard(name) for name in names)
+        for post in self.posts:
+            self.assertIn(f'<loc>https://blog.example/post/{post.pk}/</loc>', urls)
+        self.assertNotIn(f'/post/{self.draft.pk}/', urls)
+        self.assertIn('https://blog.example/profile/author/', self.read_shard('sitemap-profiles-0000.xml.gz'))
+
+        response = self.client.get(reverse('sitemap_index'))
+        index = b''.join(response.streaming_content).decode()
+        self.assertEqual(index.count('<sitemap>'), stats['written'])
+        self.assertIn('https://blog.example/sitemaps/sitemap-posts-0001.xml.gz', index)
+
+    def test_incremental_build_rewrites_only_changed_shards(self):
+        size = self.posts[0].pk + 3
+        sitemaps.build(size=size)
+        self.assertEqual(sitemaps.build(size=size), {'written': 0, 'unchanged': 4, 'removed': 0})
+
+        last = self.posts[-1]
+        BlogPost.objects.filter(pk=last.pk).update(title='Edited', updated_at=last.updated_at + timedelta(minutes=1))
+        self.assertEqual(sitemaps.build(size=size), {'written': 1, 'unchanged': 3, 'removed': 0})
+
+        Category.objects.create(name='rust')
+        self.assertEqual(sitemaps.build(size=size), {'written': 1, 'unchanged': 3, 'removed': 0})
+
+        BlogPost.objects.filter(pk__in=[post.pk for post in self.posts[3:]]).update(status='draft')
+        stats = sitemaps.build(size=size)
+        self.assertEqual(stats['removed'], 1)
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'sitemap-posts-0001.xml.gz')))
+
+    def test_shard_view(self):
+        self.assertEqual(self.client.get(reverse('sitemap_index')).status_code, 404)
+        call_command('build_sitemaps', stdout=StringIO())
+
+        response = self.client.get(reverse('sitemap_shard', kwargs={'name': 'sitemap-posts-0000.xml.gz'}))
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn(b'<urlset', gzip.decompress(b''.join(response.streaming_content)))
+
+        response = self.client.get(reverse('sitemap_shard', kwargs={'name': 'manifest.json'}))
+        self.assertEqual(response.status_code, 404)
+
+
+class ApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author')
+        cls.reader = User.objects.create(username='reader')
+        cls.category = Category.objects.create(name='python')
+        tags = [Tag.objects.create(name=name) for name in ('django', 'orm')]
+        cls.posts = []
+        for i in range(5):
+            post = BlogPost.objects.create(
+                title=f'Post {i}', content=f'Body {i}', author=cls.author, category=cls.category, status='published'
+            )
+            post.tags.set(tags)
+            post.likes.add(cls.reader)
+            Comment.objects.create(post=post, author=cls.reader, content=f'Comment {i}')
+            cls.posts.append(post)
+        cls.draft = BlogPost.objects.create(title='Draft', content='x', author=cls.author)
+
+    def get(self, name, kwargs=None, **params):
+        response = self.client.get(reverse(name, kwargs=kwargs), params)
+        return response.status_code, response.json()
+
+    def test_post_list_default_fields_and_cursor(self):
+        with self.assertNumQueries(2):
+            status, data = self.get('api_post_list', limit=3)
+        self.assertEqual(status, 200)
+        self.assertEqual([post['title'] for post in data['results']], ['Post 4', 'Post 3', 'Post 2'])
+        first = data['results'][0]
+        self.assertEqual(first['author'], {'id': self.author.pk, 'username': 'author'})
+        self.assertEqual(first['category'], 'python')
+        self.assertEqual(first['tags'], ['django', 'orm'])
+        self.assertNotIn('content', first)
+
+        response = self.client.get(data['next'])
+        self.assertEqual([post['title'] for post in response.json()['results']], ['Post 1', 'Post 0'])
+        self.assertIsNone(response.json()['next'])
+
+    def test_sparse_fields_only_read_what_is_asked(self):
+        with CaptureQueriesContext(connection) as queries:
+            status, data = self.get('api_post_list', fields='id,title')
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('content', queries[0]['sql'])
+        self.assertNotIn('JOIN', queries[0]['sql'])
+        self.assertEqual(set(data['results'][0]), {'id', 'title'})
+
+        with self.assertNumQueries(1):
+            status, data = self.get('api_post_list', fields='id,likes,dislikes,comments,author')
+        self.assertEqual(data['results'][0]['likes'], 1)
+        self.assertEqual(data['results'][0]['dislikes'], 0)
+        self.assertEqual(data['results'][0]['comments'], 1)
+
+        status, data = self.get('api_post_list', fields='id,password')
+        self.assertEqual(status, 400)
+        self.assertIn('password', data['error'])
+
+    def test_batch_lookup_by_ids(self):
+        ids = f'{self.posts[2].pk},{self.draft.pk},{self.posts[0].pk}'
+        with self.assertNumQueries(1):
+            status, data = self.get('api_post_list', ids=ids, fields='id,title')
+        self.assertEqual([post['title'] for post in data['results']], ['Post 2', 'Post 0'])
+        self.assertEqual(data['missing'], [self.draft.pk])
+        self.assertEqual(self.get('api_post_list', ids='1,x')[0], 400)
+
+    def test_bad_numbers_are_client_errors(self):
+        self.assertEqual(self.get('api_post_list', limit='²')[0], 400)
+        self.assertEqual(self.get('api_post_list', limit='0')[0], 400)
+        self.assertEqual(self.get('api_comment_list', post='²')[0], 400)
+
+    def test_detail_endpoints(self):
+        self.assertEqual(self.get('api_post_detail', {'pk': self.draft.pk})[0], 404)
+        with self.assertNumQueries(2):
+            status, data = self.get('api_post_detail', {'pk': self.posts[0].pk})
+        self.assertEqual(data['title'], 'Post 0')
+
+        with self.assertNumQueries(1):
+            status, data = self.get('api_profile_detail', {'username': 'author'}, fields='username,bio,posts')
+        self.assertEqual(data, {'username': 'author', 'bio': '', 'posts': 5})
+
+        status, data = self.get('api_tag_detail', {'pk': Tag.objects.get(name='orm').pk})
+        self.assertEqual(data['post_count'], 5)
+
+    def test_comment_list_by_post(self):
+        with self.assertNumQueries(1):
+            status, data = self.get('api_comment_list', post=self.posts[1].pk)
+        self.assertEqual([comment['content'] for comment in data['results']], ['Comment 1'])
+        self.assertEqual(data['results'][0]['author']['username'], 'reader')
+        self.assertTrue(data['results'][0]['url'].endswith(f"#comment-{data['results'][0]['id']}"))
+
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.get('api_profile_list')[1]['results']), 2)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get('api_category_list')[1]['results'][0]['name'], 'python')
+
+
+class AutosaveTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author')
+        cls.category = Category.objects.create(name='python')
+        cls.post = BlogPost.objects.create(title='Long post', content='Hello world', author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.author)
+
+    def autosave(self, version, patch, post=True, **extra):
+        body = {'post': self.post.pk if post else None, 'version': version, 'patch': patch, **extra}
+        response = self.client.post(reverse('autosave_draft'), json.dumps(body), content_type='application/json')
+        return response.status_code, response.json()
+
+    def test_splices_use_utf16_offsets(self):
+        self.assertEqual(autosave.apply_patch('a😀b', [[3, 4, 'c']]), 'a😀c')
+        self.assertEqual(autosave.apply_patch('Hello world', [[6, 11, 'there'], [0, 0, '> ']]), '> Hello there')
+        with self.assertRaises(autosave.InvalidPatch):
+            autosave.apply_patch('a😀b', [[2, 3, '']])
+        with self.assertRaises(autosave.InvalidPatch):
+            autosave.apply_patch('abc', [[2, 9, '']])
+
+    def test_writes_are_coalesced_until_the_interval_or_a_flush(self):
+        with self.settings(AUTOSAVE_WRITE_INTERVAL=0):
+            status, data = self.autosave(0, [[11, 11, '!']])
+        self.assertEqual(data, {'version': 1, 'saved': True})
+
+        version = 1
+        for i in range(20):
+            status, data = self.autosave(version, [[12 + i, 12 + i, '.']])
+            version = data['version']
+        self.assertEqual(data, {'version': 21, 'saved': False})
+        self.assertEqual(DraftAutosave.objects.get().version, 1)
+
+        # Unchanged content is acknowledged without a new version
+        status, data = self.autosave(version, [], title='Long post')
+        self.assertEqual(data['version'], 21)
+
+        status, data = self.autosave(version, [], flush=True)
+        self.assertEqual(data, {'version': 21, 'saved': True})
+        row = DraftAutosave.objects.get()
+        self.assertEqual((row.version, row.content), (21, 'Hello world!' + '.' * 20))
+        self.assertEqual(BlogPost.objects.get(pk=self.post.pk).content, 'Hello world')
+
+    def test_stale_version_conflicts_and_cache_loss_recovers(self):
+        self.autosave(0, [[0, 5, 'Howdy']], flush=True)
+        status, data = self.autosave(0, [[0, 0, 'x']])
+        self.assertEqual((status, data['version'], data['length']), (409, 1, 11))
+
+        self.autosave(1, [[11, 11, '?']])
+        cache.clear()
+        status, data = self.autosave(2, [[12, 12, '?']])
+        self.assertEqual((status, data['version']), (409, 1))
+        status, data = self.autosave(1, [[0, data['length'], 'Howdy world??']], flush=True)
+        self.assertEqual(data, {'version': 2, 'saved': True})
+
+    def test_concurrent_first_saves_of_a_new_post_conflict(self):
+        self.autosave(0, [[0, 0, 'Theirs']], post=False, flush=True)
+        # A second session that had not seen the row yet
+        current = {'title': '', 'content': 'Mine', 'version': 1, 'row_id': None}
+        with self.assertRaises(autosave.Conflict):
+            autosave._persist(self.author, None, current)
+        # Without the partial unique index, as on MySQL
+        self.addCleanup(setattr, connection.features, 'supports_partial_indexes', True)
+        connection.features.supports_partial_indexes = False
+        with self.assertRaises(autosave.Conflict):
+            autosave._persist(self.author, None, current)
+        self.assertEqual(DraftAutosave.objects.filter(post=None).count(), 1)
+
+    def test_editor_offers_restore_and_save_clears_it(self):
+        self.autosave(0, [[0, 5, 'Howdy']], flush=True)
+        response = self.client.get(reverse('edit_post', kwargs={'pk': self.post.pk}))
+        self.assertTrue(response.context['autosave']['restore'])
+        self.assertEqual(response.context['autosave']['version'], 1)
+
+        self.client.post(reverse('edit_post', kwargs={'pk': self.post.pk}), {
+            'title': 'Long post', 'content': 'Howdy world', 'status': 'draft', 'category': self.category.pk,
+        })
+        self.assertFalse(DraftAutosave.objects.exists())
+        self.assertEqual(self.client.get(reverse('create_post')).context['autosave']['version'], 0)
+
+    def test_only_the_author_can_autosave(self):
+        self.client.force_login(User.objects.create(username='other'))
+        body = json.dumps({'post': self.post.pk, 'version': 0, 'patch': [[0, 0, 'x']]})
+        response = self.client.post(reverse('autosave_draft'), body, content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+        status, data = self.autosave(0, [[0, 0, 'New']], post=False, flush=True)
+        self.assertEqual(data, {'version': 1, 'saved': True})
+
+    def test_malformed_post_ids_are_rejected(self):
+        self.client.force_login(self.author)
+        for post in ('abc', {'x': 1}, [1]):
+            body = json.dumps({'post': post, 'version': 0, 'patch': [[0, 0, 'x']]})
+            response = self.client.post(reverse('autosave_draft'), body, content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+
+
+class RevisionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author')
+        cls.category = Category.objects.create(name='python')
+
+    def setUp(self):
+        self.lines = [f'Paragraph {i} ' + 'lorem ipsum ' * 20 + '\n' for i in range(200)]
+        self.post = BlogPost.objects.create(
+            title='Long post', content=''.join(self.lines), author=self.author, category=self.category
+        )
+
+    def edit(self, i):
+        self.lines[i * 7 % 200] = f'Edited paragraph {i}\n'
+        self.post.content = ''.join(self.lines)
+        self.post.save()
+        return revisions.record(self.post, self.author)
+
+    def test_deltas_between_snapshots_rebuild_every_version(self):
+        revisions.record(self.post, self.author)
+        versions = {1: self.post.content}
+        for i in range(1, 25):
+            revision = self.edit(i)
+            versions[revision.number] = self.post.content
+
+        kinds = dict(self.post.revisions.values_list('number', 'kind'))
+        self.assertEqual([n for n, kind in sorted(kinds.items()) if kind == 'snapshot'], [1, 11, 21])
+        full = len(zlib.compress(self.post.content.encode(), 6))
+        delta = len(bytes(self.post.revisions.get(number=2).data))
+        self.assertLess(delta * 10, full)
+
+        for number, content in versions.items():
+            with self.subTest(revision=number):
+                self.assertEqual(revisions.content_at(self.post, number), content)
+        # Rebuilding replays at most one snapshot and its deltas
+        with self.assertNumQueries(2):
+            revisions.content_at(self.post, 20)
+
+        diff = revisions.diff(self.post, 3, 5)
+        self.assertIn('-Paragraph 28', diff)
+        self.assertIn('+Edited paragraph 4', diff)
+
+    def test_unchanged_save_records_nothing(self):
+        revisions.record(self.post)
+        self.assertIsNone(revisions.record(self.post))
+        self.assertEqual(self.post.revisions.count(), 1)
+
+    def test_pruning_keeps_the_newest_revisions_reconstructible(self):
+        revisions.record(self.post, self.author)
+        with self.settings(POST_MAX_REVISIONS=5):
+            for i in range(1, 13):
+                self.edit(i)
+        numbers = list(self.post.revisions.order_by('number').values_list('number', 'kind'))
+        self.assertEqual(numbers, [(9, 'snapshot'), (10, 'delta'), (11, 'delta'), (12, 'delta'), (13, 'delta')])
+        self.assertEqual(revisions.content_at(self.post, 13), self.post.content)
+        self.assertIn('Edited paragraph 8', revisions.content_at(self.post, 9))
+
+    def test_edit_view_records_history_and_restore_rolls_back(self):
+        original = self.post.content
+        self.client.force_login(self.author)
+        self.client.post(reverse('edit_post', kwargs={'pk': self.post.pk}), {
+            'title': 'Short post', 'content': 'Rewritten', 'status': 'draft', 'category': self.category.pk,
+        })
+        self.assertEqual(list(self.post.revisions.values_list('number', 'title')), [(1, 'Long post'), (2, 'Short post')])
+
+        response = self.client.get(reverse('revision_diff', kwargs={'pk': self.post.pk, 'number': 2}))
+        self.assertContains(response, '+Rewritten')
+        response = self.client.get(reverse('revision_diff', kwargs={'pk': self.post.pk, 'number': 2}), {'against': '²'})
+        self.assertContains(response, '+Rewritten')
+
+        self.client.post(reverse('restore_revision', kwargs={'pk': self.post.pk, 'number': 1}))
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.title, self.post.content), ('Long post', original))
+        self.assertEqual(self.post.revisions.count(), 3)
+
+        self.client.force_login(User.objects.create(username='other'))
+        response = self.client.get(reverse('post_history', kwargs={'pk': self.post.pk}))
+        self.assertRedirects(response, reverse('post_detail', kwargs={'pk': self.post.pk}), fetch_redirect_response=False)
+
+
+class ArchiveTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author')
+        cls.reader = User.objects.create(username='reader')
+        cls.tag = Tag.objects.create(name='django')
+
+    def setUp(self):
+        self.old = BlogPost.objects.create(title='Old post', content='<p>Ancient</p>', author=self.author,
+                                           status='published')
+        self.old.tags.add(self.tag)
+        self.old.likes.add(self.reader)
+        self.comment = Comment.objects.create(post=self.old, author=self.reader, content='First!')
+        self.reply = Comment.objects.create(post=self.old, author=self.author, content='Thanks', parent=self.comment)
+        self.comment.likes.add(self.author)
+        long_ago = timezone.now() - timedelta(days=1000)
+        BlogPost.objects.filter(pk=self.old.pk).update(
+            created_at=long_ago, updated_at=long_ago, comments_changed_at=long_ago, reactions_changed_at=long_ago
+        )
+        self.fresh = BlogPost.objects.create(title='Fresh post', content='New', author=self.author, status='published')
+        self.fresh.tags.add(self.tag)
+
+    def test_archive_moves_cold_posts_and_keeps_the_url(self):
+        self.assertEqual(Tag.objects.get().post_count, 2)
+        out = StringIO()
+        call_command('archive_posts', '--days', '365', stdout=out)
+        self.assertIn('Archived 1 post(s) and 2 comment(s)', out.getvalue())
+
+        self.assertEqual(list(BlogPost.objects.values_list('title', flat=True)), ['Fresh post'])
+        self.assertFalse(Comment.objects.exists())
+        self.assertFalse(BlogPost.likes.through.objects.exists())
+        self.assertEqual(Tag.objects.get().post_count, 1)
+
+        archived = ArchivedPost.objects.get(pk=self.old.pk)
+        self.assertEqual((archived.tag_ids, archived.like_ids), ([self.tag.pk], [self.reader.pk]))
+        self.assertEqual(ArchivedComment.objects.get(pk=self.comment.pk).like_ids, [self.author.pk])
+
+        response = self.client.get(reverse('post_detail', kwargs={'pk': self.old.pk}))
+        self.assertContains(response, 'Ancient')
+        self.assertContains(response, 'has been archived')
+        self.assertContains(response, 'Thanks')
+        self.assertEqual(self.client.get(reverse('post_detail', kwargs={'pk': 9999})).status_code, 404)
+
+    def test_restore_puts_everything_back(self):
+        archive.archive(days=365)
+        activity = list(TagActivity.objects.values_list('count', flat=True))
+
+        call_command('archive_posts', '--restore', str(self.old.pk), stdout=StringIO())
+        self.assertFalse(ArchivedPost.objects.exists())
+        post = BlogPost.objects.get(pk=self.old.pk)
+        self.assertEqual(post.content, '<p>Ancient</p>')
+        self.assertEqual(list(post.likes.all()), [self.reader])
+        self.assertEqual(list(post.tags.all()), [self.tag])
+        reply = Comment.objects.get(pk=self.reply.pk)
+        self.assertEqual(reply.parent_id, self.comment.pk)
+        self.assertEqual(list(reply.parent.likes.all()), [self.author])
+
+        self.assertEqual(Tag.objects.get().post_count, 2)
+        self.assertEqual(list(TagActivity.objects.values_list('count', flat=True)), activity)
+
+    def test_restored_post_keeps_its_unique_reader_count(self):
+        BlogPost.objects.filter(pk=self.old.pk).update(unique_viewers=40)
+        archive.archive(days=365)
+        archive.restore([self.old.pk])
+        cache.clear()
+        self.client.get(reverse('post_detail', kwargs={'pk': self.old.pk}))
+        self.assertEqual(BlogPost.objects.get(pk=self.old.pk).unique_viewers, 40)
+
+
+class LiveUpdateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author')
+        cls.reader = User.objects.create(username='reader')
+        cls.post = BlogPost.objects.create(title='Busy post', content='x', author=cls.author, status='published')
+
+    async def open_stream(self, path):
+        async def django_app(scope, receive, send):
+            await send({'type': 'http.response.start', 'status': 204, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b''})
+
+        stream = {'sent': [], 'incoming': asyncio.Queue()}
+
+        async def send(message):
+            stream['sent'].append(message)
+
+        scope = {'type': 'http', 'method': 'GET', 'path': path, 'headers': []}
+        stream['task'] = asyncio.ensure_future(live.router(django_app)(scope, stream['incoming'].get, send))
+        await self.wait_for(lambda: stream['sent'] and stream['sent'][0]['type'] == 'http.response.start')
+        return stream
+
+    async def wait_for(self, condition):
+        for _ in range(200):
+            if condition():
+                return
+            await asyncio.sleep(0.01)
+        self.fail('Timed out waiting for the stream')
+
+    def body(self, stream):
+        return b''.join(message.get('body', b'') for message in stream['sent']).decode()
+
+    async def close(self, stream):
+        await stream['incoming'].put({'type': 'http.disconnect'})
+        await asyncio.wait_for(stream['task'], 1)
+
+    def comment_and_like(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(post=self.post, author=self.reader, content='Live!')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.likes.add(self.reader)
+
+    async def test_readers_share_one_listener_per_post(self):
+        path = f'/post/{self.post.pk}/events/'
+        first, second = await self.open_stream(path), await self.open_stream(path)
+        self.assertEqual(first['sent'][0]['status'], 200)
+        self.assertEqual(list(live.hub.listeners), [self.post.pk])
+
+        await sync_to_async(self.comment_and_like)()
+        for stream in (first, second):
+            await self.wait_for(lambda: 'event: reactions' in self.body(stream))
+            body = self.body(stream)
+            self.assertIn('event: comment\ndata: {"id": ', body)
+            self.assertIn('"content": "Live!"', body)
+            self.assertIn('data: {"likes": 1, "dislikes": 0}', body)
+
+        await self.close(first)
+        self.assertEqual(list(live.hub.listeners), [self.post.pk])
+        await self.close(second)
+        self.assertEqual(live.hub.listeners, {})
+        self.assertEqual(dict(live.broker()._subscriptions), {})
+
+    async def test_listener_survives_a_message_it_cannot_resolve(self):
+        stream = await self.open_stream(f'/post/{self.post.pk}/events/')
+        with self.assertLogs('blog.live', 'ERROR'):
+            live.publish(self.post.pk, {'type': 'comment'})
+            await asyncio.sleep(0.05)
+        live.publish(self.post.pk, {'type': 'reactions'})
+        await self.wait_for(lambda: 'event: reactions' in self.body(stream))
+        await self.close(stream)
+
+    async def test_unknown_posts_and_other_paths(self):
+        stream = await self.open_stream('/post/9999/events/')
+        self.assertEqual(stream['sent'][0]['status'], 404)
+        stream = await self.open_stream('/post/1/')
+        self.assertEqual(stream['sent'][0]['status'], 204)
+
+
+class CommentFragmentTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author')
+        cls.reader = User.objects.create(username='reader')
+        cls.post = BlogPost.objects.create(title='Talked about', content='x', author=cls.author, status='published')
+
+    def setUp(self):
+        cache.clear()
+        self.comment = Comment.objects.create(post=self.post, author=self.reader, content='First!')
+        self.reply = Comment.objects.create(post=self.post, author=self.author, content='Thanks', parent=self.comment)
+
+    def stamp(self):
+        return Comment.objects.values_list('render_version', flat=True).get(pk=self.comment.pk)
+
+    def test_threads_are_rendered_once_and_shared(self):
+        with self.assertNumQueries(4):
+            threads = comment_cache.render_threads(self.post).items
+        self.assertEqual(len(threads), 1)
+        self.assertIn('Thanks', threads[0])
+        with self.assertNumQueries(1):
+            self.assertEqual(comment_cache.render_threads(self.post).items, threads)
+
+    def test_edits_replies_and_reactions_restamp_the_thread(self):
+        stamps = [self.stamp()]
+        self.reply.likes.add(self.reader)
+        stamps.append(self.stamp())
+        self.reader.disliked_comments.add(self.comment)
+        stamps.append(self.stamp())
+        self.reply.content = 'Thanks a lot'
+        self.reply.save()
+        stamps.append(self.stamp())
+        Comment.objects.create(post=self.post, author=self.reader, content='Welcome', parent=self.comment)
+        stamps.append(self.stamp())
+        self.reply.delete()
+        stamps.append(self.stamp())
+        self.assertEqual(len(set(stamps)), len(stamps))
+
+        thread = comment_cache.render_threads(self.post).items[0]
+        self.assertIn('Welcome', thread)
+        self.assertNotIn('Thanks', thread)
+
+    def test_fragment_carries_no_viewer_state(self):
+        self.comment.likes.add(self.reader)
+        self.client.force_login(self.reader)
+        response = self.client.get(reverse('post_detail', kwargs={'pk': self.post.pk}))
+        thread = comment_cache.render_threads(self.post).items[0]
+        self.assertIn(thread, response.content.decode())
+        self.assertNotIn('csrfmiddlewaretoken', thread)
+        self.assertNotIn('text-primary', thread)
+        self.assertEqual(response.context['comment_reactions'], {'liked': [self.comment.pk], 'disliked': []})
+
+        self.client.logout()
+        response = self.client.get(reverse('post_detail', kwargs={'pk': self.post.pk}))
+        self.assertIn(thread, response.content.decode())
+        self.assertContains(response, 'comments-list anonymous')
+
+    def test_threads_load_page_by_page(self):
+        for i in range(4):
+            Comment.objects.create(post=self.post, author=self.reader, content=f'Comment {i}')
+        with self.settings(COMMENTS_PER_PAGE=2):
+            response = self.client.get(reverse('post_detail', kwargs={'pk': self.post.pk}))
+            self.assertContains(response, 'First!')
+            self.assertContains(response, 'Comment 0')
+            self.assertNotContains(response, 'Comment 1')
+
+            seen = []
+            url = response.context['more_comments_url']
+            while url:
+                data = self.client.get(url).json()
+                seen += [f'Comment {i}' for i in range(4) if f'Comment {i}' in data['html']]
+                url = data['next']
+        self.assertEqual(seen, ['Comment 1', 'Comment 2', 'Comment 3'])
+
+    def test_long_threads_load_their_replies_on_demand(self):
+        for i in range(comment_cache.REPLIES_SHOWN + comment_cache.REPLIES_PER_PAGE):
+            Comment.objects.create(post=self.post, author=self.reader, content=f'Reply {i}', parent=self.comment)
+        thread = comment_cache.render_threads(self.post).items[0]
+        self.assertIn('Reply 1', thread)
+        self.assertNotIn(f'Reply {comment_cache.REPLIES_SHOWN}', thread)
+        self.assertIn('Show more replies', thread)
+
+        url = comment_cache.replies_url(self.post.pk, self.comment.pk, '')
+        data = self.client.get(url).json()
+        self.assertIn('Thanks', data['html'])
+        self.assertIn(f'Reply {comment_cache.REPLIES_PER_PAGE - 2}', data['html'])
+        self.assertNotIn(f'Reply {comment_cache.REPLIES_PER_PAGE - 1}', data['html'])
+        data = self.client.get(data['next']).json()
+        self.assertIn(f'Reply {comment_cache.REPLIES_PER_PAGE - 1}', data['html'])
+        self.assertIsNone(data['next'])
+        self.assertEqual(self.client.get(url.replace('thread=', 'thread=x')).status_code, 400)
+        response = self.client.get(reverse('comment_page', kwargs={'pk': self.post.pk}), {'thread': '²'})
+        self.assertEqual(response.status_code, 400)
+
+
+class CommentPathTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='talker')
+        cls.post = BlogPost.objects.create(title='Threads', content='x', author=cls.user, status='published')
+
+    def setUp(self):
+        cache.clear()
+
+    def reply(self, parent, content='...'):
+        return Comment.objects.create(post=self.post, author=self.user, content=content, parent=parent)
+
+    def build_tree(self, width, depth):
+        # `width` replies under the root, each starting a chain of `depth`
+        root = Comment.objects.create(post=self.post, author=self.user, content='root')
+        for i in range(width):
+            node = root
+            for level in range(depth):
+                node = self.reply(node, f'{i}.{level}')
+        return root
+
+    def walk(self, comment):
+        # Depth-first order the slow way, one query per node
+        order = []
+        for child in comment.children().order_by('pk'):
+            order.append(child.pk)
+            order += self.walk(child)
+        return order
+
+    def test_subtree_comes_back_in_one_ordered_query(self):
+        root = self.build_tree(width=12, depth=5)
+        # Interleave later replies so pk order is not tree order
+        for comment in list(root.descendants()[::7]):
+            self.reply(comment, 'late')
+        root.refresh_from_db()
+        with self.assertNumQueries(1):
+            descendants = list(root.descendants())
+        self.assertEqual([comment.pk for comment in descendants], self.walk(root))
+        for comment in descendants:
+            self.assertTrue(comment.path.startswith(root.path))
+            self.assertEqual(comment.depth, Comment.objects.get(pk=comment.parent_id).depth + 1)
+
+    def test_deep_thread_renders_and_expands(self):
+        root = self.build_tree(width=1, depth=40)
+        self.assertEqual(root.descendants().last().depth, 40)
+        thread = comment_cache.render_threads(self.post).items[0]
+        self.assertIn('0.4', thread)
+        self.assertNotIn('0.5', thread)
+
+        seen = []
+        url = comment_cache.replies_url(self.post.pk, root.pk, root.descendants()[4].path)
+        while url:
+            data = self.client.get(url).json()
+            seen.append(data['html'])
+            url = data['next']
+        self.assertEqual(len(seen), 2)
+        self.assertIn('0.39', seen[-1])
+        self.assertIn(f'margin-left: {comment_cache.MAX_INDENT}rem', seen[-1])
+
+    def test_replies_stop_at_the_maximum_depth(self):
+        node = Comment.objects.create(post=self.post, author=self.user, content='root')
+        for _ in range(MAX_COMMENT_DEPTH - 1):
+            node = self.reply(node)
+        self.assertFalse(node.can_reply())
+        self.client.force_login(self.user)
+        self.client.post(reverse('reply_to_comment', kwargs={'comment_pk': node.pk}), {'content': 'deeper'})
+        self.assertFalse(Comment.objects.filter(content='deeper').exists())
+
+    def test_comment_is_not_kept_without_its_path(self):
+        def fail(pk):
+            raise RuntimeError('killed between the insert and the path update')
+        self.addCleanup(setattr, models, 'path_step', models.path_step)
+        models.path_step = fail
+        with self.assertRaises(RuntimeError):
+            Comment.objects.create(post=self.post, author=self.user, content='lost')
+        self.assertFalse(Comment.objects.filter(content='lost').exists())
+
+    def test_migration_backfills_paths(self):
+        root = self.build_tree(width=6, depth=4)
+        self.reply(root, 'late')
+        expected = dict(Comment.objects.values_list('pk', 'path'))
+        Comment.objects.update(path='')
+
+        from django.apps import apps
+        migration = importlib.import_module('blog.migrations.0013_comment_path')
+        migration.fill_paths(apps, None)
+        self.assertEqual(dict(Comment.objects.values_list('pk', 'path')), expected)
+
+
+class ProfilingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', is_superuser=True)
+        cls.member = User.objects.create(username='member')
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        override = self.settings(PROFILE_ROOT=tmp.name, PROFILE_SAMPLE_RATE=0.0)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_superuser_profiles_a_request_with_the_signed_flag(self):
+        self.client.force_login(self.admin)
+        self.client.get(reverse('home'))
+        self.assertEqual(profiling.list_profiles(), [])
+
+        self.client.get(reverse('home'), {profiling.PARAM: profiling.profile_token(self.admin)})
+        [profile] = profiling.list_profiles()
+        self.assertEqual((profile['view'], profile['reason'], profile['user']), ('home', 'requested', 'admin'))
+
+        response = self.client.get(reverse('admin_profiles'))
+        self.assertContains(response, reverse('admin_profile_detail', kwargs={'profile_id': profile['id']}))
+        response = self.client.get(reverse('admin_profile_detail', kwargs={'profile_id': profile['id']}))
+        self.assertContains(response, 'views.py')
+        functions = response.context['profile']['functions']
+        self.assertEqual(functions, sorted(functions, key=lambda row: row['cumtime'], reverse=True))
+        self.assertEqual(self.client.get(reverse('admin_profile_detail', kwargs={'profile_id': 'f' * 32})).status_code, 404)
+
+    def test_flag_only_works_for_the_superuser_it_was_signed_for(self):
+        token = profiling.profile_token(self.admin)
+        self.client.force_login(self.member)
+        self.client.get(reverse('home'), {profiling.PARAM: token})
+        self.client.force_login(self.admin)
+        self.client.get(reverse('home'), {profiling.PARAM: token + 'x'})
+        self.assertEqual(profiling.list_profiles(), [])
+
+        self.client.force_login(self.member)
+        self.assertRedirects(self.client.get(reverse('admin_profiles')), reverse('home'))
+
+    def test_sampled_profiles_are_pruned_to_the_newest(self):
+        with self.settings(PROFILE_SAMPLE_RATE=1.0, PROFILE_KEEP=2):
+            for _ in range(3):
+                self.client.get(reverse('home'))
+        profiles = profiling.list_profiles()
+        self.assertEqual([profile['reason'] for profile in profiles], ['sampled', 'sampled'])
+        self.assertEqual(len(os.listdir(profiling.profile_root())), 4)
+
+
+class QueryLogTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', is_superuser=True)
+        cls.posts = [
+            BlogPost.objects.create(title=f'Post {i}', content='x', author=cls.admin, status='published')
+            for i in range(2)
+        ]
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        override = self.settings(QUERYLOG_ROOT=tmp.name, QUERYLOG_FLUSH_INTERVAL=3600)
+        override.enable()
+        self.addCleanup(override.disable)
+        previous = querylog.stats
+        querylog.stats = querylog.QueryStats()
+        self.addCleanup(setattr, querylog, 'stats', previous)
+
+    def test_fingerprints_strip_literals(self):
+        self.assertEqual(
+            querylog.fingerprint('SELECT "t"."id" FROM "t" WHERE "t"."id" IN (1, 2, 3) AND "t"."name" = \'a\'\'b\' LIMIT 21'),
+            querylog.fingerprint('SELECT "t"."id" FROM "t" WHERE "t"."id" IN (%s) AND "t"."name" = %s LIMIT 5'),
+        )
+        self.assertEqual(
+            querylog.fingerprint('INSERT INTO "t" ("a", "b") VALUES (%s, %s), (%s, %s)'),
+            'INSERT INTO "t" ("a", "b") VALUES (...)',
+        )
+        self.assertIn('"col1"', querylog.fingerprint('SELECT "t"."x" AS "col1" FROM "t" T3'))
+        self.assertEqual(querylog.fingerprint('SAVEPOINT "s1398364_x12"'), 'SAVEPOINT ?')
+        self.assertEqual(querylog.fingerprint('RELEASE SAVEPOINT `s1398364_x12`'), 'RELEASE SAVEPOINT ?')
+
+    def test_queries_are_counted_per_view_and_fingerprint(self):
+        for post in self.posts:
+            self.client.get(reverse('post_detail', kwargs={'pk': post.pk}))
+        entries = querylog.stats.snapshot()
+        self.assertTrue(entries)
+        self.assertEqual({entry['view'] for entry in entries}, {'post_detail'})
+        [views] = [entry for entry in entries if entry['fingerprint'].startswith('UPDATE "blog_blogpost" SET "view_count"')]
+        self.assertEqual(views['fingerprint'], 'UPDATE "blog_blogpost" SET "view_count" = ("blog_blogpost"."view_count" + ?) '
+                                               'WHERE "blog_blogpost"."id" = ?')
+        self.assertEqual((views['calls'], sum(views['buckets'])), (2, 2))
+
+    def test_entries_are_bounded(self):
+        with self.settings(QUERYLOG_MAX_FINGERPRINTS=2):
+            self.client.get(reverse('post_detail', kwargs={'pk': self.posts[0].pk}))
+        fingerprints = [entry['fingerprint'] for entry in querylog.stats.snapshot()]
+        self.assertEqual(len(fingerprints), 3)
+        self.assertIn(querylog.OTHER, fingerprints)
+
+    def test_slow_statements_are_logged_with_their_stack(self):
+        with self.settings(QUERYLOG_SLOW_MS=0), self.assertLogs('blog.querylog', 'WARNING') as logs:
+            self.client.get(reverse('post_detail', kwargs={'pk': self.posts[0].pk}))
+        self.assertIn('in post_detail', logs.output[0])
+        self.assertTrue(any('views.py' in line for line in logs.output))
+
+    def test_admin_panel_shows_top_offenders_of_all_processes(self):
+        self.client.get(reverse('post_detail', kwargs={'pk': self.posts[0].pk}))
+        querylog.stats.flush()
+        querylog.stats = querylog.QueryStats()
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('admin_panel'))
+        self.assertEqual(len(os.listdir(querylog.querylog_root())), 2)
+        views = {view['view']: view for view in response.context['top_views']}
+        self.assertIn('post_detail', views)
+        self.assertIn('admin_panel', views)
+        top = response.context['top_queries']
+        self.assertEqual(top, sorted(top, key=lambda query: query['total_ms'], reverse=True))
+        self.assertContains(response, 'Top Queries by Database Time')
+
+    def test_p95_comes_from_the_histogram(self):
+        buckets = [0] * (len(querylog.BUCKETS) + 1)
+        buckets[0], buckets[5] = 94, 6
+        self.assertEqual(querylog.percentile(buckets), querylog.BUCKETS[5])
+        buckets[5], buckets[-1] = 0, 6
+        self.assertIsNone(querylog.percentile(buckets))
+
+
+class MetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', 'pass12345')
+        cls.post = BlogPost.objects.create(title='Hello', content='x', author=cls.author, status='published')
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        override = self.settings(METRICS_ROOT=tmp.name, METRICS_FLUSH_INTERVAL=3600, METRICS_TOKEN='secret')
+        override.enable()
+        self.addCleanup(override.disable)
+        previous = metrics.registry
+        metrics.registry = metrics.Registry()
+        self.addCleanup(setattr, metrics, 'registry', previous)
+
+    def histogram(self, series, name):
+        [(offset, bounds)] = [
+            (offset, bounds) for offset, (histogram, _, bounds) in zip(metrics.OFFSETS, metrics.HISTOGRAMS)
+            if histogram == name
+        ]
+        counters = series[offset:offset + len(bounds) + 2]
+        return sum(counters[:-1]), counters[-1]
+
+    def test_requests_are_recorded_per_route_and_status(self):
+        self.client.get(reverse('post_detail', kwargs={'pk': self.post.pk}))
+        self.client.get(reverse('post_detail', kwargs={'pk': self.post.pk}))
+        self.client.get(reverse('post_detail', kwargs={'pk': self.post.pk + 1}))
+        self.client.get('/no-such-page/')
+        series = metrics.registry.snapshot()
+        self.assertEqual(set(series), {('post_detail', 200), ('post_detail', 404), (metrics.UNMATCHED, 404)})
+
+        found = series['post_detail', 200]
+        self.assertEqual(self.histogram(found, 'http_request_duration_seconds')[0], 2)
+        count, size = self.histogram(found, 'http_response_size_bytes')
+        self.assertEqual(count, 2)
+        self.assertGreater(size, 1000)
+        count, queries = self.histogram(found, 'http_request_queries')
+        self.assertGreater(queries, 2)
+        self.assertGreater(self.histogram(found, 'http_request_db_seconds')[1], 0)
+
+    def test_endpoint_sums_all_processes(self):
+        self.client.get(reverse('home'))
+        metrics.registry.flush()
+        metrics.registry = metrics.Registry()
+        self.client.get(reverse('home'))
+
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', text)
+        self.assertIn('http_request_duration_seconds_count{route="home",status="200"} 2', text)
+        self.assertIn('http_request_queries_bucket{route="home",status="200",le="+Inf"} 2', text)
+
+    def test_buckets_are_cumulative(self):
+        metrics.registry.record('home', 200, 0.003, None, 0.0, 0)
+        metrics.registry.record('home', 200, 0.02, None, 0.0, 0)
+        text = metrics.render(metrics.registry.snapshot())
+        self.assertIn('http_request_duration_seconds_bucket{route="home",status="200",le="0.005"} 1', text)
+        self.assertIn('http_request_duration_seconds_bucket{route="home",status="200",le="0.025"} 2', text)
+        self.assertIn('http_response_size_bytes_count{route="home",status="200"} 0', text)
+
+    def test_series_of_finished_threads_are_kept_but_not_their_dicts(self):
+        for _ in range(3):
+            thread = threading.Thread(target=metrics.registry.record, args=('home', 200, 0.003, None, 0.0, 0))
+            thread.start()
+            thread.join()
+        metrics.registry.record('home', 200, 0.02, None, 0.0, 0)
+        self.assertEqual(len(metrics.registry.threads), 1)
+        series = metrics.registry.snapshot()
+        self.assertEqual(self.histogram(series['home', 200], 'http_request_duration_seconds')[0], 4)
+
+    def test_token_is_required(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        with self.settings(METRICS_TOKEN=None):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+            with self.settings(DEBUG=True):
+                self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+
+class WarmCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', 'pass12345')
+        cls.category = Category.objects.create(name='python')
+        cls.tag = Tag.objects.create(name='django')
+        cls.popular = BlogPost.objects.create(title='Popular', content='x', author=cls.author,
+                                              category=cls.category, status='published', view_count=100)
+        cls.popular.tags.add(cls.tag)
+        cls.active = BlogPost.objects.create(title='Active', content='x', author=cls.author, status='published')
+        cls.quiet = BlogPost.objects.create(title='Quiet', content='x', author=cls.author, status='published')
+        BlogPost.objects.filter(pk=cls.quiet.pk).update(
+            comments_changed_at=timezone.now() - timedelta(days=30),
+            reactions_changed_at=timezone.now() - timedelta(days=30),
+        )
+        Comment.objects.create(post=cls.popular, author=cls.author, content='First')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_picks_most_read_and_recently_active_posts(self):
+        self.assertEqual(warmup.hot_posts(1, 7), [self.popular.pk, self.active.pk])
+        urls = [url for url, _ in warmup.pages(posts=1, listings=5)]
+        self.assertEqual(urls[0], reverse('home'))
+        self.assertIn(reverse('category_posts', kwargs={'name': 'python'}), urls)
+        self.assertIn(reverse('tag_posts', kwargs={'name': 'django'}), urls)
+        self.assertNotIn(reverse('post_detail', kwargs={'pk': self.quiet.pk}), urls)
+
+    def test_fills_caches_without_counting_views(self):
+        out = StringIO()
+        call_command('warm_cache', '--posts=1', '--workers=1', stdout=out)
+        self.assertIn('Warmed 8 of 8 page(s)', out.getvalue())
+        self.assertIn('no cache keys were kept for the web workers', out.getvalue())
+
+        self.popular.refresh_from_db()
+        self.assertEqual((self.popular.view_count, self.popular.unique_viewers), (100, 0))
+        thread = comment_cache.render_threads(self.popular)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(comment_cache.render_threads(self.popular)), len(thread))
+        self.assertIsNotNone(cache.get(f'viewers:{self.popular.pk}:{ViewerSketch.TOTAL}'))
+
+    def test_reports_the_keys_it_filled(self):
+        targets = warmup.pages(posts=1, listings=5)
+        first = warmup.warm(targets, workers=1)
+        self.assertEqual(first['failed'], [])
+        self.assertGreater(first['keys'], 0)
+        self.assertFalse(first['shared'])
+        self.assertEqual(warmup.warm(targets, workers=1)['keys'], 0)
+
+    def test_reports_keys_kept_in_a_shared_cache(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        backend = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': tmp.name}
+        out = StringIO()
+        with self.settings(CACHES={'default': backend}):
+            call_command('warm_cache', '--posts=1', '--workers=1', stdout=out)
+        self.assertRegex(out.getvalue(), r'Warmed 8 of 8 page\(s\) in [\d.]+s, filling [1-9]\d* cache key\(s\)\.')
+
+
+class TypeaheadTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('django_fan', 'fan@example.com', 'pass12345')
+        cls.popular = BlogPost.objects.create(title='Django tips', content='x', author=cls.author,
+                                              status='published', view_count=50)
+        cls.other = BlogPost.objects.create(title='Déjà vu with Django', content='x', author=cls.author,
+                                            status='published', view_count=5)
+        cls.draft = BlogPost.objects.create(title='Django drafts', content='x', author=cls.author, status='draft')
+        cls.tag = Tag.objects.create(name='django')
+
+    def setUp(self):
+        typeahead.reset()
+        self.addCleanup(typeahead.reset)
+
+    def labels(self, query):
+        return {kind: [item['label'] for item in items] for kind, items in typeahead.suggest(query).items()}
+
+    def test_groups_are_ranked_by_popularity(self):
+        self.assertEqual(self.labels('DJ'), {
+            'posts': ['Django tips', 'Déjà vu with Django'], 'tags': ['django'], 'users': ['django_fan'],
+        })
+        self.assertEqual(self.labels('deja')['posts'], ['Déjà vu with Django'])
+        self.assertEqual(self.labels('django t')['posts'], ['Django tips'])
+        self.assertEqual(self.labels('   ')['posts'], [])
+
+    def test_signals_update_the_index(self):
+        self.labels('dj')
+        with self.captureOnCommitCallbacks(execute=True):
+            post = BlogPost.objects.create(title='Django at scale', content='x', author=self.author,
+                                           status='published', view_count=100)
+            self.draft.status = 'published'
+            self.draft.save()
+            self.popular.delete()
+        self.assertEqual(self.labels('dj')['posts'], ['Django at scale', 'Déjà vu with Django', 'Django drafts'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            reader = User.objects.create_user('djangonaut', 'naut@example.com', 'pass12345')
+            Follow.objects.create(follower=self.author, followed=reader)
+            post.title = 'Scaling'
+            post.save()
+        self.assertEqual(self.labels('dj')['users'], ['djangonaut', 'django_fan'])
+        self.assertEqual(self.labels('scal')['posts'], ['Scaling'])
+        self.assertEqual(self.labels('django a')['posts'], [])
+
+    def test_remembered_rankings_stay_exact(self):
+        index = typeahead.Index()
+        for pk in range(typeahead.KEPT + 5):
+            index.put('posts', pk, f'Post {pk}', pk)
+        self.assertEqual([pk for pk, _ in index.search('post', 3)['posts']], [24, 23, 22])
+        index.remove('posts', 24)
+        index.put('posts', 23, 'Post 23', 0)
+        index.put('posts', 99, 'Post 99', 30)
+        self.assertEqual([pk for pk, _ in index.search('post', 3)['posts']], [99, 22, 21])
+        # Ranked from scratch
+        self.assertEqual([pk for pk, _ in index.search('pos', 3)['posts']], [99, 22, 21])
+
+    def test_suggest_endpoint(self):
+        response = self.client.get(reverse('search_suggest'), {'q': 'tips'})
+        self.assertEqual(response.json()['posts'], [
+            {'label': 'Django tips', 'url': reverse('post_detail', kwargs={'pk': self.popular.pk})},
+        ])
+
+
+class FacetedSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.ann = User.objects.create_user('ann', 'ann@example.com', 'pass12345')
+        cls.bob = User.objects.create_user('bob', 'bob@example.com', 'pass12345')
+        cls.python = Category.objects.create(name='python')
+        cls.rust = Category.objects.create(name='rust')
+        cls.web = Tag.objects.create(name='web')
+        cls.cli = Tag.objects.create(name='cli')
+
+        def post(title, author, category, tags, status='published'):
+            created = BlogPost.objects.create(title=title, content='x', author=author, category=category, status=status)
+            created.tags.set(tags)
+            return created
+
+        cls.posts = [
+            post('Django guide', cls.ann, cls.python, [cls.web]),
+            post('Click guide', cls.ann, cls.python, [cls.cli]),
+            post('Axum guide', cls.bob, cls.rust, [cls.web]),
+            post('Clap guide', cls.bob, cls.rust, [cls.cli, cls.web]),
+            post('Unrelated', cls.bob, cls.rust, [cls.cli]),
+            post('Draft guide', cls.ann, cls.python, [cls.web], status='draft'),
+        ]
+
+    def setUp(self):
+        facets.reset()
+        self.addCleanup(facets.reset)
+
+    def search(self, **params):
+        response = self.client.get(reverse('search_posts'), {'query': 'guide', **params})
+        counts = {
+            facet: {value['name']: value['count'] for value in values}
+            for facet, values in response.context['facets'].items()
+        }
+        return [post.title for post in response.context['page_obj']], counts
+
+    def test_counts_each_facet_for_the_query(self):
+        titles, counts = self.search()
+        self.assertEqual(titles, ['Clap guide', 'Axum guide', 'Click guide', 'Django guide'])
+        self.assertEqual(counts, {
+            'category': {'python': 2, 'rust': 2},
+            'tag': {'web': 3, 'cli': 2},
+            'author': {'ann': 2, 'bob': 2},
+        })
+
+    def test_ignores_values_that_are_not_ids(self):
+        self.assertEqual(self.search(tag=['²', 'x']), self.search())
+
+    def test_selected_values_combine(self):
+        # OR within a facet, AND across facets; a facet's own selection
+        # does not narrow its counts
+        titles, counts = self.search(tag=[self.cli.pk], author=[self.ann.pk, self.bob.pk])
+        self.assertEqual(titles, ['Clap guide', 'Click guide'])
+        self.assertEqual(counts['tag'], {'web': 3, 'cli': 2})
+        self.assertEqual(counts['category'], {'python': 1, 'rust': 1})
+
+        titles, counts = self.search(tag=[self.cli.pk], category=[self.rust.pk])
+        self.assertEqual(titles, ['Clap guide'])
+        self.assertEqual(counts['category'], {'python': 1, 'rust': 1})
+        self.assertEqual(counts['author'], {'bob': 1})
+
+    def test_bitset_counts_match_array_counts(self):
+        index = facets.get_index()
+        ids = [post.pk for post in reversed(self.posts)]
+        selections = [{}, {'tag': {self.cli.pk}}, {'tag': {self.web.pk}, 'author': {self.bob.pk}},
+                      {'category': {self.python.pk, self.rust.pk}, 'tag': {self.cli.pk}}]
+        expected = [index.search(ids, selected) for selected in selections]
+        self.addCleanup(setattr, facets, 'ARRAY_LIMIT', facets.ARRAY_LIMIT)
+        facets.ARRAY_LIMIT = 0
+        self.assertEqual([index.search(ids, selected) for selected in selections], expected)
+
+    def test_facet_links_toggle_values(self):
+        response = self.client.get(reverse('search_posts'), {'query': 'guide', 'tag': self.cli.pk, 'page': 1})
+        [cli] = [value for value in response.context['facets']['tag'] if value['id'] == self.cli.pk]
+        self.assertTrue(cli['selected'])
+        self.assertEqual(cli['url'], '?query=guide')
+        self.assertContains(response, f'?query=guide&amp;tag={self.cli.pk}&amp;tag={self.web.pk}')
+
+    def test_sparse_and_dense_values_count_alike(self):
+        results = facets.bitset([p.pk for p in self.posts[:4]])
+        mask_bytes = results.to_bytes((results.bit_length() + 7) >> 3, 'little')
+        pks = [self.posts[0].pk, self.posts[2].pk, self.posts[4].pk]
+        dense, sparse = facets.Value('x', pks, 1), facets.Value('x', pks, 10 ** 6)
+        self.assertIsNotNone(dense.bits)
+        self.assertIsNotNone(sparse.pks)
+        self.assertEqual(dense.count(results, mask_bytes), 2)
+        self.assertEqual(sparse.count(results, mask_bytes), 2)
+
+    def test_index_is_rebuilt_in_the_background(self):
+        before = self.search(author=[self.ann.pk])
+        draft = self.posts[5]
+        draft.status = 'published'
+        draft.save()
+        self.assertEqual(self.search(author=[self.ann.pk]), before)
+
+        stale = facets.get_index()
+        with self.settings(FACETS_REFRESH=0), facets._building:
+            # A rebuild is under way: the old index serves without waiting
+            self.assertIs(facets.get_index(), stale)
+        facets._building.acquire()
+        facets._rebuild()
+        self.assertFalse(facets._building.locked())
+        titles, counts = self.search(author=[self.ann.pk])
+        self.assertEqual(titles, ['Draft guide', 'Click guide', 'Django guide'])
+        self.assertEqual(counts['category'], {'python': 3})
+
+
+class DigestTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', 'alice@example.com', 'pass12345')
+        cls.bob = User.objects.create_user('bob', 'bob@example.com', 'pass12345')
+        cls.carol = User.objects.create_user('carol', 'carol@example.com', 'pass12345')
+        cls.nomail = User.objects.create_user('nomail', '', 'pass12345')
+        cls.post = BlogPost.objects.create(title='Hello', content='x', author=cls.alice, status='published')
+
+    def notify(self, recipient, kind='follow', **fields):
+        return Notification.objects.create(recipient=recipient, sender=self.bob, notification_type=kind, **fields)
+
+    def test_mails_each_notification_once(self):
+        self.notify(self.alice)
+        last = self.notify(self.alice, 'like_post', post=self.post)
+        self.notify(self.carol, is_read=True)
+        self.notify(self.nomail)
+
+        out = StringIO()
+        call_command('send_digests', '--workers=1', stdout=out)
+        self.assertIn('Sent 1 digest(s) covering 2 notification(s)', out.getvalue())
+        message = mail.outbox[0]
+        self.assertEqual(message.to, ['alice@example.com'])
+        self.assertIn('bob started following you', message.body)
+        self.assertIn(f'/post/{self.post.pk}/', message.body)
+        self.assertIn('bob</strong> liked your post', message.alternatives[0][0])
+        self.assertEqual(DigestWatermark.objects.get(user=self.alice).notification_id, last.pk)
+
+        self.assertEqual(digests.send(workers=1)['sent'], 0)
+        self.notify(self.alice, 'comment', post=self.post)
+        self.assertEqual(digests.send(workers=1)['notifications'], 1)
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_chunks_and_caps_items(self):
+        for _ in range(3):
+            self.notify(self.alice)
+        self.notify(self.carol)
+        # Per chunk: recipients, notifications, watermark upsert
+        with self.assertNumQueries(7):
+            result = digests.send(chunk_size=1, workers=1, limit=2)
+        self.assertEqual((result['sent'], result['notifications']), (2, 4))
+        alice = next(message for message in mail.outbox if message.to == ['alice@example.com'])
+        self.assertEqual(alice.subject, '3 new notification(s) on Blog Site')
+        self.assertIn('...and 1 more.', alice.body)
+
+    def test_pool_renders_the_same_mails(self):
+        self.notify(self.alice, 'reply', post=self.post)
+        batch = digests.digests(digests.recipients(), 20)
+        with digests._renderer(2) as start_rendering:
+            pooled = list(start_rendering(batch))
+        self.assertEqual(pooled, list(map(digests.render, batch)))
+
+
+class RetentionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', 'alice@example.com', 'pass12345')
+        cls.bob = User.objects.create_user('bob', 'bob@example.com', 'pass12345')
+        cls.post = BlogPost.objects.create(title='Hello', content='x', author=cls.alice, status='published')
+
+    def notify(self, kind='comment', days=0, **fields):
+        fields.setdefault('sender', self.bob)
+        notification = Notification.objects.create(
+            recipient=self.alice, notification_type=kind, post=self.post, **fields
+        )
+        Notification.objects.filter(pk=notification.pk).update(created_at=timezone.now() - timedelta(days=days))
+        return notification.pk
+
+    def test_policies_keep_what_is_still_wanted(self):
+        carol = User.objects.create_user('carol', 'carol@example.com', 'pass12345')
+        Follow.objects.create(follower=self.bob, followed=self.alice)
+        kept = [
+            self.notify(days=100),  # unread
+            self.notify(days=10, is_read=True),
+            self.notify('follow'),
+        ]
+        self.notify(days=100, is_read=True)
+        self.notify('follow', sender=carol)
+        self.notify('like_post')
+
+        old = timezone.now() - timedelta(days=30)
+        done = Job.objects.create(name='x', status='done', finished_at=old)
+        failed = Job.objects.create(name='x', status='failed', finished_at=old)
+        tag = Tag.objects.create(name='django')
+        TagActivity.objects.create(tag=tag, day=(old - timedelta(days=90)).date())
+        recent = TagActivity.objects.create(tag=tag, day=old.date())
+
+        out = StringIO()
+        call_command('prune_rows', '--batch-size=1', stdout=out)
+        self.assertIn('withdrawn notifications: deleted 2 row(s)', out.getvalue())
+        self.assertEqual(sorted(Notification.objects.values_list('pk', flat=True)), kept)
+        self.assertEqual(list(Job.objects.filter(pk__in=[done.pk, failed.pk])), [failed])
+        self.assertEqual(list(TagActivity.objects.all()), [recent])
+
+    def test_batches_cover_gaps_between_matches(self):
+        pks = [self.notify(days=100, is_read=index % 3 != 0) for index in range(10)]
+        with self.assertNumQueries(1 + 2 * 4):
+            deleted, _ = retention.prune(Notification, Q(is_read=True), batch_size=2)
+        self.assertEqual(deleted, 6)
+        self.assertEqual(list(Notification.objects.order_by('pk').values_list('pk', flat=True)), pks[::3])
+
+    @override_settings(NOTIFICATION_READ_RETENTION_DAYS=None, NOTIFICATION_PRUNE_WITHDRAWN=False)
+    def test_disabled_policies_are_skipped(self):
+        self.assertEqual([name for name, _, _ in retention.policies()], ['finished jobs', 'tag activity'])
 
-# Create your tests here.
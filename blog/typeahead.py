@@ -0,0 +1,305 @@
+import heapq
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connections
+from django.urls import reverse
+
+from .models import BlogPost, Tag
+
+# Typeahead suggestions for the navbar search.
+#
+# Each process keeps an in-memory index over published post titles, tag
+# names and usernames: a sorted list of distinct words and, per word, the
+# items containing it. A query's longest word is looked up as a prefix by
+# bisection and its items ranked by popularity (views, tagged posts,
+# followers); the other words must prefix some word of the item too. The
+# top KEPT items per kind are remembered per prefix and kept exact as
+# items come and go, so a repeated prefix costs a dict lookup.
+#
+# The signals put and remove items once their transaction commits. Changes
+# made by other processes, and counters updated without signals (views,
+# tag counts), arrive with a full rebuild every TYPEAHEAD_REFRESH seconds,
+# done in a background thread while the old index keeps serving.
+
+KINDS = ('posts', 'tags', 'users')
+KEPT = 20
+PRECOMPUTED = 2  # prefixes this short are ranked when the index is built
+MAX_PREFIXES = 20000
+WORD = re.compile(r'\w+')
+
+
+def refresh_interval():
+    return getattr(settings, 'TYPEAHEAD_REFRESH', 600)
+
+
+def normalize(text):
+    # Case- and accent-insensitive
+    if text.isascii():
+        return text.lower()
+    text = unicodedata.normalize('NFKD', text)
+    return ''.join(char for char in text if not unicodedata.combining(char)).casefold()
+
+
+def _words(text):
+    return tuple(set(WORD.findall(normalize(text))))
+
+
+def _prefixes(words):
+    return {word[:end] for word in words for end in range(1, len(word) + 1)}
+
+
+def _key(kind, pk):
+    # Items are keyed by one int, pk and kind together
+    return pk * len(KINDS) + KINDS.index(kind)
+
+
+def _kind(key):
+    return KINDS[key % len(KINDS)]
+
+
+class Entry:
+    __slots__ = ('label', 'score', 'words')
+
+    def __init__(self, label, score, words):
+        self.label = label
+        self.score = score
+        self.words = words
+
+
+class Index:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}  # key -> Entry
+        self.postings = {}  # word -> [key, ...]
+        self.words = []  # sorted keys of postings
+        self.ranked = {}  # prefix -> {kind: [key, ...]}, best first
+        self.built_at = time.monotonic()
+
+    @classmethod
+    def load(cls, rows):
+        # rows: (kind, pk, label, score) in any order
+        index = cls()
+        for kind, pk, label, score in rows:
+            key = _key(kind, pk)
+            entry = index.entries[key] = Entry(label, score, _words(label))
+            for word in entry.words:
+                index.postings.setdefault(word, []).append(key)
+        index.words = sorted(index.postings)
+        for prefix in {word[:end] for word in index.words for end in range(1, PRECOMPUTED + 1)}:
+            index.ranked[prefix] = index._top(index._matches(prefix), KEPT)
+        return index
+
+    def _rank(self, key):
+        return self.entries[key].score, key
+
+    def put(self, kind, pk, label, score=None):
+        # score None keeps the item's current score
+        key = _key(kind, pk)
+        with self.lock:
+            old = self._unlink(key)
+            if score is None:
+                score = old.score if old else 0
+            entry = self.entries[key] = Entry(label, score, _words(label))
+            for word in entry.words:
+                postings = self.postings.get(word)
+                if postings is None:
+                    postings = self.postings[word] = []
+                    insort(self.words, word)
+                postings.append(key)
+
+            prefixes = _prefixes(entry.words)
+            for prefix in _prefixes(old.words) - prefixes if old else ():
+                self._unrank(prefix, key)
+            for prefix in prefixes:
+                ranked = self.ranked.get(prefix)
+                if ranked is None:
+                    continue
+                keys = ranked[kind]
+                if key in keys and score < old.score and len(keys) >= KEPT:
+                    # An item below it may now belong in the list
+                    ranked[kind] = self._top(self._matches(prefix), KEPT, kind)[kind]
+                    continue
+                if key not in keys:
+                    keys.append(key)
+                keys.sort(key=self._rank, reverse=True)
+                del keys[KEPT:]
+
+    def remove(self, kind, pk):
+        key = _key(kind, pk)
+        with self.lock:
+            entry = self._unlink(key)
+            for prefix in _prefixes(entry.words) if entry else ():
+                self._unrank(prefix, key)
+
+    def rescore(self, kind, pk, delta):
+        entry = self.entries.get(_key(kind, pk))
+        if entry is not None:
+            self.put(kind, pk, entry.label, max(entry.score + delta, 0))
+
+    def _unlink(self, key):
+        entry = self.entries.pop(key, None)
+        for word in entry.words if entry else ():
+            postings = self.postings[word]
+            postings.remove(key)
+            if not postings:
+                del self.postings[word]
+                del self.words[bisect_left(self.words, word)]
+        return entry
+
+    def _unrank(self, prefix, key):
+        ranked = self.ranked.get(prefix)
+        kind = _kind(key)
+        if ranked is None or key not in ranked[kind]:
+            return
+        if len(ranked[kind]) >= KEPT:
+            # The next best item is unknown until ranked again
+            ranked[kind] = self._top(self._matches(prefix), KEPT, kind)[kind]
+        else:
+            ranked[kind].remove(key)
+
+    def _matches(self, prefix):
+        index = bisect_left(self.words, prefix)
+        end = bisect_left(self.words, prefix + '\uffff', index)
+        return set().union(*(self.postings[word] for word in self.words[index:end]))
+
+    def _top(self, keys, limit, *kinds):
+        by_kind = {kind: [] for kind in kinds or KINDS}
+        for key in keys:
+            found = by_kind.get(_kind(key))
+            if found is not None:
+                found.append(key)
+        return {kind: heapq.nlargest(limit, found, key=self._rank) for kind, found in by_kind.items()}
+
+    def search(self, query, limit=5):
+        # {kind: [(pk, Entry), ...]} best first, at most KEPT of each
+        limit = min(limit, KEPT)
+        terms = WORD.findall(normalize(query))
+        if not terms:
+            return {kind: [] for kind in KINDS}
+        prefix = max(terms, key=len)
+        terms.remove(prefix)
+
+        def wanted(key):
+            words = self.entries[key].words
+            return all(any(word.startswith(term) for word in words) for term in terms)
+
+        with self.lock:
+            ranked = self.ranked.get(prefix)
+            if ranked is None:
+                if len(self.ranked) >= MAX_PREFIXES:
+                    self.ranked = {prefix: keys for prefix, keys in self.ranked.items() if len(prefix) <= PRECOMPUTED}
+                ranked = self.ranked[prefix] = self._top(self._matches(prefix), KEPT)
+            if not terms:
+                found = {kind: keys[:limit] for kind, keys in ranked.items()}
+            else:
+                found = {kind: [key for key in keys if wanted(key)][:limit] for kind, keys in ranked.items()}
+                if any(len(found[kind]) < limit and len(ranked[kind]) >= KEPT for kind in KINDS):
+                    # The remembered lists ran out before enough items
+                    # matched the other words: rank all under the prefix
+                    found = self._top(filter(wanted, self._matches(prefix)), limit)
+            return {
+                kind: [(key // len(KINDS), self.entries[key]) for key in keys]
+                for kind, keys in found.items()
+            }
+
+
+def build():
+    posts = BlogPost.objects.filter(status='published').values_list('pk', 'title', 'view_count')
+    tags = Tag.objects.values_list('pk', 'name', 'post_count')
+    users = User.objects.filter(is_active=True).values_list('pk', 'username', 'profile__followers_count')
+
+    def rows():
+        for kind, queryset in (('posts', posts), ('tags', tags), ('users', users)):
+            for pk, label, score in queryset.iterator(chunk_size=2000):
+                yield kind, pk, label, score or 0
+
+    return Index.load(rows())
+
+
+_index = None
+_state_lock = threading.Lock()  # guards _index and _replay
+_building = threading.Lock()
+_replay = None  # changes made while a rebuild reads the database
+
+
+def get_index():
+    index = _index
+    if index is None:
+        with _building:
+            if _index is None:
+                _build()
+            return _index
+    if time.monotonic() - index.built_at >= refresh_interval() and _building.acquire(blocking=False):
+        threading.Thread(target=_rebuild, daemon=True).start()
+    return index
+
+
+def _build():
+    global _index, _replay
+    with _state_lock:
+        _replay = []
+    try:
+        index = build()
+        with _state_lock:
+            for method, args in _replay:
+                getattr(index, method)(*args)
+            _index = index
+    finally:
+        _replay = None
+
+
+def _rebuild():
+    try:
+        _build()
+    finally:
+        connections.close_all()
+        _building.release()
+
+
+def _apply(method, *args):
+    with _state_lock:
+        if _index is not None:
+            getattr(_index, method)(*args)
+        if _replay is not None:
+            _replay.append((method, args))
+
+
+def put(kind, pk, label, score=None):
+    _apply('put', kind, pk, label, score)
+
+
+def remove(kind, pk):
+    _apply('remove', kind, pk)
+
+
+def rescore(kind, pk, delta):
+    _apply('rescore', kind, pk, delta)
+
+
+def reset():
+    global _index
+    _index = None
+
+
+def _url(kind, pk, entry):
+    if kind == 'posts':
+        return reverse('post_detail', kwargs={'pk': pk})
+    if kind == 'tags':
+        return reverse('tag_posts', kwargs={'name': entry.label})
+    return reverse('user_profile', kwargs={'username': entry.label})
+
+
+def suggest(query, limit=5):
+    # Grouped suggestions for the navbar, as JSON-ready dicts
+    index = get_index()
+    found = index.search(query, limit)
+    return {
+        kind: [{'label': entry.label, 'url': _url(kind, pk, entry)} for pk, entry in entries]
+        for kind, entries in found.items()
+    }
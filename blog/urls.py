@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import api, feeds, views
 
 urlpatterns = [
     path('', views.home, name='home'),
@@ -7,6 +7,8 @@ urlpatterns = [
     path('profile/', views.profile, name='profile'),
     path('profile/edit/', views.edit_profile, name='edit_profile'),
     path('profile/<str:username>/', views.user_profile, name='user_profile'),
+    path('profile/<str:username>/followers/', views.follow_list, {'relation': 'followers'}, name='followers_list'),
+    path('profile/<str:username>/following/', views.follow_list, {'relation': 'following'}, name='following_list'),
     path('follow/<str:username>/', views.follow_user, name='follow_user'),
     path('unfollow/<str:username>/', views.unfollow_user, name='unfollow_user'),
     path('logout/', views.logout_view, name='logout'),
@@ -16,12 +18,17 @@ urlpatterns = [
     path('post/<int:pk>/', views.post_detail, name='post_detail'),
     path('post/<int:pk>/edit/', views.edit_post, name='edit_post'),
     path('post/<int:pk>/delete/', views.delete_post, name='delete_post'),
+    path('post/<int:pk>/history/', views.post_history, name='post_history'),
+    path('post/<int:pk>/history/<int:number>/', views.revision_diff, name='revision_diff'),
+    path('post/<int:pk>/history/<int:number>/restore/', views.restore_revision, name='restore_revision'),
     path('post/<int:pk>/like/', views.like_post, name='like_post'),
     path('post/<int:pk>/dislike/', views.dislike_post, name='dislike_post'),
+    path('post/autosave/', views.autosave_draft, name='autosave_draft'),
     path('drafts/', views.DraftListView.as_view(), name='draft_list'),
     
     # Comments
     path('post/<int:post_pk>/comment/', views.add_comment, name='add_comment'),
+    path('post/<int:pk>/comments/', views.comment_page, name='comment_page'),
     path('comment/<int:comment_pk>/reply/', views.reply_to_comment, name='reply_to_comment'),
     path('comment/<int:pk>/like/', views.like_comment, name='like_comment'),
     path('comment/<int:pk>/dislike/', views.dislike_comment, name='dislike_comment'),
@@ -29,15 +36,48 @@ urlpatterns = [
     # Categories and Tags
     path('category/<str:name>/', views.category_posts, name='category_posts'),
     path('tag/<str:name>/', views.tag_posts, name='tag_posts'),
+    path('tags/cloud/', views.tag_cloud, name='tag_cloud'),
+    
+    # Feeds
+    path('feed/rss/', feeds.site_rss, name='feed_rss'),
+    path('feed/atom/', feeds.site_atom, name='feed_atom'),
+    path('feed/category/<str:name>/rss/', feeds.category_rss, name='category_feed_rss'),
+    path('feed/category/<str:name>/atom/', feeds.category_atom, name='category_feed_atom'),
+    path('feed/tag/<str:name>/rss/', feeds.tag_rss, name='tag_feed_rss'),
+    path('feed/tag/<str:name>/atom/', feeds.tag_atom, name='tag_feed_atom'),
+    path('feed/author/<str:username>/rss/', feeds.author_rss, name='author_feed_rss'),
+    path('feed/author/<str:username>/atom/', feeds.author_atom, name='author_feed_atom'),
+    
+    # Read-only JSON API
+    path('api/posts/', api.post_list, name='api_post_list'),
+    path('api/posts/<int:pk>/', api.post_detail, name='api_post_detail'),
+    path('api/comments/', api.comment_list, name='api_comment_list'),
+    path('api/comments/<int:pk>/', api.comment_detail, name='api_comment_detail'),
+    path('api/profiles/', api.profile_list, name='api_profile_list'),
+    path('api/profiles/<str:username>/', api.profile_detail, name='api_profile_detail'),
+    path('api/categories/', api.category_list, name='api_category_list'),
+    path('api/categories/<int:pk>/', api.category_detail, name='api_category_detail'),
+    path('api/tags/', api.tag_list, name='api_tag_list'),
+    path('api/tags/<int:pk>/', api.tag_detail, name='api_tag_detail'),
+    
+    # Sitemaps (built by the build_sitemaps command)
+    path('sitemap.xml', views.sitemap_index, name='sitemap_index'),
+    path('sitemaps/<str:name>', views.sitemap_shard, name='sitemap_shard'),
+    
+    # Prometheus metrics (see blog/metrics.py)
+    path('metrics/', views.prometheus_metrics, name='metrics'),
     
     # Search
     path('search/', views.search_posts, name='search_posts'),
+    path('search/suggest/', views.search_suggest, name='search_suggest'),
     
     # Admin panel for moderation
     path('admin-panel/', views.admin_panel, name='admin_panel'),
     path('admin-panel/posts/', views.admin_posts, name='admin_posts'),
     path('admin-panel/comments/', views.admin_comments, name='admin_comments'),
     path('admin-panel/users/', views.admin_users, name='admin_users'),
+    path('admin-panel/profiles/', views.admin_profiles, name='admin_profiles'),
+    path('admin-panel/profiles/<str:profile_id>/', views.admin_profile_detail, name='admin_profile_detail'),
     
     # Tags
     path('tag/create/', views.create_tag, name='create_tag'),
@@ -0,0 +1,82 @@
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .hll import HyperLogLog, hash64
+from .models import BlogPost, ViewerSketch
+
+# Unique-reader counting per post with HyperLogLog sketches.
+#
+# Sketches live in ViewerSketch rows (one per day plus the all-time row) and
+# are cached, so a repeat visit reads nothing from the database and writes
+# nothing: a write only happens when a register actually grows.
+
+CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def viewer_key(request):
+    if request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    if request.session.session_key:
+        return f'session:{request.session.session_key}'
+    meta = request.META
+    return f"anon:{meta.get('REMOTE_ADDR', '')}:{meta.get('HTTP_USER_AGENT', '')}"
+
+
+def _cache_key(post_id, bucket):
+    return f'viewers:{post_id}:{bucket}'
+
+
+def load_sketch(post_id, bucket):
+    data = cache.get(_cache_key(post_id, bucket))
+    if data is None:
+        row = ViewerSketch.objects.filter(post_id=post_id, bucket=bucket).values_list('registers', flat=True).first()
+        data = bytes(row) if row is not None else b''
+        cache.set(_cache_key(post_id, bucket), data, CACHE_TIMEOUT)
+    return HyperLogLog.from_bytes(data) if data else HyperLogLog()
+
+
+def save_sketch(post_id, bucket, sketch):
+    # Merge with the stored registers under a row lock so concurrent
+    # workers never drop each other's updates
+    with transaction.atomic():
+        row, created = ViewerSketch.objects.select_for_update().get_or_create(
+            post_id=post_id, bucket=bucket, defaults={'registers': sketch.to_bytes()}
+        )
+        if not created:
+            stored = bytes(row.registers)
+            sketch.merge(HyperLogLog.from_bytes(stored))
+            if sketch.to_bytes() != stored:
+                row.registers = sketch.to_bytes()
+                row.save(update_fields=['registers', 'updated_at'])
+    cache.set(_cache_key(post_id, bucket), sketch.to_bytes(), CACHE_TIMEOUT)
+    return sketch
+
+
+def record_view(request, post):
+    hashed = hash64(viewer_key(request))
+
+    today = timezone.now().date().isoformat()
+    daily = load_sketch(post.pk, today)
+    if daily.add_hash(hashed):
+        save_sketch(post.pk, today, daily)
+
+    total = load_sketch(post.pk, ViewerSketch.TOTAL)
+    if total.add_hash(hashed):
+        total = save_sketch(post.pk, ViewerSketch.TOTAL, total)
+        # Never lowered: a post restored from the archive keeps its count
+        # but starts a new sketch
+        BlogPost.objects.filter(pk=post.pk).update(unique_viewers=Greatest('unique_viewers', total.count()))
+
+
+def merged_sketch(post_id, days):
+    # Unique readers over the last `days` days, merged from daily sketches
+    since = (timezone.now() - timedelta(days=days - 1)).date().isoformat()
+    sketch = HyperLogLog()
+    rows = ViewerSketch.objects.filter(post_id=post_id, bucket__gte=since).exclude(bucket=ViewerSketch.TOTAL)
+    for registers in rows.values_list('registers', flat=True):
+        sketch.merge(HyperLogLog.from_bytes(bytes(registers)))
+    return sketch
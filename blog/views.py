@@ -1,16 +1,27 @@
+import json
+import os
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib.auth.models import User
 from django.contrib import messages
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
-from django.http import JsonResponse, HttpResponseRedirect
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, HttpResponseRedirect
 from django.urls import reverse
-from django.db.models import Q, Count
+from django.db import transaction
+from django.db.models import Q, Count, F
 from django.core.paginator import Paginator
-from .models import Profile, BlogPost, Comment, Category, Follow, Notification, Tag
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import condition, require_GET, require_POST
+from . import autosave, comment_cache, conditional, facets, metrics, profiling, querylog, revisions, sitemaps, tag_stats, typeahead, warmup
+from .models import Profile, ArchivedPost, BlogPost, Comment, Category, Follow, Notification, PostRevision, Tag
 from .forms import (UserRegisterForm, UserUpdateForm, ProfileUpdateForm, 
                    BlogPostForm, CommentForm, ReplyForm, SearchForm, TagForm)
+from .pagination import cursor_paginate
+from .suggestions import suggestions_for
+from .viewers import record_view
 from django.contrib.auth import logout
 
 class DraftListView(LoginRequiredMixin, ListView):
@@ -25,6 +36,7 @@ class DraftListView(LoginRequiredMixin, ListView):
             status='draft'
         ).order_by('-created_at')
 
+@condition(etag_func=conditional.home_etag, last_modified_func=conditional.home_last_modified)
 def home(request):
     posts = BlogPost.objects.filter(status='published').order_by('-created_at')
     popular_posts = BlogPost.objects.filter(status='published').order_by('-view_count')[:5]
@@ -38,6 +50,7 @@ def home(request):
         'page_obj': page_obj,
         'popular_posts': popular_posts,
         'categories': categories,
+        'trending_tags': tag_stats.trending_tags(),
     }
     
     return render(request, 'blog/home.html', context)
@@ -46,7 +59,9 @@ def register(request):
     if request.method == 'POST':
         form = UserRegisterForm(request.POST)
         if form.is_valid():
-            form.save()
+            # User and Profile (created by the post_save signal) together
+            with transaction.atomic():
+                form.save()
             username = form.cleaned_data.get('username')
             messages.success(request, f'Account created for {username}! You can now log in.')
             return redirect('login')
@@ -73,9 +88,9 @@ def profile(request):
     # Get user's blog posts
     posts = BlogPost.objects.filter(author=request.user).order_by('-created_at')
     
-    # Get followers and following
-    followers = Follow.objects.filter(followed=request.user).select_related('follower')
-    following = Follow.objects.filter(follower=request.user).select_related('followed')
+    # First page of followers and following; the rest is paginated
+    followers = _follow_page(request, request.user, 'followers')
+    following = _follow_page(request, request.user, 'following')
     
     context = {
         'u_form': u_form,
@@ -83,6 +98,7 @@ def profile(request):
         'posts': posts,
         'followers': followers,
         'following': following,
+        'suggested_users': suggestions_for(request.user),
     }
     
     return render(request, 'blog/profile.html', context)
@@ -110,7 +126,7 @@ def edit_profile(request):
     return render(request, 'blog/edit_profile.html', context)
 
 def user_profile(request, username):
-    user = get_object_or_404(User, username=username)
+    user = get_object_or_404(User.objects.select_related('profile'), username=username)
     posts = BlogPost.objects.filter(author=user, status='published').order_by('-created_at')
     
     # Check if the current user is following this user
@@ -118,27 +134,61 @@ def user_profile(request, username):
     if request.user.is_authenticated:
         is_following = Follow.objects.filter(follower=request.user, followed=user).exists()
     
-    # Get followers and following
-    followers = Follow.objects.filter(followed=user).select_related('follower')
-    following = Follow.objects.filter(follower=user).select_related('followed')
-    
+    # The page shows the profile's counters; the lists have their own
+    # paginated views
     context = {
         'profile_user': user,
         'posts': posts,
         'is_following': is_following,
-        'followers': followers,
-        'following': following,
     }
     
+    if request.user.is_authenticated:
+        context['suggested_users'] = suggestions_for(request.user, exclude={user.pk})
+    
     return render(request, 'blog/user_profile.html', context)
 
+FOLLOW_PAGE_SIZE = 20
+
+def _follow_page(request, user, relation, cursor=None, per_page=FOLLOW_PAGE_SIZE):
+    # Keyset-paginated Follow rows, newest first, with the listed users in
+    # `page.users` and whether the viewer follows each of them
+    if relation == 'followers':
+        follows = Follow.objects.filter(followed=user).select_related('follower__profile')
+    else:
+        follows = Follow.objects.filter(follower=user).select_related('followed__profile')
+    page = cursor_paginate(follows, cursor, per_page)
+    page.users = [f.follower if relation == 'followers' else f.followed for f in page]
+    
+    # One membership query for the whole page instead of one per user
+    viewer_follows = set()
+    if request.user.is_authenticated and page.users:
+        viewer_follows = set(Follow.objects.filter(
+            follower=request.user, followed__in=[u.pk for u in page.users]
+        ).values_list('followed_id', flat=True))
+    for listed in page.users:
+        listed.viewer_follows = listed.pk in viewer_follows
+    return page
+
+def follow_list(request, username, relation):
+    user = get_object_or_404(User.objects.select_related('profile'), username=username)
+    page = _follow_page(request, user, relation, cursor=request.GET.get('cursor'))
+    
+    context = {
+        'profile_user': user,
+        'relation': relation,
+        'page': page,
+    }
+    
+    return render(request, 'blog/follow_list.html', context)
+
 @login_required
 def follow_user(request, username):
     user_to_follow = get_object_or_404(User, username=username)
     
-    # Check if already following
+    # Check if already following; counters are updated in the same transaction
     if request.user != user_to_follow:
-        Follow.objects.get_or_create(follower=request.user, followed=user_to_follow)
+        with transaction.atomic():
+            Follow.objects.get_or_create(follower=request.user, followed=user_to_follow)
         messages.success(request, f'You are now following {username}.')
     
     return redirect('user_profile', username=username)
@@ -147,8 +197,9 @@ def follow_user(request, username):
 def unfollow_user(request, username):
     user_to_unfollow = get_object_or_404(User, username=username)
     
-    # Delete the follow relationship
-    Follow.objects.filter(follower=request.user, followed=user_to_unfollow).delete()
+    # Delete the follow relationship and update the counters together
+    with transaction.atomic():
+        Follow.objects.filter(follower=request.user, followed=user_to_unfollow).delete()
     messages.success(request, f'You have unfollowed {username}.')
     
     return redirect('user_profile', username=username)
@@ -175,6 +226,8 @@ def create_post(request):
                     tag, created = Tag.objects.get_or_create(name=tag_name.lower())
                     post.tags.add(tag)
             
+            revisions.record(post, request.user)
+            autosave.clear(request.user, None)
             if post.status == 'draft':
                 messages.success(request, 'Your draft has been saved!')
             else:
@@ -186,19 +239,30 @@ def create_post(request):
     context = {
         'form': form,
         'title': 'New Post',
+        'autosave': autosave.editor_state(request.user, None),
     }
     
     return render(request, 'blog/post_form.html', context)
 
 def post_detail(request, pk):
-    post = get_object_or_404(BlogPost, pk=pk)
-    
-    # Increment view count
-    post.view_count += 1
-    post.save()
+    # Views are counted ahead of the conditional check, so a reader whose
+    # copy is answered with 304 Not Modified still counts
+    if not warmup.is_warmup(request):
+        # Increment view count without touching updated_at
+        if BlogPost.objects.filter(pk=pk).update(view_count=F('view_count') + 1):
+            record_view(request, BlogPost(pk=pk))
+    return _post_detail_page(request, pk)
+
+@condition(etag_func=conditional.post_etag, last_modified_func=conditional.post_last_modified)
+def _post_detail_page(request, pk):
+    post = BlogPost.objects.filter(pk=pk).first()
+    if post is None:
+        # Old posts moved to the archive keep their URL
+        return archived_post_detail(request, pk)
     
-    # Get comments (top-level only)
-    comments = post.comments.filter(parent=None).order_by('created_at')
+    # First page of comment threads from the shared fragment cache; the
+    # rest is loaded from comment_page
+    comment_threads = comment_cache.render_threads(post)
     
     # Check if user has liked or disliked
     is_liked = False
@@ -225,7 +289,11 @@ def post_detail(request, pk):
     
     context = {
         'post': post,
-        'comments': comments,
+        'comment_threads': comment_threads,
+        'more_comments_url': (
+            comment_cache.threads_url(post.pk, comment_threads.next_cursor) if comment_threads.has_next else None
+        ),
+        'comment_reactions': comment_cache.viewer_reactions(request.user, post),
         'comment_form': comment_form,
         'reply_form': reply_form,
         'is_liked': is_liked,
@@ -236,6 +304,43 @@ def post_detail(request, pk):
     
     return render(request, 'blog/post_detail.html', context)
 
+@require_GET
+def comment_page(request, pk):
+    # "Load more" for a post's comment threads, or with ?thread= for the
+    # further replies of one thread
+    post = get_object_or_404(BlogPost, pk=pk)
+    cursor = request.GET.get('cursor')
+    thread = request.GET.get('thread')
+    if thread is not None:
+        if not (thread.isascii() and thread.isdigit()):
+            return JsonResponse({'error': 'thread must be an integer'}, status=400)
+        page = comment_cache.render_replies(post, int(thread), cursor)
+        next_url = comment_cache.replies_url(post.pk, thread, page.next_cursor) if page.has_next else None
+        return JsonResponse({'html': page.items, 'next': next_url})
+    
+    page = comment_cache.render_threads(post, cursor)
+    next_url = comment_cache.threads_url(post.pk, page.next_cursor) if page.has_next else None
+    return JsonResponse({'html': ''.join(page), 'next': next_url})
+
+def archived_post_detail(request, pk):
+    post = get_object_or_404(ArchivedPost.objects.select_related('author', 'category'), pk=pk)
+    
+    # Thread the comments in memory; archived posts are read-only
+    comments = list(post.comments.select_related('author').order_by('created_at'))
+    replies = {}
+    for comment in comments:
+        replies.setdefault(comment.parent_id, []).append(comment)
+    for comment in comments:
+        comment.thread = replies.get(comment.pk, [])
+    
+    context = {
+        'post': post,
+        'tags': Tag.objects.filter(pk__in=post.tag_ids).order_by('name'),
+        'comments': replies.get(None, []),
+        'comment_count': len(comments),
+    }
+    return render(request, 'blog/archived_post.html', context)
+
 @login_required
 def edit_post(request, pk):
     post = get_object_or_404(BlogPost, pk=pk)
@@ -246,6 +351,8 @@ def edit_post(request, pk):
         return redirect('post_detail', pk=post.pk)
     
     if request.method == 'POST':
+        # Keep the text being replaced if the post has no history yet
+        revisions.ensure_baseline(post)
         form = BlogPostForm(request.POST, instance=post)
         if form.is_valid():
             post = form.save(commit=False)
@@ -255,6 +362,8 @@ def edit_post(request, pk):
             # The form.save_m2m() will handle the tags
             form.save_m2m()
             
+            revisions.record(post, request.user)
+            autosave.clear(request.user, post)
             messages.success(request, 'Your blog post has been updated!')
             return redirect('post_detail', pk=post.pk)
     else:
@@ -264,10 +373,100 @@ def edit_post(request, pk):
         'form': form,
         'title': 'Edit Post',
         'post': post,
+        'autosave': autosave.editor_state(request.user, post),
     }
     
     return render(request, 'blog/post_form.html', context)
 
+def _revisable_post(request, pk):
+    # Revision history is open to the author and to moderators
+    post = get_object_or_404(BlogPost, pk=pk)
+    if post.author != request.user and not request.user.is_superuser:
+        return None
+    return post
+
+@login_required
+def post_history(request, pk):
+    post = _revisable_post(request, pk)
+    if post is None:
+        messages.error(request, 'You are not authorized to view this history.')
+        return redirect('post_detail', pk=pk)
+    
+    history = post.revisions.select_related('editor').defer('data').order_by('-number')
+    context = {
+        'post': post,
+        'revisions': history,
+    }
+    return render(request, 'blog/post_history.html', context)
+
+@login_required
+def revision_diff(request, pk, number):
+    post = _revisable_post(request, pk)
+    if post is None:
+        messages.error(request, 'You are not authorized to view this history.')
+        return redirect('post_detail', pk=pk)
+    
+    against = request.GET.get('against', '')
+    against = int(against) if against.isascii() and against.isdigit() else number - 1
+    try:
+        if against < 1 or not post.revisions.filter(number=against).exists():
+            diff = ''.join(f'+{line}' for line in revisions.content_at(post, number).splitlines(keepends=True))
+            against = None
+        else:
+            diff = revisions.diff(post, against, number)
+    except PostRevision.DoesNotExist:
+        raise Http404('No such revision')
+    
+    context = {
+        'post': post,
+        'number': number,
+        'against': against,
+        'diff_lines': diff.splitlines(),
+    }
+    return render(request, 'blog/revision_diff.html', context)
+
+@login_required
+@require_POST
+def restore_revision(request, pk, number):
+    post = _revisable_post(request, pk)
+    if post is None:
+        messages.error(request, 'You are not authorized to restore this post.')
+        return redirect('post_detail', pk=pk)
+    
+    try:
+        revisions.restore(post, number, request.user)
+    except PostRevision.DoesNotExist:
+        raise Http404('No such revision')
+    messages.success(request, f'Restored revision {number}.')
+    return redirect('post_history', pk=pk)
+
+@login_required
+@require_POST
+def autosave_draft(request):
+    # Applies editor splices to the author's draft; see blog/autosave.py
+    try:
+        data = json.loads(request.body)
+        version = int(data.get('version'))
+        patch = data.get('patch') or []
+        if not isinstance(patch, list):
+            raise ValueError
+        post_id = int(data['post']) if data.get('post') else None
+    except (ValueError, TypeError, AttributeError):
+        return JsonResponse({'error': 'Expected a JSON body with version and patch'}, status=400)
+    
+    post = None
+    if post_id is not None:
+        post = get_object_or_404(BlogPost, pk=post_id, author=request.user)
+    
+    try:
+        current = autosave.save(request.user, post, version, patch, data.get('title'), bool(data.get('flush')))
+    except autosave.Conflict as conflict:
+        return JsonResponse({'error': str(conflict), 'version': conflict.version, 'length': conflict.length}, status=409)
+    except autosave.InvalidPatch as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    
+    return JsonResponse({'version': current['version'], 'saved': current['version'] == current['saved_version']})
+
 @login_required
 def delete_post(request, pk):
     post = get_object_or_404(BlogPost, pk=pk)
@@ -307,7 +506,9 @@ def add_comment(request, post_pk):
 def reply_to_comment(request, comment_pk):
     parent_comment = get_object_or_404(Comment, pk=comment_pk)
     
-    if request.method == 'POST':
+    if not parent_comment.can_reply():
+        messages.error(request, 'This thread is too deep to reply to.')
+    elif request.method == 'POST':
         form = ReplyForm(request.POST)
         if form.is_valid():
             reply = form.save(commit=False)
@@ -431,6 +632,7 @@ def dislike_comment(request, pk):
     
     return redirect('post_detail', pk=comment.post.pk)
 
+@condition(etag_func=conditional.category_etag, last_modified_func=conditional.category_last_modified)
 def category_posts(request, name):
     category = get_object_or_404(Category, name=name)
     posts = BlogPost.objects.filter(category=category, status='published').order_by('-created_at')
@@ -446,6 +648,7 @@ def category_posts(request, name):
     
     return render(request, 'blog/category_posts.html', context)
 
+@condition(etag_func=conditional.tag_etag, last_modified_func=conditional.tag_last_modified)
 def tag_posts(request, name):
     tag = get_object_or_404(Tag, name=name)
     posts = BlogPost.objects.filter(status='published', tags=tag).order_by('-created_at')
@@ -463,38 +666,48 @@ def tag_posts(request, name):
 
 def search_posts(request):
     search_form = SearchForm(request.GET)
-    results = []
+    query = request.GET.get('query', '')
+    selected = {
+        facet: {int(value) for value in request.GET.getlist(facet) if value.isascii() and value.isdigit()}
+        for facet in facets.FACETS
+    }
     
-    if 'query' in request.GET:
-        query = request.GET.get('query')
-        category_id = request.GET.get('category')
-        
-        if query:
-            # Base query
-            post_query = BlogPost.objects.filter(status='published')
-            
-            # Add category filter if selected
-            if category_id:
-                post_query = post_query.filter(category_id=category_id)
-            
-            # Search in title and content
-            results = post_query.filter(
-                Q(title__icontains=query) | 
-                Q(content__icontains=query)
-            ).order_by('-created_at')
+    ids = []
+    counts = {facet: [] for facet in facets.FACETS}
+    if query:
+        # Every match's id, newest first; facets narrow them down and are
+        # counted from them in memory
+        matches = BlogPost.objects.filter(status='published').filter(
+            Q(title__icontains=query) | 
+            Q(content__icontains=query)
+        ).order_by('-created_at')
+        ids, counts = facets.search(list(matches.values_list('pk', flat=True)), selected)
     
-    paginator = Paginator(results, 10)  # Show 10 posts per page
+    paginator = Paginator(ids, 10)  # Show 10 posts per page
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
+    posts = BlogPost.objects.select_related('author', 'category').in_bulk(page_obj.object_list)
+    page_obj.object_list = [posts[pk] for pk in page_obj.object_list if pk in posts]
+    
+    for facet, values in counts.items():
+        for value in values:
+            value['url'] = facets.toggle_url(request.GET, facet, value['id'])
     
     context = {
         'search_form': search_form,
         'page_obj': page_obj,
-        'query': request.GET.get('query', ''),
+        'query': query,
+        'facets': counts,
+        'page_query': facets.page_query(request.GET),
     }
     
     return render(request, 'blog/search_results.html', context)
 
+@require_GET
+def search_suggest(request):
+    # Navbar typeahead, answered from the in-memory index
+    return JsonResponse(typeahead.suggest(request.GET.get('q', '')[:100]))
+
 @login_required
 def admin_panel(request):
     # Check if user is superuser
@@ -511,6 +724,10 @@ def admin_panel(request):
     recent_comments = Comment.objects.order_by('-created_at')[:10]
     recent_users = User.objects.order_by('-date_joined')[:10]
     
+    # Database time per query fingerprint and per view, all processes
+    querylog.stats.flush()
+    query_entries, querylog_since = querylog.load()
+    
     context = {
         'total_users': total_users,
         'total_posts': total_posts,
@@ -518,6 +735,9 @@ def admin_panel(request):
         'recent_posts': recent_posts,
         'recent_comments': recent_comments,
         'recent_users': recent_users,
+        'top_queries': querylog.top_queries(query_entries),
+        'top_views': querylog.top_views(query_entries),
+        'querylog_since': querylog_since,
     }
     
     return render(request, 'blog/admin_panel.html', context)
@@ -579,6 +799,48 @@ def admin_users(request):
     
     return render(request, 'blog/admin_users.html', context)
 
+@login_required
+def admin_profiles(request):
+    # Check if user is superuser
+    if not request.user.is_superuser:
+        messages.error(request, 'You do not have permission to access this page.')
+        return redirect('home')
+    
+    token = profiling.profile_token(request.user)
+    context = {
+        'profiles': profiling.list_profiles(),
+        'profile_param': profiling.PARAM,
+        'profile_token': token,
+        'example_url': f"{reverse('home')}?{profiling.PARAM}={token}",
+        'sample_rate': profiling.sample_rate(),
+    }
+    
+    return render(request, 'blog/admin_profiles.html', context)
+
+@login_required
+def admin_profile_detail(request, profile_id):
+    # Check if user is superuser
+    if not request.user.is_superuser:
+        messages.error(request, 'You do not have permission to access this page.')
+        return redirect('home')
+    
+    profile = profiling.load(profile_id)
+    if profile is None:
+        raise Http404('No such profile')
+    
+    return render(request, 'blog/admin_profile_detail.html', {'profile': profile})
+
+@require_GET
+def prometheus_metrics(request):
+    # Scraped by Prometheus, which has to send METRICS_TOKEN as a bearer
+    # token; without a token the endpoint is only open under DEBUG
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if not token and not settings.DEBUG:
+        return HttpResponse('Set METRICS_TOKEN to enable metrics', status=403, content_type='text/plain')
+    if token and not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse('Unauthorized', status=401, content_type='text/plain')
+    return HttpResponse(metrics.render(metrics.load()), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 def logout_view(request):
     logout(request)
     messages.success(request, 'You have been successfully logged out.')
@@ -610,5 +872,33 @@ def create_tag(request):
 
 def get_tags(request):
     query = request.GET.get('query', '')
-    tags = Tag.objects.filter(name__icontains=query).values('id', 'name')[:10]
+    tags = Tag.objects.filter(name__icontains=query).order_by('-post_count', 'name').values('id', 'name')[:10]
     return JsonResponse(list(tags), safe=False)
+
+def tag_cloud(request):
+    limit = request.GET.get('limit', '')
+    limit = min(int(limit), 200) if limit.isascii() and limit.isdigit() else 50
+    return JsonResponse({
+        'tags': tag_stats.tag_cloud(limit=limit),
+        'trending': tag_stats.trending_tags(),
+    })
+
+
+def _sitemap_file(name, content_type):
+    # Served from disk as written by build_sitemaps; in production the web
+    # server can serve SITEMAP_ROOT directly
+    path = os.path.join(sitemaps.sitemap_root(), name)
+    try:
+        return FileResponse(open(path, 'rb'), content_type=content_type)
+    except FileNotFoundError:
+        raise Http404('Sitemap not built yet')
+
+
+def sitemap_index(request):
+    return _sitemap_file(sitemaps.INDEX, 'application/xml')
+
+
+def sitemap_shard(request, name):
+    if not sitemaps.SHARD_NAME.match(name):
+        raise Http404
+    return _sitemap_file(name, 'application/gzip')
@@ -0,0 +1,146 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connections
+from django.db.models import Count, Q
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import BlogPost, Category, Tag, ViewerSketch
+from .viewers import load_sketch
+
+# Cache warm-up after a deploy or restart.
+#
+# The home page, the hottest posts (most read overall, plus the most read
+# of those with recent comments or reactions) and the busiest category and
+# tag listings are requested through the full Django stack by a small pool
+# of threads. That fills the caches those pages read from (comment thread
+# fragments, trending tags, feeds, viewer sketches) and pulls their rows
+# into the database's buffer pool. Warm-up requests carry WARMUP_META,
+# which no HTTP client can set, and post_detail does not count them as
+# views.
+#
+# Only a shared cache backend (CACHES) keeps the keys for the web workers.
+# The default LocMemCache lives and dies with the warm_cache process, so
+# then only the database side stays warm and the command says so.
+
+WARMUP_META = 'blog.warmup'
+
+
+def is_warmup(request):
+    return request.META.get(WARMUP_META, False)
+
+
+def shared_cache():
+    # Whether keys written here outlive this process and reach the web workers
+    return not isinstance(caches[DEFAULT_CACHE_ALIAS], (LocMemCache, DummyCache))
+
+
+def hot_posts(limit, days):
+    published = BlogPost.objects.filter(status='published')
+    ids = list(published.order_by('-view_count', '-pk').values_list('pk', flat=True)[:limit])
+    since = timezone.now() - timedelta(days=days)
+    ids += (
+        published.filter(Q(comments_changed_at__gte=since) | Q(reactions_changed_at__gte=since))
+        .exclude(pk__in=ids).order_by('-view_count', '-pk').values_list('pk', flat=True)[:limit]
+    )
+    return ids
+
+
+def pages(posts=50, listings=20, days=7):
+    # (url, post id or None) of the pages to warm, hottest first
+    urls = [reverse('home'), reverse('feed_rss'), reverse('feed_atom'), reverse('tag_cloud')]
+    targets = [(url, None) for url in urls]
+    targets += [(reverse('post_detail', kwargs={'pk': pk}), pk) for pk in hot_posts(posts, days)]
+    categories = (
+        Category.objects.annotate(published=Count('posts', filter=Q(posts__status='published')))
+        .filter(published__gt=0).order_by('-published', 'name').values_list('name', flat=True)[:listings]
+    )
+    targets += [(reverse('category_posts', kwargs={'name': name}), None) for name in categories]
+    tags = Tag.objects.filter(post_count__gt=0).order_by('-post_count', 'name').values_list('name', flat=True)
+    targets += [(reverse('tag_posts', kwargs={'name': name}), None) for name in tags[:listings]]
+    return targets
+
+
+@contextmanager
+def _recording_writes(keys):
+    # Notes the keys this thread writes to the default cache; cache
+    # connections are per thread, so other threads are not affected
+    backend = caches[DEFAULT_CACHE_ALIAS]
+    set_, add, set_many = backend.set, backend.add, backend.set_many
+
+    def record_set(key, *args, **kwargs):
+        keys.add(key)
+        return set_(key, *args, **kwargs)
+
+    def record_add(key, *args, **kwargs):
+        added = add(key, *args, **kwargs)
+        if added:
+            keys.add(key)
+        return added
+
+    def record_set_many(data, *args, **kwargs):
+        failed = set_many(data, *args, **kwargs)
+        keys.update(key for key in data if key not in failed)
+        return failed
+
+    backend.set, backend.add, backend.set_many = record_set, record_add, record_set_many
+    try:
+        yield
+    finally:
+        del backend.set, backend.add, backend.set_many
+
+
+def _host():
+    hosts = [host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*']
+    return hosts[0] if hosts else 'localhost'
+
+
+def _warm_one(target):
+    # Returns (status, keys written)
+    url, post_id = target
+    keys = set()
+    with _recording_writes(keys):
+        client = Client(raise_request_exception=False, HTTP_HOST=_host(), **{WARMUP_META: True})
+        status = client.get(url).status_code
+        if post_id is not None and status == 200:
+            # Read by the view counting that warm-up requests skip
+            load_sketch(post_id, ViewerSketch.TOTAL)
+            load_sketch(post_id, timezone.now().date().isoformat())
+    return status, keys
+
+
+def _warm_in_worker(target):
+    try:
+        return _warm_one(target)
+    finally:
+        connections.close_all()
+
+
+def warm(targets, workers=4):
+    # Requests the pages with at most `workers` at a time; returns a dict
+    # of pages, failed (url, status) pairs, keys filled, whether the cache
+    # is shared with the web workers and elapsed seconds
+    started = time.perf_counter()
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_warm_in_worker, targets))
+    else:
+        results = [_warm_one(target) for target in targets]
+    keys = set()
+    failed = []
+    for (url, _), (status, written) in zip(targets, results):
+        keys |= written
+        if status != 200:
+            failed.append((url, status))
+    return {
+        'pages': len(targets), 'failed': failed, 'keys': len(keys), 'shared': shared_cache(),
+        'elapsed': time.perf_counter() - started,
+    }
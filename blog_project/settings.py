@@ -48,11 +48,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'blog.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'blog.querylog.QueryLogMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'blog.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -154,3 +157,62 @@ LOGIN_URL = 'login'
 ADMIN_SITE_HEADER = "Blogging Website Administration"
 ADMIN_SITE_TITLE = "Blogging Website Admin"
 ADMIN_SITE_INDEX_TITLE = "Welcome to Blogging Website Admin"
+
+# Background jobs (see blog/jobs.py and the run_jobs management command)
+# Set JOBS_RUN_INLINE to run handlers right after commit without a worker
+JOBS_RUN_INLINE = False
+JOBS_RETRY_BACKOFF = 10  # seconds, doubled on every retry
+
+# Public base URL used for absolute links outside a request (sitemaps)
+SITE_URL = 'http://localhost:8000'
+
+# Sharded sitemaps (see blog/sitemaps.py and the build_sitemaps command)
+SITEMAP_ROOT = os.path.join(BASE_DIR, 'sitemaps')
+SITEMAP_SHARD_SIZE = 10000  # primary keys per shard, at most 50000
+
+# Draft autosave: seconds between row writes for one editing session
+AUTOSAVE_WRITE_INTERVAL = 30
+
+# Revisions kept per post (see blog/revisions.py)
+POST_MAX_REVISIONS = 50
+
+# Live post updates over server-sent events (ASGI only, see blog/live.py)
+LIVE_BROKER = 'blog.live.InProcessBroker'
+LIVE_KEEPALIVE = 15  # seconds between keepalive comments on idle streams
+
+# Request profiling (see blog/profiling.py); superusers can also profile a
+# single request from the admin panel's Profiles page
+PROFILE_SAMPLE_RATE = 0.0  # fraction of all requests, e.g. 0.001
+PROFILE_ROOT = os.path.join(BASE_DIR, 'profiles')
+PROFILE_KEEP = 200
+
+# Per-view SQL statistics and slow-query log (see blog/querylog.py)
+QUERYLOG_ROOT = os.path.join(BASE_DIR, 'querylog')
+QUERYLOG_SLOW_MS = 100  # statements slower than this are logged with their stack
+QUERYLOG_FLUSH_INTERVAL = 60  # seconds between writes of a process's totals
+QUERYLOG_MAX_FINGERPRINTS = 500  # per process; the rest count as "other"
+
+# Request metrics for Prometheus, served at /metrics/ (see blog/metrics.py)
+METRICS_ROOT = os.path.join(BASE_DIR, 'metrics')
+METRICS_FLUSH_INTERVAL = 15  # seconds between writes of a process's counters
+METRICS_TOKEN = None  # scrapes must send "Authorization: Bearer <token>"; unset, /metrics/ only works under DEBUG
+
+# Navbar typeahead (see blog/typeahead.py)
+TYPEAHEAD_REFRESH = 600  # seconds between full rebuilds of a process's index
+
+# Search facet index (see blog/facets.py)
+FACETS_REFRESH = 300  # seconds before a process rebuilds its index regardless
+
+# Notification email digests (see blog/digests.py and the send_digests command);
+# point EMAIL_BACKEND at django.core.mail.backends.smtp.EmailBackend and set
+# EMAIL_HOST etc. in production
+EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+DEFAULT_FROM_EMAIL = 'Blog Site <noreply@localhost>'
+DIGEST_MAX_ITEMS = 20  # notifications listed per mail; the rest are only counted
+
+# Retention for the prune_rows command (see blog/retention.py), in days;
+# None keeps the rows forever
+NOTIFICATION_READ_RETENTION_DAYS = 90  # read notifications
+NOTIFICATION_PRUNE_WITHDRAWN = True  # follow/like notifications whose follow or like was undone
+JOB_RETENTION_DAYS = 14  # finished jobs; failed ones are kept
+TAG_ACTIVITY_RETENTION_DAYS = 90  # daily tag counts; trending reads the last 7 days